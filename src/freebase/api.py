@@ -1,17 +1,39 @@
 """
 The Freebase API module contains a set of functions for:
 1. transforming the Turtle format into N-triples RDF
-2. building MQL queries for an entity
-3. executing and processing the results of these queries
+2. building MQL queries for an entity, or batched queries which look
+   up many entities in a single request
+3. executing and processing the results of these queries, either one
+   by one or concurrently over a pool of keep-alive connections
+4. downloading topics in Turtle format
+
+Queries and downloads can be served from a ResponseCache (see
+src.freebase.cache), which is passed as the cache argument.
 """
 
 from collections import namedtuple
+import concurrent.futures
 import json
+import random
 import requests
+import requests.adapters
 import sys
+import time
+import urllib.parse
 from parse import *
+from src.freebase.turtle import PrefixIndex
 
 _PredicateObjectPair = namedtuple('_PredicateObjectPair', 'predicate, object')
+_QueryOutcome = namedtuple('_QueryOutcome', 'tuple_list, error')
+_QueryError = namedtuple('_QueryError', 'url, status_code, message')
+_BatchQuery = namedtuple('_BatchQuery', 'link, lang, entity_ids')
+
+# HTTP status codes after which a query is retried.
+_TRANSIENT_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
+# Default limit on the length of a batched query link. Longer links are
+# rejected by some servers and proxies.
+_MAX_URL_LENGTH = 4000
    
 def turtle_lines_to_rdf_lines(turtle_lines):
     """Transforms the Turtle format into N-Triples RDF."""
@@ -23,9 +45,10 @@ def turtle_lines_to_rdf_lines(turtle_lines):
             parse("@prefix {} <{}>.", line).fixed
             for line in prefix_lines
         ])
-    pt_dict =  {token[0]: token[1] for token in token_list}
+    prefix_index = PrefixIndex(
+        {token[0]: token[1] for token in token_list})
     
-    full_subject =_replace_prefix(subject, pt_dict)
+    full_subject = _replace_prefix(subject, prefix_index)
     po_pairs =_build_predicate_object_pairs(po_lines)
     
     full_triples = []
@@ -33,7 +56,7 @@ def turtle_lines_to_rdf_lines(turtle_lines):
         full_triple = (
             _format_as_rdf_line(
                 full_subject,
-                po_pair, pt_dict))
+                po_pair, prefix_index))
         full_triples.append(full_triple)
     return full_triples
     
@@ -64,40 +87,188 @@ def create_queries_for_entity(
         queries.append((mql_link, lang))
     return queries
            
-def execute_freebase_queries(queries):
+def create_batched_queries(
+    lang_list, predicate_url_list,
+    mql_service_url, api_key, entity_ids,
+    max_url_length=_MAX_URL_LENGTH):
+    """
+    Creates MQL array queries which look up the predicates of many
+    entities at once, by selecting the entities with a "mid|=" clause.
+    The entities are packed into as few queries per language as
+    possible, while keeping each request link at most max_url_length
+    characters long (a link holds at least one entity). The query of a
+    link is percent-encoded, so the link is sent as it is measured.
+
+    Returns a list of named tuples, each consisting of the request link,
+    the language code and the list of entity ID's in the query. The
+    queries of the first language come first.
+    """
+    query_dict = {'mid': 'null'}
+    for predicate in predicate_url_list:
+        query_dict[_predicate_url_to_mql_key(predicate)] = '[]'
+    queries = []
+    for lang in lang_list:
+        batch_ids = []
+        for entity_id in entity_ids:
+            # the link is measured as it is sent, with the entity added
+            link_length = len(_create_batched_request_link(
+                mql_service_url, api_key, query_dict,
+                batch_ids + [entity_id], lang))
+            if batch_ids and link_length > max_url_length:
+                queries.append(_create_batch_query(
+                    mql_service_url, api_key, query_dict, batch_ids, lang))
+                batch_ids = []
+            batch_ids.append(entity_id)
+        if batch_ids:
+            queries.append(_create_batch_query(
+                mql_service_url, api_key, query_dict, batch_ids, lang))
+    return queries
+
+def execute_batched_queries(
+    batch_queries, max_workers=8, max_retries=3, backoff=0.5,
+    session=None, timeout=30.0, cache=None):
+    """
+    Executes queries created by create_batched_queries concurrently, in
+    the same way as execute_queries_concurrently, and demultiplexes the
+    results by entity.
+
+    Returns a dict which maps each entity ID to a named tuple with the
+    tuple_list that execute_freebase_queries would return for the entity
+    alone, and an error, which is None if all queries of the entity
+    succeeded. Entities which the server did not return get an empty
+    tuple_list.
+    """
+    if session is None:
+        session = create_session(max_workers)
+    outcomes = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        futures = [
+            executor.submit(
+                _fetch_result, query.link, session,
+                max_retries, backoff, timeout, cache)
+            for query in batch_queries]
+        for query, future in zip(batch_queries, futures):
+            result, error = future.result()
+            if error is None:
+                tuple_lists = demultiplex_batch_result(result, query.lang)
+            else:
+                tuple_lists = {}
+            for entity_id in query.entity_ids:
+                tuple_list, entity_error = outcomes.get(
+                    entity_id, _QueryOutcome([], None))
+                tuple_list.extend(tuple_lists.get(entity_id, []))
+                if entity_error is None:
+                    entity_error = error
+                outcomes[entity_id] = _QueryOutcome(tuple_list, entity_error)
+    return outcomes
+
+def demultiplex_batch_result(result, query_lang):
+    """
+    Splits the result of a batched query into a dict, which maps entity
+    ID's to lists of (language, predicate key, object) tuples.
+    """
+    tuple_lists = {}
+    for entity_result in result:
+        entity_id = entity_result['mid'].lstrip('/').translate(
+            {ord('/'): '.'})
+        tuple_lists.setdefault(entity_id, []).extend(
+            _query_result_to_tuple_list(entity_result, query_lang))
+    return tuple_lists
+
+def execute_freebase_queries(queries, session=None, cache=None):
     """
     Executes a list of queries created by the create_queries_for_entity
     function. Returns a dict created by decoding the returned JSON and
-    parsing the results.
+    parsing the results. If a query fails, prints the error and exits
+    the application.
     """
-    tuple_list = []
-    for query in queries:
-        query_link = query[0]
-        query_lang = query[1]
-        http_reply = requests.get(query_link)
-        if http_reply.status_code == 400:
-            print("Request URL: {}".format(query_link))
-            print("Server response: bad request.")
-            print("Probably an invalid Google API key?")
-            print("Response data:")
-            print(http_reply.text)
-            sys.exit(2)
-        assert(http_reply.status_code == 200)
-        result = json.loads(http_reply.text)['result']
-        for predicate, object_list in result.items():
-            if predicate == "mid" or len(object_list) is 0:
-                continue
-            for object in object_list:
-                stripped_object = (
-                    object.lstrip('/').translate({ord('/'): '.'}))
-                encoded_object = (str(
-                    stripped_object
-                        .encode('utf-8'))
-                        .lstrip('b')
-                        .strip('\''))
-                tuple_list.append(
-                    (query_lang, predicate, encoded_object))
-    return tuple_list
+    outcome = _execute_entity_queries(
+        queries, session or requests.Session(), 0, 0.0, cache)
+    if outcome.error is not None:
+        print_query_error(outcome.error)
+        sys.exit(2)
+    return outcome.tuple_list
+
+def execute_queries_concurrently(
+    query_lists, max_workers=8, max_retries=3, backoff=0.5,
+    session=None, timeout=30.0, cache=None):
+    """
+    Executes several lists of queries (one list per entity, as created
+    by create_queries_for_entity) with up to max_workers queries in
+    flight, reusing pooled keep-alive connections. Queries which fail
+    with a connection error, a timeout or a transient HTTP status are
+    retried up to max_retries times, waiting backoff seconds before the
+    first retry and twice as long before every next one.
+
+    Returns a list of named tuples, one per query list and in the same
+    order, with the tuple_list that execute_freebase_queries would
+    return and an error, which is None if all queries of the list
+    succeeded. Errors are never raised and the application is never
+    exited.
+    """
+    if session is None:
+        session = create_session(max_workers)
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        futures = [
+            [
+                executor.submit(
+                    _execute_query, query, session,
+                    max_retries, backoff, timeout, cache)
+                for query in queries
+            ]
+            for queries in query_lists]
+        outcomes = []
+        for query_futures in futures:
+            tuple_list, error = [], None
+            for future in query_futures:
+                outcome = future.result()
+                tuple_list.extend(outcome.tuple_list)
+                if error is None:
+                    error = outcome.error
+            outcomes.append(_QueryOutcome(tuple_list, error))
+    return outcomes
+
+def create_session(pool_size=8):
+    """
+    Creates a requests session which keeps up to pool_size connections
+    per host alive.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def download_turtle_lines(rdf_url, session=None, cache=None):
+    """
+    Downloads a topic in Turtle format from a link created by the
+    create_turtle_download_link function. Returns the list of lines and
+    None, or None and an error, which can be printed with
+    print_query_error.
+    """
+    if cache is not None:
+        text = cache.get(rdf_url)
+        if text is not None:
+            return text.split('\n'), None
+        if cache.offline:
+            return None, _offline_error(rdf_url)
+    http_reply = (session or requests).get(rdf_url)
+    if http_reply.status_code != 200:
+        return None, _QueryError(
+            rdf_url, http_reply.status_code, http_reply.text)
+    if cache is not None:
+        cache.put(rdf_url, http_reply.text)
+    return http_reply.text.split('\n'), None
+
+def print_query_error(error):
+    """Prints an error returned by execute_queries_concurrently."""
+    print("Request URL: {}".format(error.url))
+    if error.status_code == 400:
+        print("Server response: bad request.")
+        print("Probably an invalid Google API key?")
+    print("Response data:")
+    print(error.message)
     
 def create_turtle_download_link(rdf_service_url, api_key, topic_id):
     """Creates an RDF download link for the specified topic ID."""
@@ -130,8 +301,10 @@ def _create_mql_query_string(input_dict):
         query += '\"{key}\":'.format(key=key)
         if (val == '[]' or val == 'null'):
             query += val
-        else:
+        elif isinstance(val, str):
             query += '\"' + val + '\"'
+        else:
+            query += json.dumps(val, separators=(',', ':'))
         query += ','
     return query[:-1] + '}'
 
@@ -151,6 +324,30 @@ def _create_mql_request_link(mql_service_url, api_key, input_dict, lang = 'en'):
                 query_string,
                 lang, api_key))
     
+def _create_batch_query(
+    mql_service_url, api_key, input_dict, entity_ids, lang):
+    return _BatchQuery(
+        _create_batched_request_link(
+            mql_service_url, api_key, input_dict, entity_ids, lang),
+        lang, entity_ids)
+
+def _create_batched_request_link(
+    mql_service_url, api_key, input_dict, entity_ids, lang):
+    batch_dict = dict(input_dict)
+    batch_dict['mid|='] = [
+        '/' + entity_id.translate({ord('.'): '/'})
+        for entity_id in entity_ids]
+    # the default limit of MQL array results is 100
+    batch_dict['limit'] = len(entity_ids)
+    query_string = '[' + _create_mql_query_string(batch_dict) + ']'
+    # encoded here, as requests would only encode some of the characters
+    return ("{}read?query={}&lang={}&key={}"
+            .format(
+                mql_service_url,
+                urllib.parse.quote(query_string, safe=''),
+                urllib.parse.quote('/lang/' + lang),
+                urllib.parse.quote(api_key, safe='')))
+
 def _build_predicate_object_pairs(predicate_object_lines):
     token_list = [line.strip().split(None, 1)
                  for line in predicate_object_lines]
@@ -162,17 +359,10 @@ def _build_predicate_object_pairs(predicate_object_lines):
             for token in token_list
         ])
 
-def _replace_prefix(str, prefix_translation_dict):
-    for p, r in prefix_translation_dict.items():
-        if str.startswith(p):
-            prefix, replacement = p, r
-            break
-    else:
-        prefix, replacement = None, None
-    return (str if prefix is None
-            else str
-                .replace(prefix, replacement)
-                .rstrip()) # remove newline
+def _replace_prefix(str, prefix_index):
+    expanded = prefix_index.expand(str)
+    return (str if expanded is None
+            else expanded.rstrip()) # remove newline
 
 def _tag_as_link_if_http(str):
     if str.startswith('http://'):
@@ -180,10 +370,10 @@ def _tag_as_link_if_http(str):
     else:
         return str
 
-def _format_as_rdf_line(subject, po_pair, pt_dict):
+def _format_as_rdf_line(subject, po_pair, prefix_index):
     # expand prefixes
-    predicate =_replace_prefix(po_pair.predicate, pt_dict)
-    object =_replace_prefix(po_pair.object, pt_dict)
+    predicate = _replace_prefix(po_pair.predicate, prefix_index)
+    object = _replace_prefix(po_pair.object, prefix_index)
     # format as valid links
     rdf_subject = _tag_as_link_if_http(subject)
     rdf_predicate = _tag_as_link_if_http(predicate)
@@ -191,6 +381,81 @@ def _format_as_rdf_line(subject, po_pair, pt_dict):
     return '{}\t.\n'.format(
         '\t'.join([rdf_subject, rdf_predicate, rdf_object]))
 
+def _execute_entity_queries(queries, session, max_retries, backoff, cache):
+    tuple_list = []
+    for query in queries:
+        outcome = _execute_query(
+            query, session, max_retries, backoff, cache=cache)
+        if outcome.error is not None:
+            return _QueryOutcome(tuple_list, outcome.error)
+        tuple_list.extend(outcome.tuple_list)
+    return _QueryOutcome(tuple_list, None)
+
+def _execute_query(query, session, max_retries, backoff, timeout=30.0,
+                   cache=None):
+    query_link = query[0]
+    query_lang = query[1]
+    result, error = _fetch_result(
+        query_link, session, max_retries, backoff, timeout, cache)
+    if error is not None:
+        return _QueryOutcome([], error)
+    return _QueryOutcome(_query_result_to_tuple_list(result, query_lang), None)
+
+def _fetch_result(query_link, session, max_retries, backoff, timeout,
+                  cache=None):
+    # Returns the decoded result of a query and None, or None and an
+    # error.
+    if cache is not None:
+        text = cache.get(query_link)
+        if text is not None:
+            return json.loads(text)['result'], None
+        if cache.offline:
+            return None, _offline_error(query_link)
+    for attempt in range(max_retries + 1):
+        if attempt > 0:
+            # exponential backoff with some jitter
+            time.sleep(backoff * 2 ** (attempt - 1) * random.uniform(1, 1.5))
+        try:
+            http_reply = session.get(query_link, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout) as exception:
+            error = _QueryError(query_link, None, str(exception))
+            continue
+        if http_reply.status_code == 200:
+            try:
+                result = json.loads(http_reply.text)['result']
+            except (ValueError, KeyError):
+                return None, _QueryError(
+                    query_link, http_reply.status_code,
+                    "malformed response: {}".format(http_reply.text))
+            if cache is not None:
+                cache.put(query_link, http_reply.text)
+            return result, None
+        error = _QueryError(
+            query_link, http_reply.status_code, http_reply.text)
+        if http_reply.status_code not in _TRANSIENT_STATUS_CODES:
+            break
+    return None, error
+
+def _offline_error(url):
+    return _QueryError(url, None, "not in the response cache (offline)")
+
+def _query_result_to_tuple_list(result, query_lang):
+    tuple_list = []
+    for predicate, object_list in result.items():
+        if predicate == "mid" or len(object_list) == 0:
+            continue
+        for object in object_list:
+            stripped_object = (
+                object.lstrip('/').translate({ord('/'): '.'}))
+            encoded_object = (str(
+                stripped_object
+                    .encode('utf-8'))
+                    .lstrip('b')
+                    .strip('\''))
+            tuple_list.append(
+                (query_lang, predicate, encoded_object))
+    return tuple_list
+
 def _split_turtle_lines(turtle_lines):
     # Prefix lines end at the first empty line.
     prefix_lines_end = turtle_lines.index("")
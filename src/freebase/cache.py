@@ -0,0 +1,191 @@
+"""
+The Freebase cache module stores the responses of the Freebase API (MQL
+query results and Turtle downloads) in a SQLite database on disk, so
+that repeated runs of the test suite do not download the same topics
+again. Responses are keyed by a hash of the normalized request URL, in
+which the API key is left out, so that the cache can be shared between
+keys. Bodies are stored compressed.
+
+The cache is bounded by an age (ttl_seconds) and a total size of the
+compressed bodies (max_bytes), beyond which the least recently used
+responses are evicted. In offline mode, requests are served only from
+the cache, including expired responses, and are never sent.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+import zlib
+
+class ResponseCache:
+    """
+    A size bounded LRU cache of response bodies, stored in the SQLite
+    database file_name. If ttl_seconds is None, responses never expire,
+    and if max_bytes is None, the cache is not bounded. The numbers of
+    hits, misses and evictions are counted in the attributes with these
+    names. The cache can be used from several threads.
+    """
+    def __init__(self, file_name, ttl_seconds=None, max_bytes=None,
+                 offline=False):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        directory = os.path.dirname(file_name)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            file_name, check_same_thread=False, isolation_level=None)
+        # a lost access time or response is harmless, so the database
+        # is not synced after every change
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute("PRAGMA synchronous = NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, url TEXT, body BLOB, size INTEGER, "
+            "created REAL, accessed REAL)")
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed "
+            "ON responses (accessed)")
+        self._total_size = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get(self, url):
+        """
+        Returns the cached response body of a URL as a string, or None
+        if it is not cached or has expired.
+        """
+        key = cache_key(url)
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT body, created FROM responses WHERE key = ?",
+                (key,)).fetchone()
+            if row is not None and not self.offline and self._expired(
+                    row[1], now):
+                self._delete(key)
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._connection.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?",
+                (now, key))
+            self.hits += 1
+        return zlib.decompress(row[0]).decode('utf-8')
+
+    def put(self, url, body):
+        """
+        Stores the response body (a string) of a URL, evicting the least
+        recently used responses if the cache grows beyond max_bytes.
+        """
+        key = cache_key(url)
+        compressed_body = zlib.compress(body.encode('utf-8'))
+        now = time.time()
+        with self._lock:
+            self._delete(key)
+            self._connection.execute(
+                "INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, normalize_url(url), compressed_body,
+                 len(compressed_body), now, now))
+            self._total_size += len(compressed_body)
+            self._evict()
+
+    def stats(self):
+        """Returns a dict with the counters and the size of the cache."""
+        with self._lock:
+            count = self._connection.execute(
+                "SELECT COUNT(*) FROM responses").fetchone()[0]
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'responses': count,
+                'bytes': self._total_size,
+            }
+
+    def close(self):
+        """Closes the database."""
+        self._connection.close()
+
+    def _expired(self, created, now):
+        return (
+            self.ttl_seconds is not None
+            and now - created > self.ttl_seconds)
+
+    def _delete(self, key):
+        row = self._connection.execute(
+            "SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self._connection.execute(
+                "DELETE FROM responses WHERE key = ?", (key,))
+            self._total_size -= row[0]
+
+    def _evict(self):
+        if self.max_bytes is None:
+            return
+        while self._total_size > self.max_bytes:
+            rows = self._connection.execute(
+                "SELECT key, size FROM responses "
+                "ORDER BY accessed LIMIT 64").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self._total_size <= self.max_bytes:
+                    break
+                self._connection.execute(
+                    "DELETE FROM responses WHERE key = ?", (key,))
+                self._total_size -= size
+                self.evictions += 1
+
+def open_response_cache(cache_config, offline=None):
+    """
+    Opens the response cache described by the 'response_cache' entry of
+    a configuration dict, for example:
+
+    {"file": "data/response_cache.sqlite", "ttl_seconds": 604800,
+     "max_bytes": 268435456, "offline": false}
+
+    Returns None if cache_config is None. If offline is not None, it
+    overrides the 'offline' entry.
+    """
+    if cache_config is None:
+        return None
+    if offline is None:
+        offline = cache_config.get('offline', False)
+    return ResponseCache(
+        cache_config['file'],
+        cache_config.get('ttl_seconds', None),
+        cache_config.get('max_bytes', None),
+        offline)
+
+def normalize_url(url):
+    """
+    Normalizes a request URL: lowercases the scheme and the host, drops
+    the API key and sorts the query parameters.
+    """
+    parts = urllib.parse.urlsplit(url)
+    parameters = sorted(
+        (name, value)
+        for name, value in urllib.parse.parse_qsl(
+            parts.query, keep_blank_values=True)
+        if name != 'key')
+    return urllib.parse.urlunsplit((
+        parts.scheme.lower(), parts.netloc.lower(), parts.path,
+        urllib.parse.urlencode(parameters), ''))
+
+def cache_key(url):
+    """Returns the key of a URL in the cache, a hash of the normalized URL."""
+    return hashlib.sha256(normalize_url(url).encode('utf-8')).hexdigest()
@@ -0,0 +1,96 @@
+"""
+The Freebase checkpoint module records the progress of an extraction
+run in a small JSON file, so that a run which was interrupted can be
+resumed instead of starting over. A checkpoint contains:
+- the name of the input file,
+- input_offset, the number of decompressed input bytes up to the last
+  completed entity,
+- dump_position, the position in the (compressed) dump file at the
+  time of the checkpoint,
+- last_subject, the subject of the last completed entity,
+- output_lengths, the lengths of the output files up to that entity,
+- line_count and entity_count, the numbers of processed lines and
+  written entities.
+
+Gzip and zstd streams cannot be entered in the middle, so a resumed
+run decompresses (but does not parse) the input up to input_offset.
+Uncompressed input is seeked directly.
+"""
+
+import json
+import os
+import time
+
+def load_checkpoint(file_name):
+    """
+    Loads a checkpoint dict from a file. Returns None if the file does
+    not exist.
+    """
+    try:
+        with open(file_name, 'rt') as checkpoint_file:
+            return json.loads(checkpoint_file.read())
+    except FileNotFoundError:
+        return None
+
+class Checkpointer:
+    """
+    Writes a checkpoint at most every every_seconds seconds while chunks
+    of the input are processed (a non-positive value disables it). The
+    checkpoint is written after the outputs of a chunk were flushed, and
+    it replaces the previous checkpoint atomically. The counts start
+    from the given state, which is a dict loaded by load_checkpoint.
+    """
+    def __init__(self, file_name, input_file_name, input_file, output_files,
+                 every_seconds=300.0, state=None):
+        self._file_name = file_name
+        self._input_file = input_file
+        self._output_files = output_files
+        self._every_seconds = every_seconds
+        self._last_save = time.time()
+        self.state = {
+            'input_file_name': input_file_name,
+            'input_offset': 0,
+            'dump_position': 0,
+            'last_subject': None,
+            'output_lengths': [0 for _ in output_files],
+            'line_count': 0,
+            'entity_count': 0,
+        }
+        if state is not None:
+            self.state.update(state)
+
+    def chunk_done(self, byte_count, line_count, entity_count, last_subject):
+        """
+        Records that a chunk of input lines was processed and its output
+        was written, and saves a checkpoint if one is due.
+        """
+        self.state['input_offset'] += byte_count
+        self.state['line_count'] += line_count
+        self.state['entity_count'] += entity_count
+        if last_subject is not None:
+            self.state['last_subject'] = last_subject
+        if (self._every_seconds > 0
+            and time.time() - self._last_save >= self._every_seconds):
+            self.save()
+
+    def save(self):
+        """Flushes the output files and writes the checkpoint."""
+        for output_file in self._output_files:
+            output_file.sync()
+        self.state['output_lengths'] = [
+            output_file.bytes_written for output_file in self._output_files]
+        dump_file = self._input_file.dump_file
+        self.state['dump_position'] = os.lseek(
+            dump_file.fileno(), 0, os.SEEK_CUR)
+        temporary_file_name = self._file_name + '.tmp'
+        with open(temporary_file_name, 'wt') as checkpoint_file:
+            checkpoint_file.write(json.dumps(self.state, indent=4))
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(temporary_file_name, self._file_name)
+        self._last_save = time.time()
+
+    def finish(self):
+        """Removes the checkpoint after the run has completed."""
+        if os.path.isfile(self._file_name):
+            os.remove(self._file_name)
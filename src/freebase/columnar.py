@@ -0,0 +1,340 @@
+"""
+The Freebase columnar module contains a compact binary alternative to
+the tab separated output of the extraction. A columnar file holds the
+same rows (subject, predicate ID, object, language), as a sequence of
+self-contained chunks, one per written batch of entities. In a chunk:
+- predicate ID's and languages are dictionary encoded as small integers,
+  with the dictionaries stored in the chunk,
+- subjects are stored once per entity, with the range of the entity's
+  rows,
+- subjects and objects are stored as offsets into a block of string
+  data,
+- every column can be compressed with zlib.
+
+Because chunks are only ever appended whole, a columnar file can be
+truncated to the length recorded in a checkpoint, like the text output.
+
+The reader memory-maps a file, so that a column of an uncompressed chunk
+is a memoryview of the file, without copying or parsing it.
+"""
+
+import array
+import itertools
+import mmap
+import struct
+import sys
+import zlib
+from src.freebase.writer import escape_field
+
+_MAGIC = b'FBC1'
+_VERSION = 1
+
+_COMPRESSION_CODES = {None: 0, 'zlib': 1}
+
+# magic, version, compression, predicate code width, lang code width,
+# entity count, row count, dictionary length, chunk length
+_CHUNK_HEADER = struct.Struct('<4sBBBBIIII')
+
+# stored and original length of every column
+_COLUMN_LENGTH = struct.Struct('<II')
+
+COLUMN_NAMES = (
+    'entity_row_starts',
+    'subject_offsets',
+    'subject_data',
+    'predicate_codes',
+    'lang_codes',
+    'object_offsets',
+    'object_data',
+)
+
+_OFFSET_COLUMNS = frozenset(
+    ['entity_row_starts', 'subject_offsets', 'object_offsets'])
+
+_ALIGNMENT = 8
+
+def encode_chunk(entities, compression=None):
+    """
+    Encodes a list of entities, given as lists of rows of strings
+    (subject, predicate ID, object, language), into a columnar chunk.
+    The rows of an entity share its subject. Returns the chunk as bytes,
+    or empty bytes if there are no entities. The compression is None or
+    'zlib'.
+    """
+    if not entities:
+        return b''
+    predicate_codes = {}
+    lang_codes = {}
+    entity_row_starts = array.array('I', [0])
+    subject_offsets = array.array('I', [0])
+    subject_data = bytearray()
+    predicates = []
+    langs = []
+    object_offsets = array.array('I', [0])
+    object_data = bytearray()
+    for rows in entities:
+        subject_data += rows[0][0].encode('utf-8')
+        subject_offsets.append(len(subject_data))
+        for _, predicate_id, object, lang in rows:
+            predicates.append(predicate_codes.setdefault(
+                predicate_id, len(predicate_codes)))
+            langs.append(lang_codes.setdefault(lang, len(lang_codes)))
+            object_data += object.encode('utf-8')
+            object_offsets.append(len(object_data))
+        entity_row_starts.append(len(predicates))
+    predicate_width = 1 if len(predicate_codes) <= 256 else 2
+    lang_width = 1 if len(lang_codes) <= 256 else 2
+    columns = [
+        _little_endian(entity_row_starts),
+        _little_endian(subject_offsets),
+        bytes(subject_data),
+        _little_endian(
+            array.array(_code_type(predicate_width), predicates)),
+        _little_endian(array.array(_code_type(lang_width), langs)),
+        _little_endian(object_offsets),
+        bytes(object_data),
+    ]
+    dictionary = (
+        '\t'.join(predicate_codes) + '\n' + '\t'.join(lang_codes)
+    ).encode('utf-8')
+    stored_columns = [
+        column if compression is None else zlib.compress(column)
+        for column in columns]
+    parts = [b'', b''.join(
+        _COLUMN_LENGTH.pack(len(stored), len(column))
+        for stored, column in zip(stored_columns, columns))]
+    parts.append(_pad(dictionary))
+    parts.extend(_pad(column) for column in stored_columns)
+    chunk_length = _CHUNK_HEADER.size + sum(map(len, parts))
+    parts[0] = _CHUNK_HEADER.pack(
+        _MAGIC, _VERSION, _COMPRESSION_CODES[compression],
+        predicate_width, lang_width, len(entities), len(predicates),
+        len(dictionary), chunk_length)
+    return b''.join(parts)
+
+def triples_to_rows(localized_triples):
+    """
+    Transforms the localized triples of an entity into rows for
+    encode_chunk, with the subjects and objects escaped as in the text
+    output (see src.freebase.writer.triples_to_string).
+    """
+    return [
+        (escape_field(t[0]), t[1], escape_field(t[2]), t[3])
+        for t in localized_triples]
+
+class ColumnarFile:
+    """
+    A columnar file opened for reading. The file is memory-mapped and
+    its chunks are available as the chunks attribute, a list of
+    ColumnarChunk objects. The number of rows is len(file).
+
+    A chunk at the end of the file which is not complete, because the
+    file is being written or was cut short, is left out. The length of
+    the complete chunks is the length attribute.
+    """
+    def __init__(self, file_name):
+        self._file = open(file_name, 'rb')
+        self._mmap = None
+        self.chunks = []
+        self.entity_count = 0
+        self.length = 0
+        self._row_count = 0
+        try:
+            self._mmap = mmap.mmap(
+                self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # an empty file cannot be mapped
+            return
+        buffer = memoryview(self._mmap)
+        position = 0
+        while len(buffer) - position >= _CHUNK_HEADER.size:
+            chunk_length = _CHUNK_HEADER.unpack_from(buffer, position)[-1]
+            if position + chunk_length > len(buffer):
+                break
+            chunk = ColumnarChunk(buffer, position)
+            self.chunks.append(chunk)
+            self.entity_count += chunk.entity_count
+            self._row_count += chunk.row_count
+            position += chunk.length
+        self.length = position
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self._row_count
+
+    def rows(self):
+        """
+        Yields all rows of the file as (subject, predicate ID, object,
+        language) tuples of strings.
+        """
+        for chunk in self.chunks:
+            yield from chunk.rows()
+
+    def close(self):
+        """
+        Closes the file. Memoryviews of its columns must be released
+        before.
+        """
+        for chunk in self.chunks:
+            chunk.release()
+        self.chunks = []
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+class ColumnarChunk:
+    """
+    A chunk of a columnar file, which starts at the given offset of a
+    buffer. The dictionaries of the chunk are the predicate_ids and
+    langs lists, indexed by the predicate and language codes.
+    """
+    def __init__(self, buffer, offset):
+        (magic, version, compression, predicate_width, lang_width,
+         self.entity_count, self.row_count, dictionary_length,
+         self.length) = _CHUNK_HEADER.unpack_from(buffer, offset)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(
+                "not a columnar chunk at offset {}".format(offset))
+        self.compressed = compression != 0
+        self._buffer = buffer[offset:offset + self.length]
+        self._code_types = {
+            'predicate_codes': _code_type(predicate_width),
+            'lang_codes': _code_type(lang_width),
+        }
+        position = _CHUNK_HEADER.size
+        lengths = []
+        for _ in COLUMN_NAMES:
+            lengths.append(
+                _COLUMN_LENGTH.unpack_from(self._buffer, position))
+            position += _COLUMN_LENGTH.size
+        dictionary = bytes(
+            self._buffer[position:position + dictionary_length])
+        predicate_ids, langs = dictionary.decode('utf-8').split('\n')
+        self.predicate_ids = predicate_ids.split('\t')
+        self.langs = langs.split('\t')
+        position += _padded_length(dictionary_length)
+        self._column_ranges = {}
+        for name, (stored_length, _) in zip(COLUMN_NAMES, lengths):
+            self._column_ranges[name] = (position, position + stored_length)
+            position += _padded_length(stored_length)
+        self._columns = {}
+
+    def column(self, name):
+        """
+        Returns a column by its name (see COLUMN_NAMES): a memoryview of
+        unsigned integers for the offsets and codes, and of bytes for
+        the string data. The columns of uncompressed chunks are views of
+        the mapped file (on little-endian machines), those of compressed
+        chunks are decompressed when they are first accessed.
+        """
+        column = self._columns.get(name, None)
+        if column is None:
+            begin, end = self._column_ranges[name]
+            data = self._buffer[begin:end]
+            if self.compressed:
+                data = memoryview(zlib.decompress(data))
+            type_code = (
+                'I' if name in _OFFSET_COLUMNS
+                else self._code_types.get(name, 'B'))
+            if type_code != 'B':
+                if sys.byteorder == 'little':
+                    data = data.cast(type_code)
+                else:
+                    values = array.array(type_code, data)
+                    values.byteswap()
+                    data = memoryview(values)
+            column = self._columns[name] = data
+        return column
+
+    def subject(self, entity_index):
+        """Returns the subject of an entity of the chunk by its index."""
+        offsets = self.column('subject_offsets')
+        return bytes(self.column('subject_data')[
+            offsets[entity_index]:offsets[entity_index + 1]]).decode('utf-8')
+
+    def entity_rows(self, entity_index):
+        """
+        Returns the rows of an entity of the chunk by its index, as
+        (subject, predicate ID, object, language) tuples.
+        """
+        row_starts = self.column('entity_row_starts')
+        return self._rows(
+            self.subject(entity_index),
+            row_starts[entity_index], row_starts[entity_index + 1])
+
+    def rows(self):
+        """Yields all rows of the chunk, see entity_rows."""
+        # decodes all strings of the chunk at once, which is much faster
+        # than accessing the entities one by one
+        subjects = self._strings('subject_offsets', 'subject_data')
+        objects = self._strings('object_offsets', 'object_data')
+        predicate_ids = [
+            self.predicate_ids[code]
+            for code in self.column('predicate_codes')]
+        langs = [self.langs[code] for code in self.column('lang_codes')]
+        row_starts = self.column('entity_row_starts')
+        for entity_index, subject in enumerate(subjects):
+            begin = row_starts[entity_index]
+            end = row_starts[entity_index + 1]
+            yield from zip(
+                itertools.repeat(subject, end - begin),
+                predicate_ids[begin:end], objects[begin:end],
+                langs[begin:end])
+
+    def release(self):
+        """Releases the views of the mapped file."""
+        for column in self._columns.values():
+            column.release()
+        self._columns = {}
+        self._buffer.release()
+
+    def _rows(self, subject, begin, end):
+        predicate_codes = self.column('predicate_codes')
+        lang_codes = self.column('lang_codes')
+        object_offsets = self.column('object_offsets')
+        object_data = self.column('object_data')
+        predicate_ids = self.predicate_ids
+        langs = self.langs
+        return [
+            (subject, predicate_ids[predicate_codes[row]],
+             bytes(object_data[
+                 object_offsets[row]:object_offsets[row + 1]]
+             ).decode('utf-8'),
+             langs[lang_codes[row]])
+            for row in range(begin, end)]
+
+    def _strings(self, offsets_name, data_name):
+        offsets = self.column(offsets_name)
+        data = bytes(self.column(data_name))
+        text = data.decode('utf-8')
+        if len(text) == len(data):
+            # ASCII, where the byte offsets are character offsets
+            return [
+                text[begin:end]
+                for begin, end in zip(offsets, offsets[1:])]
+        return [
+            data[begin:end].decode('utf-8')
+            for begin, end in zip(offsets, offsets[1:])]
+
+def is_columnar_file_name(file_name):
+    """Checks whether an output file name is that of a columnar file."""
+    return file_name.endswith('.fbc')
+
+def _code_type(width):
+    return 'B' if width == 1 else 'H'
+
+def _little_endian(values):
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values.tobytes()
+
+def _padded_length(length):
+    return (length + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+def _pad(data):
+    return data + bytes(_padded_length(len(data)) - len(data))
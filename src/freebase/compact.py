@@ -0,0 +1,153 @@
+"""
+The Freebase compact module holds the parsed triples of an entity in a
+compact form, for entities with many triples, such as popular topics
+with thousands of keys and aliases. By default, iter_entities builds
+a _LocalizedTriple with freshly decoded object and language strings for
+every line, even though most of the triples of such an entity are then
+dropped by filter_triples. Given the new_triples method of a PairTable,
+it groups the triples into CompactTriples objects instead.
+
+In a CompactTriples object:
+- the subject is decoded once per entity and interned,
+- every triple is a small integer code of its (lang, predicate ID) pair,
+  interned in a PairTable which is shared by all entities of a run,
+- the objects are kept as the raw object fields of the lines, stored one
+  after the other in a single buffer, and are only decoded for triples
+  which are selected.
+
+Selecting the triples with the (lang, predicate ID) pairs of a plan is
+a lookup of the codes, and only returns _LocalizedTriple tuples for the
+selected triples, so filter_triples (which does this for CompactTriples)
+and route_entities work on them as on lists of triples.
+"""
+
+import array
+import sys
+from src.freebase.parser import (
+    _LocalizedTriple, _extract_lang, _extract_object_and_lang_bytes)
+
+class PairTable:
+    """
+    Interns (lang, predicate ID) pairs as small integer codes. The pair
+    of a code is pairs[code].
+    """
+    __slots__ = ('pairs', '_codes', '_selections')
+
+    def __init__(self):
+        self.pairs = []
+        # (language bytes, predicate ID) keys, with None for links
+        self._codes = {}
+        self._selections = {}
+
+    def code(self, lang_bytes, predicate_id):
+        """
+        Returns the code of the pair of a language tag (the bytes after
+        the @ of the object field, or None for objects without one) and
+        a predicate ID.
+        """
+        key = (lang_bytes, predicate_id)
+        code = self._codes.get(key, None)
+        if code is None:
+            code = len(self.pairs)
+            lang = 'link' if lang_bytes is None else lang_bytes.decode()
+            self.pairs.append((sys.intern(lang), predicate_id))
+            self._codes[key] = code
+        return code
+
+    def new_triples(self, subject):
+        """
+        Returns an empty CompactTriples object for the triples of a
+        subject, whose pairs are interned in this table. This is the
+        new_triples argument of iter_entities for compact triples.
+        """
+        return CompactTriples(subject, self)
+
+    def selected_codes(self, lang_predicate_tuples):
+        """
+        Returns the set of the codes of those pairs which are in
+        lang_predicate_tuples, such as the lang_predicate_tuples of an
+        extraction plan.
+        """
+        selection = self._selections.get(lang_predicate_tuples, None)
+        # pairs interned since the selection was made are checked again
+        if selection is None or selection[0] != len(self.pairs):
+            selection = (len(self.pairs), frozenset(
+                code for code, pair in enumerate(self.pairs)
+                if pair in lang_predicate_tuples))
+            self._selections[lang_predicate_tuples] = selection
+        return selection[1]
+
+class CompactTriples:
+    """
+    The parsed triples of an entity, as codes of a PairTable and raw
+    object fields (see the module documentation). Iterating yields the
+    triples as _LocalizedTriple tuples, in the order of the lines, and
+    len is the number of triples.
+    """
+    __slots__ = ('subject', 'pair_table', '_codes', '_objects', '_ends')
+
+    def __init__(self, subject, pair_table):
+        self.subject = sys.intern(subject)
+        self.pair_table = pair_table
+        self._codes = array.array('H')
+        self._objects = bytearray()
+        self._ends = array.array('L')
+
+    def __len__(self):
+        return len(self._codes)
+
+    def __iter__(self):
+        return iter(self.select(None))
+
+    def append(self, code, object_field):
+        """
+        Adds a triple with the code of its pair and the object field of
+        its line, as bytes.
+        """
+        self._codes.append(code)
+        self._objects += object_field
+        self._ends.append(len(self._objects))
+
+    def add(self, predicate_id, object_field):
+        """
+        Adds a triple with a predicate ID and the object field of its
+        line, as bytes, interning its pair in the pair table.
+        """
+        self.append(
+            self.pair_table.code(_lang_bytes(object_field), predicate_id),
+            object_field)
+
+    def select(self, lang_predicate_tuples):
+        """
+        Returns the triples whose (lang, predicate ID) pair is in
+        lang_predicate_tuples as a list of _LocalizedTriple tuples, like
+        filter_triples, or all triples if it is None.
+        """
+        pairs = self.pair_table.pairs
+        selected_codes = (
+            None if lang_predicate_tuples is None
+            else self.pair_table.selected_codes(lang_predicate_tuples))
+        objects = self._objects
+        ends = self._ends
+        triples = []
+        for index, code in enumerate(self._codes):
+            if selected_codes is not None and code not in selected_codes:
+                continue
+            begin = ends[index - 1] if index else 0
+            object, _ = _extract_object_and_lang_bytes(
+                bytes(objects[begin:ends[index]]))
+            lang, predicate_id = pairs[code]
+            triples.append(_LocalizedTriple(
+                self.subject, predicate_id, object, lang))
+        return triples
+
+def _lang_bytes(object_field):
+    # the language tag of an object field, as _extract_object_and_lang_bytes
+    # finds it, or None
+    tail = object_field[-3:]
+    if not tail.isascii():
+        lang = _extract_lang(object_field.decode('utf-8'), None)
+        return None if lang is None else lang.encode('utf-8')
+    if len(tail) == 3 and tail[0] == ord('@'):
+        return tail[1:]
+    return None
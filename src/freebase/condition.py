@@ -0,0 +1,146 @@
+"""
+The Freebase condition module decides which entities are extracted. A
+condition is compiled from the 'condition' entry of a configuration
+dict, which can look like any of these:
+
+{"predicate_id": "type", "predicate_value": "common.topic"}
+
+{"predicate_id": "type", "predicate_values": ["common.topic", "..."]}
+
+{"predicate_id": "type",
+ "predicate_values_file": "data/celestial_object_categories.txt"}
+
+{"predicate_id": "category",
+ "predicate_values_file": "data/celestial_object_categories.txt",
+ "values_from": "subject"}
+
+{"all_of": [condition, ...]}
+
+{"any_of": [condition, ...]}
+
+The first four match entities which have a triple with the predicate ID
+and one of the values. A values file is either a plain list with one
+value per line, or extraction output, from which the objects of rows
+with the condition's predicate ID are taken, or with "values_from":
+"subject", the subjects of all rows. The "type" example matches
+entities with one of the types of the celestial object categories in
+that file. Subjects are topic MID's, so they only match predicates
+whose objects are MID's as well, and never "type", whose objects are
+type ID's. The "category" example is for a predicate with the URL
+<http://rdf.freebase.com/ns/astronomy.celestial_object.category>, and
+matches the celestial objects of the categories in that file. "all_of"
+and "any_of" combine other conditions.
+
+An entity is evaluated by grouping the objects of its triples by their
+predicate ID once, after which every value condition only looks at the
+objects of its own predicate, using set membership. The cost per entity
+therefore grows with the number of its triples, and not with the number
+of condition values.
+"""
+
+from collections import defaultdict
+
+class ValueCondition:
+    """
+    Matches entities with at least one triple whose predicate ID is
+    predicate_id and whose object is one of the values.
+    """
+    def __init__(self, predicate_id, values):
+        self.predicate_id = predicate_id
+        self.values = frozenset(values)
+
+    def matches(self, objects_by_predicate):
+        """
+        Evaluates the condition on a dict which maps predicate ID's of
+        an entity to lists of the entity's objects.
+        """
+        objects = objects_by_predicate.get(self.predicate_id, None)
+        if objects is None:
+            return False
+        return not self.values.isdisjoint(objects)
+
+class AllOfCondition:
+    """Matches entities which match all of the given conditions."""
+    def __init__(self, conditions):
+        self.conditions = conditions
+
+    def matches(self, objects_by_predicate):
+        """See ValueCondition.matches."""
+        return all(
+            condition.matches(objects_by_predicate)
+            for condition in self.conditions)
+
+class AnyOfCondition:
+    """Matches entities which match at least one of the given conditions."""
+    def __init__(self, conditions):
+        self.conditions = conditions
+
+    def matches(self, objects_by_predicate):
+        """See ValueCondition.matches."""
+        return any(
+            condition.matches(objects_by_predicate)
+            for condition in self.conditions)
+
+def compile_condition(condition_config):
+    """
+    Compiles the 'condition' entry of a configuration dict into a
+    condition object. Returns None if condition_config is None.
+    """
+    if condition_config is None:
+        return None
+    if 'all_of' in condition_config:
+        return AllOfCondition(
+            [compile_condition(c) for c in condition_config['all_of']])
+    if 'any_of' in condition_config:
+        return AnyOfCondition(
+            [compile_condition(c) for c in condition_config['any_of']])
+    predicate_id = condition_config['predicate_id']
+    values = set()
+    if 'predicate_value' in condition_config:
+        values.add(condition_config['predicate_value'])
+    values.update(condition_config.get('predicate_values', []))
+    if 'predicate_values_file' in condition_config:
+        values.update(load_condition_values(
+            condition_config['predicate_values_file'], predicate_id,
+            condition_config.get('values_from', 'object')))
+    return ValueCondition(predicate_id, values)
+
+def load_condition_values(file_name, predicate_id, values_from='object'):
+    """
+    Loads condition values from a file, which is either a list with one
+    value per line, or extraction output. In the latter case, the objects
+    of the rows with the given predicate ID are loaded, or the subjects
+    of all rows if values_from is 'subject'. Subjects are MID's, so they
+    are only useful for a predicate which links to topics (see the
+    module documentation).
+    """
+    if values_from not in ('object', 'subject'):
+        raise ValueError("values_from must be 'object' or 'subject', not {}"
+            .format(values_from))
+    values = set()
+    with open(file_name, 'rt', encoding='utf-8') as values_file:
+        for line in values_file:
+            line = line.rstrip('\n')
+            if '\t' in line:
+                tokens = line.split('\t')
+                if len(tokens) != 4:
+                    continue
+                if values_from == 'subject':
+                    values.add(tokens[0])
+                elif tokens[1] == predicate_id:
+                    values.add(tokens[2])
+            elif line:
+                values.add(line)
+    return values
+
+def condition_matches(condition, triples):
+    """
+    Evaluates a condition on the localized triples of an entity. If the
+    condition is None, every entity matches.
+    """
+    if condition is None:
+        return True
+    objects_by_predicate = defaultdict(list)
+    for t in triples:
+        objects_by_predicate[t[1]].append(t[2])
+    return condition.matches(objects_by_predicate)
@@ -0,0 +1,272 @@
+"""
+The Freebase entity index module looks up all rows of an entity in an
+output file of the extraction, without reading the whole file. The
+index is a file next to the output (its name is the output file name
+with .idx appended), which holds the subjects of all entities in sorted
+order, each with the location of the entity's rows:
+- the range of bytes of the rows in a text output,
+- the offset of the chunk and the index of the entity in the chunk in a
+  columnar output (see src.freebase.columnar).
+
+Both files are memory-mapped, and a lookup is a binary search over the
+sorted entries, which reads only a few pages of the index and the rows
+of the entity. The decoded chunks of a columnar output are cached, so
+that the columns of a compressed chunk are only decompressed once for
+many lookups.
+
+The entries are sorted in runs of a bounded size, which are merged while
+the index is written, so that building the index of a large output does
+not hold all of its subjects in memory.
+"""
+
+import collections
+import heapq
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+from src.freebase.columnar import (
+    ColumnarChunk, ColumnarFile, is_columnar_file_name)
+
+_MAGIC = b'FBI1'
+
+_TEXT_FORMAT = 0
+_COLUMNAR_FORMAT = 1
+
+# magic, format of the output, number of entries, size of the output
+_HEADER = struct.Struct('<4sB3xQQ')
+
+# offset and length of the subject, and the location of the rows
+_ENTRY = struct.Struct('<QIQQ')
+
+# length of the subject and the location of the rows, in sorted runs
+_RUN_ENTRY = struct.Struct('<IQQ')
+
+# entries sorted in memory before they are written into a run
+_RUN_ENTRY_COUNT = 1000000
+
+def index_file_name_for(output_file_name):
+    """Returns the name of the entity index of an output file."""
+    return output_file_name + '.idx'
+
+def build_entity_index(output_file_name, index_file_name=None):
+    """
+    Reads an output file (text or columnar) and writes its entity index.
+    Returns the number of indexed entities.
+    """
+    if index_file_name is None:
+        index_file_name = index_file_name_for(output_file_name)
+    if is_columnar_file_name(output_file_name):
+        format = _COLUMNAR_FORMAT
+        entries = _columnar_entities(output_file_name)
+    else:
+        format = _TEXT_FORMAT
+        entries = _text_entities(output_file_name)
+    temporary_file_name = index_file_name + '.tmp'
+    with tempfile.TemporaryFile() as subject_file:
+        entry_count, entries = _sort_entries(entries)
+        subject_offset = _HEADER.size + entry_count * _ENTRY.size
+        with open(temporary_file_name, 'wb') as index_file:
+            index_file.write(_HEADER.pack(
+                _MAGIC, format, entry_count,
+                os.path.getsize(output_file_name)))
+            # the subjects follow the entries, so they are collected in
+            # another file while the entries are written
+            for subject, begin, end in entries:
+                index_file.write(
+                    _ENTRY.pack(subject_offset, len(subject), begin, end))
+                subject_offset += len(subject)
+                subject_file.write(subject)
+            subject_file.seek(0)
+            shutil.copyfileobj(subject_file, index_file)
+    os.replace(temporary_file_name, index_file_name)
+    return entry_count
+
+def entity_index_is_current(output_file_name, index_file_name=None):
+    """
+    Checks whether the entity index of an output file exists and was
+    built from the output file as it is now.
+    """
+    if index_file_name is None:
+        index_file_name = index_file_name_for(output_file_name)
+    try:
+        with open(index_file_name, 'rb') as index_file:
+            header = index_file.read(_HEADER.size)
+        output_size = os.path.getsize(output_file_name)
+    except FileNotFoundError:
+        return False
+    if len(header) != _HEADER.size:
+        return False
+    magic, _, _, indexed_size = _HEADER.unpack(header)
+    return (
+        magic == _MAGIC and indexed_size == output_size
+        and os.path.getmtime(index_file_name)
+            >= os.path.getmtime(output_file_name))
+
+class EntityIndex:
+    """
+    The entity index of an output file, opened for lookups. Both the
+    index and the output are memory-mapped. Up to max_cached_chunks
+    decoded chunks of a columnar output are kept, the least recently
+    used one is dropped first.
+    """
+    def __init__(self, output_file_name, index_file_name=None,
+                 max_cached_chunks=64):
+        if index_file_name is None:
+            index_file_name = index_file_name_for(output_file_name)
+        self._index_file = open(index_file_name, 'rb')
+        self._output_file = open(output_file_name, 'rb')
+        self._index = mmap.mmap(
+            self._index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._format, self.entity_count, output_size = (
+            _HEADER.unpack_from(self._index))
+        if magic != _MAGIC:
+            raise ValueError("{} is not an entity index"
+                .format(index_file_name))
+        if output_size != os.path.getsize(output_file_name):
+            raise ValueError("{} is not the index of {}"
+                .format(index_file_name, output_file_name))
+        self.max_cached_chunks = max_cached_chunks
+        self._chunks = collections.OrderedDict()
+        self._output = None
+        if output_size > 0:
+            self._output = mmap.mmap(
+                self._output_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def lookup(self, subject, lang=None):
+        """
+        Returns the rows of an entity as (subject, predicate ID, object,
+        lang) tuples, limited to a language if lang is given. Returns an
+        empty list if the entity is not in the output.
+        """
+        key = subject.encode('utf-8')
+        position = self._lower_bound(key)
+        rows = []
+        while position < self.entity_count:
+            _, _, begin, end = self._entry(position)
+            if self._subject(position) != key:
+                break
+            rows.extend(self._rows(begin, end))
+            position += 1
+        if lang is not None:
+            rows = [row for row in rows if row[3] == lang]
+        return rows
+
+    def close(self):
+        """Closes the index and the output file."""
+        for chunk in self._chunks.values():
+            chunk.release()
+        self._chunks.clear()
+        self._index.close()
+        if self._output is not None:
+            self._output.close()
+        self._index_file.close()
+        self._output_file.close()
+
+    def _entry(self, position):
+        return _ENTRY.unpack_from(
+            self._index, _HEADER.size + position * _ENTRY.size)
+
+    def _subject(self, position):
+        subject_offset, subject_length, _, _ = self._entry(position)
+        return self._index[subject_offset:subject_offset + subject_length]
+
+    def _lower_bound(self, key):
+        low, high = 0, self.entity_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._subject(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _rows(self, begin, end):
+        if self._format == _COLUMNAR_FORMAT:
+            return self._chunk(begin).entity_rows(end)
+        lines = self._output[begin:end].decode('utf-8').split('\n')
+        return [tuple(line.split('\t')) for line in lines if line]
+
+    def _chunk(self, offset):
+        chunk = self._chunks.get(offset, None)
+        if chunk is not None:
+            self._chunks.move_to_end(offset)
+            return chunk
+        chunk = ColumnarChunk(memoryview(self._output), offset)
+        self._chunks[offset] = chunk
+        if len(self._chunks) > self.max_cached_chunks:
+            _, dropped_chunk = self._chunks.popitem(last=False)
+            dropped_chunk.release()
+        return chunk
+
+def _text_entities(output_file_name):
+    # yields (subject, first byte, end byte) of every entity of a text
+    # output
+    subject, begin, position = None, 0, 0
+    with open(output_file_name, 'rb') as output_file:
+        for line in output_file:
+            line_subject = line[:line.index(b'\t')]
+            if line_subject != subject:
+                if subject is not None:
+                    yield subject, begin, position
+                subject, begin = line_subject, position
+            position += len(line)
+    if subject is not None:
+        yield subject, begin, position
+
+def _columnar_entities(output_file_name):
+    # yields (subject, chunk offset, entity index) of every entity of a
+    # columnar output
+    with ColumnarFile(output_file_name) as columnar_file:
+        chunk_offset = 0
+        for chunk in columnar_file.chunks:
+            for entity_index in range(chunk.entity_count):
+                yield (chunk.subject(entity_index).encode('utf-8'),
+                       chunk_offset, entity_index)
+            chunk_offset += chunk.length
+
+def _sort_entries(entries):
+    # Returns the number of entries and an iterator over them in sorted
+    # order. Up to _RUN_ENTRY_COUNT entries are sorted in memory, more
+    # are sorted in runs in temporary files, which are merged. The runs
+    # are read while the iterator is consumed.
+    runs = []
+    entry_count = 0
+    buffer = []
+    for entry in entries:
+        buffer.append(entry)
+        if len(buffer) == _RUN_ENTRY_COUNT:
+            entry_count += len(buffer)
+            runs.append(_write_run(buffer))
+            buffer = []
+    entry_count += len(buffer)
+    buffer.sort()
+    if not runs:
+        return entry_count, iter(buffer)
+    runs.append(_write_run(buffer))
+    return entry_count, heapq.merge(*[_read_run(run) for run in runs])
+
+def _write_run(entries):
+    entries.sort()
+    run_file = tempfile.TemporaryFile()
+    for subject, begin, end in entries:
+        run_file.write(_RUN_ENTRY.pack(len(subject), begin, end))
+        run_file.write(subject)
+    run_file.seek(0)
+    return run_file
+
+def _read_run(run_file):
+    with run_file:
+        while True:
+            header = run_file.read(_RUN_ENTRY.size)
+            if not header:
+                return
+            subject_length, begin, end = _RUN_ENTRY.unpack(header)
+            yield run_file.read(subject_length), begin, end
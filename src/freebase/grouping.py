@@ -0,0 +1,187 @@
+"""
+The Freebase grouping module groups the parsed triples of RDF lines by
+their subject when the lines of an entity are not adjacent, as in
+unsorted or concatenated dumps. iter_entities would evaluate every run
+of adjacent lines as a separate entity, so that an entity split across
+the dump is checked against the condition in fragments.
+
+The SubjectGrouper parses and prefilters the lines, and distributes the
+triples into partitions by a hash of their subject. The partitions are
+kept in memory up to a memory budget, and are then spilled to disk as
+runs of pickled triples. After the last line, every partition is read
+back and grouped in memory, so that every entity is yielded once, with
+its triples in the order of the input. A partition which would not fit
+into the memory budget is partitioned again by other digits of the
+hash.
+
+Entities are yielded partition by partition, in the order in which their
+subjects first appear in the partition. The order is the same in every
+run with the same input and parameters.
+"""
+
+import os
+import pickle
+import shutil
+import tempfile
+import zlib
+from src.freebase.parser import (
+    parse_and_localize_target, parse_and_localize_target_bytes)
+
+# estimated memory of a buffered triple, besides its strings
+_TRIPLE_OVERHEAD = 200
+
+# partitioning a partition which is too large again, by other digits of
+# the subject hash, is given up after this many levels
+_MAX_DEPTH = 4
+
+class SubjectGrouper:
+    """
+    Groups the triples of RDF lines by subject (see group), buffering at
+    most about memory_bytes of triples in memory, in partition_count
+    partitions. Spilled runs are written into a temporary directory in
+    directory (by default, the system's temporary directory), which is
+    removed at the end. The counts of the grouping are available as the
+    attributes line_count, triple_count, entity_count, run_count (runs
+    spilled to disk) and spilled_bytes.
+    """
+    def __init__(self, plan, directory=None, memory_bytes=256 * 2 ** 20,
+                 partition_count=64):
+        self.plan = plan
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.partition_count = partition_count
+        self.line_count = 0
+        self.triple_count = 0
+        self.entity_count = 0
+        self.run_count = 0
+        self.spilled_bytes = 0
+
+    def group(self, lines):
+        """
+        Parses RDF lines (strings or UTF-8 encoded bytes) and yields a
+        (subject, triples) tuple for every subject, like iter_entities,
+        but with all triples of the subject, wherever they are in the
+        input. This is a generator; the grouping starts when the first
+        entity is requested, and it reads all lines before yielding it.
+        """
+        run_directory = tempfile.mkdtemp(
+            prefix='freebase_groups_', dir=self.directory)
+        try:
+            partitions = self._partition(lines, run_directory)
+            yield from self._group_partitions(partitions, run_directory, 0)
+        finally:
+            shutil.rmtree(run_directory)
+
+    def _partition(self, lines, run_directory):
+        # Returns a list of partitions, each of which is a list of triples
+        # if it was never spilled, or else the name of its run file.
+        plan = self.plan
+        partition_count = self.partition_count
+        buffers = [[] for _ in range(partition_count)]
+        buffered_bytes = 0
+        spilled = False
+        parse_line = None
+        for line in lines:
+            self.line_count += 1
+            if parse_line is None:
+                parse_line = (
+                    parse_and_localize_target_bytes
+                    if isinstance(line, bytes)
+                    else parse_and_localize_target)
+            triple = parse_line(line, plan)
+            if triple is None: continue
+            self.triple_count += 1
+            subject = triple.subject.encode('utf-8')
+            buffers[_partition_index(subject, partition_count, 0)].append(
+                triple)
+            buffered_bytes += (
+                _TRIPLE_OVERHEAD + len(subject) + len(triple.object))
+            if buffered_bytes > self.memory_bytes:
+                self._spill(buffers, run_directory, '')
+                buffered_bytes = 0
+                spilled = True
+        if not spilled:
+            return buffers
+        self._spill(buffers, run_directory, '')
+        return [
+            _run_file_name(run_directory, '', index)
+            for index in range(partition_count)]
+
+    def _group_partitions(self, partitions, run_directory, depth):
+        for index, partition in enumerate(partitions):
+            if isinstance(partition, list):
+                yield from self._group_triples(partition)
+                continue
+            if not os.path.exists(partition):
+                continue
+            # pickled triples take about as much memory as their size on
+            # disk times a factor of a few
+            if (os.path.getsize(partition) * 4 > self.memory_bytes
+                    and depth < _MAX_DEPTH):
+                yield from self._group_partitions(
+                    self._repartition(partition, run_directory, depth + 1),
+                    run_directory, depth + 1)
+                continue
+            triples = []
+            for run in _read_runs(partition):
+                triples.extend(run)
+            os.remove(partition)
+            yield from self._group_triples(triples)
+
+    def _repartition(self, file_name, run_directory, depth):
+        # splits a run file by the next digits of the subject hashes
+        partition_count = self.partition_count
+        prefix = '{}_'.format(os.path.basename(file_name))
+        for run in _read_runs(file_name):
+            buffers = [[] for _ in range(partition_count)]
+            for triple in run:
+                index = _partition_index(
+                    triple.subject.encode('utf-8'), partition_count, depth)
+                buffers[index].append(triple)
+            self._spill(buffers, run_directory, prefix)
+        os.remove(file_name)
+        return [
+            _run_file_name(run_directory, prefix, index)
+            for index in range(partition_count)]
+
+    def _spill(self, buffers, run_directory, prefix):
+        for index, buffer in enumerate(buffers):
+            if not buffer:
+                continue
+            file_name = _run_file_name(run_directory, prefix, index)
+            with open(file_name, 'ab') as run_file:
+                begin = run_file.tell()
+                pickle.dump(buffer, run_file, pickle.HIGHEST_PROTOCOL)
+                self.spilled_bytes += run_file.tell() - begin
+            self.run_count += 1
+            buffer.clear()
+
+    def _group_triples(self, triples):
+        # groups in the order in which the subjects first appear
+        groups = {}
+        for triple in triples:
+            group = groups.get(triple.subject, None)
+            if group is None:
+                groups[triple.subject] = [triple,]
+            else:
+                group.append(triple)
+        self.entity_count += len(groups)
+        return iter(groups.items())
+
+def _partition_index(subject, partition_count, depth):
+    # The digit of the CRC-32 of the subject in base partition_count at
+    # position depth. CRC-32 with another seed would not do, as it
+    # differs from the unseeded one by a constant for subjects of the
+    # same length.
+    return zlib.crc32(subject) // partition_count ** depth % partition_count
+
+def _run_file_name(run_directory, prefix, index):
+    return os.path.join(run_directory, '{}{}'.format(prefix, index))
+
+def _read_runs(file_name):
+    with open(file_name, 'rb') as run_file:
+        while True:
+            try:
+                yield pickle.load(run_file)
+            except EOFError:
+                return
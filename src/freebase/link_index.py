@@ -0,0 +1,399 @@
+"""
+The Freebase link index module answers questions about the link rows of
+an output file of the extraction (rows whose language is 'link', such
+as the rows of the type predicate): all objects linked from an entity,
+like all types of an entity, and all entities linked to an object, like
+all entities of a type.
+
+The index is a directory next to the output (its name is the output file
+name with .links appended), which holds NumPy arrays saved as .npy
+files, and string tables:
+- subject_ids.bin and object_ids.bin hold the IDs of the subjects and of
+  the objects of the links, sorted and concatenated as UTF-8, so that
+  they take no more space than their text, and subject_offsets.npy and
+  object_offsets.npy hold the offsets of the IDs in them; the code of an
+  ID is its position in the sorted IDs,
+- forward_indptr.npy and forward_indices.npy hold the codes of the
+  objects of every subject in the compressed sparse row (CSR) format:
+  the objects of the subject with code s are
+  forward_indices[forward_indptr[s]:forward_indptr[s + 1]], sorted,
+- reverse_indptr.npy and reverse_indices.npy hold the codes of the
+  subjects of every object in the same format,
+- link_index.json holds the format of the index, the indexed predicate
+  ID's and the size of the output, and is written last.
+
+The arrays and string tables are memory-mapped when the index is opened.
+Finding the code of an ID is a binary search in its string table, the
+neighbours of a code are a slice of the arrays, and set operations over
+the neighbours of several codes, such as intersecting the entities of
+two types, are done by NumPy on the sorted code arrays.
+"""
+
+import array
+import functools
+import json
+import mmap
+import os
+import shutil
+import numpy
+from src.freebase.columnar import ColumnarFile, is_columnar_file_name
+
+_META_FILE_NAME = 'link_index.json'
+
+# the format of the index, which is 2 since the IDs are stored as string
+# tables instead of fixed width arrays
+_FORMAT = 2
+
+_ARRAY_NAMES = (
+    'subject_offsets', 'object_offsets', 'forward_indptr',
+    'forward_indices', 'reverse_indptr', 'reverse_indices')
+
+# the number of IDs up to which they are read from a string table one by
+# one, rather than gathered by NumPy
+_FEW_CODES = 32
+
+def link_index_directory_for(output_file_name):
+    """Returns the name of the link index directory of an output file."""
+    return output_file_name + '.links'
+
+def build_link_index(output_file_name, directory=None, predicate_ids=None):
+    """
+    Reads an output file (text or columnar) and writes the link index of
+    its link rows, or only of those with one of predicate_ids, if given.
+    Duplicate links are indexed once. Returns the number of indexed
+    links.
+    """
+    if directory is None:
+        directory = link_index_directory_for(output_file_name)
+    if predicate_ids is not None:
+        predicate_ids = sorted(predicate_ids)
+    subject_codes = {}
+    object_codes = {}
+    link_subjects = array.array('I')
+    link_objects = array.array('I')
+    # codes in the order in which the IDs first appear, which are
+    # replaced by the codes of the sorted IDs below
+    for subject, object in _read_links(output_file_name, predicate_ids):
+        link_subjects.append(
+            subject_codes.setdefault(subject, len(subject_codes)))
+        link_objects.append(
+            object_codes.setdefault(object, len(object_codes)))
+    subjects, subject_ranks = _sort_ids(subject_codes)
+    objects, object_ranks = _sort_ids(object_codes)
+    del subject_codes, object_codes
+    # the links sorted by subject and object, without duplicates
+    links = numpy.unique(
+        subject_ranks[numpy.frombuffer(link_subjects, dtype=numpy.uint32)]
+        * len(objects)
+        + object_ranks[numpy.frombuffer(link_objects, dtype=numpy.uint32)])
+    del link_subjects, link_objects
+    index_type = numpy.int32 if len(links) < 2 ** 31 else numpy.int64
+    link_subjects = (links // max(len(objects), 1)).astype(index_type)
+    link_objects = (links % max(len(objects), 1)).astype(index_type)
+    del links
+    reverse_order = numpy.lexsort((link_subjects, link_objects))
+    arrays = {
+        'subject_offsets': _string_offsets(subjects),
+        'object_offsets': _string_offsets(objects),
+        'forward_indptr': _indptr(link_subjects, len(subjects)),
+        'forward_indices': link_objects,
+        'reverse_indptr': _indptr(link_objects, len(objects)),
+        'reverse_indices': link_subjects[reverse_order],
+    }
+    temporary_directory = directory + '.tmp'
+    if os.path.isdir(temporary_directory):
+        shutil.rmtree(temporary_directory)
+    os.mkdir(temporary_directory)
+    for name, values in arrays.items():
+        numpy.save(os.path.join(temporary_directory, name + '.npy'), values)
+    for name, ids in [('subject_ids', subjects), ('object_ids', objects)]:
+        with open(os.path.join(temporary_directory, name + '.bin'),
+                  'wb') as string_table_file:
+            string_table_file.writelines(ids)
+    with open(os.path.join(temporary_directory, _META_FILE_NAME),
+              'wt') as meta_file:
+        meta_file.write(json.dumps({
+            'format': _FORMAT,
+            'predicate_ids': predicate_ids,
+            'link_count': len(link_subjects),
+            'output_size': os.path.getsize(output_file_name),
+        }))
+    if os.path.isdir(directory):
+        shutil.rmtree(directory)
+    os.rename(temporary_directory, directory)
+    return len(link_subjects)
+
+def link_index_is_current(output_file_name, directory=None,
+                          predicate_ids=None):
+    """
+    Checks whether the link index of an output file exists, was built
+    from the output file as it is now, in the current format, and
+    indexes the links of predicate_ids (None for all).
+    """
+    if predicate_ids is not None:
+        predicate_ids = sorted(predicate_ids)
+    if directory is None:
+        directory = link_index_directory_for(output_file_name)
+    meta_file_name = os.path.join(directory, _META_FILE_NAME)
+    try:
+        with open(meta_file_name, 'rt') as meta_file:
+            meta = json.loads(meta_file.read())
+        output_size = os.path.getsize(output_file_name)
+    except (FileNotFoundError, ValueError):
+        return False
+    return (
+        meta.get('format', None) == _FORMAT
+        and meta['predicate_ids'] == predicate_ids
+        and meta['output_size'] == output_size
+        and os.path.getmtime(meta_file_name)
+            >= os.path.getmtime(output_file_name))
+
+class LinkIndex:
+    """
+    The link index of an output file, opened for lookups, with its
+    arrays memory-mapped. The numbers of subjects, objects and links
+    are available as subject_count, object_count and link_count, and
+    the indexed predicate ID's (None for all) as predicate_ids.
+    """
+    def __init__(self, output_file_name, directory=None):
+        if directory is None:
+            directory = link_index_directory_for(output_file_name)
+        with open(os.path.join(directory, _META_FILE_NAME),
+                  'rt') as meta_file:
+            meta = json.loads(meta_file.read())
+        if (meta.get('format', None) != _FORMAT
+                or meta['output_size'] != os.path.getsize(output_file_name)):
+            raise ValueError("{} is not the link index of {}"
+                .format(directory, output_file_name))
+        self.predicate_ids = meta['predicate_ids']
+        self.link_count = meta['link_count']
+        for name in _ARRAY_NAMES:
+            setattr(self, '_' + name, numpy.load(
+                os.path.join(directory, name + '.npy'), mmap_mode='r'))
+        self._subjects = _StringTable(
+            self._subject_offsets, os.path.join(directory, 'subject_ids.bin'))
+        self._objects = _StringTable(
+            self._object_offsets, os.path.join(directory, 'object_ids.bin'))
+        self.subject_count = len(self._subjects)
+        self.object_count = len(self._objects)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def subject_code(self, subject):
+        """Returns the code of a subject ID, or None if it has no links."""
+        return self._subjects.find(subject)
+
+    def object_code(self, object):
+        """Returns the code of an object ID, or None if it has no links."""
+        return self._objects.find(object)
+
+    def object_codes_of(self, subject_code):
+        """
+        Returns the sorted codes of the objects linked from the subject
+        with a code, as a read-only NumPy array.
+        """
+        return self._forward_indices[
+            self._forward_indptr[subject_code]:
+            self._forward_indptr[subject_code + 1]]
+
+    def subject_codes_of(self, object_code):
+        """
+        Returns the sorted codes of the subjects linked to the object
+        with a code, as a read-only NumPy array.
+        """
+        return self._reverse_indices[
+            self._reverse_indptr[object_code]:
+            self._reverse_indptr[object_code + 1]]
+
+    def subject_ids(self, subject_codes):
+        """Returns the IDs of subject codes as a list of strings."""
+        return self._subjects.strings(subject_codes)
+
+    def object_ids(self, object_codes):
+        """Returns the IDs of object codes as a list of strings."""
+        return self._objects.strings(object_codes)
+
+    def objects_of(self, subject):
+        """
+        Returns the IDs of the objects linked from a subject, such as the
+        types of an entity, sorted.
+        """
+        code = self.subject_code(subject)
+        if code is None:
+            return []
+        return self.object_ids(self.object_codes_of(code))
+
+    def subjects_of(self, object):
+        """
+        Returns the IDs of the subjects linked to an object, such as the
+        entities of a type, sorted.
+        """
+        code = self.object_code(object)
+        if code is None:
+            return []
+        return self.subject_ids(self.subject_codes_of(code))
+
+    def subjects_of_all(self, objects):
+        """
+        Returns the IDs of the subjects linked to all of the objects,
+        such as the entities which have all of several types, sorted.
+        """
+        codes = [self.object_code(object) for object in objects]
+        if not codes or None in codes:
+            return []
+        subject_codes = sorted(
+            (self.subject_codes_of(code) for code in codes), key=len)
+        return self.subject_ids(
+            functools.reduce(_intersect_sorted, subject_codes))
+
+    def subjects_of_any(self, objects):
+        """
+        Returns the IDs of the subjects linked to any of the objects,
+        such as the entities which have one of several types, sorted.
+        """
+        subject_codes = [
+            self.subject_codes_of(code)
+            for code in map(self.object_code, objects) if code is not None]
+        if not subject_codes:
+            return []
+        return self.subject_ids(
+            numpy.unique(numpy.concatenate(subject_codes)))
+
+    def close(self):
+        """Releases the memory-mapped arrays and string tables."""
+        if self._subjects is not None:
+            self._subjects.close()
+            self._objects.close()
+        self._subjects = self._objects = None
+        for name in _ARRAY_NAMES:
+            setattr(self, '_' + name, None)
+
+def _read_links(output_file_name, predicate_ids):
+    # (subject, object) of every link row, as bytes
+    if predicate_ids is not None:
+        predicate_ids = frozenset(predicate_ids)
+    if is_columnar_file_name(output_file_name):
+        with ColumnarFile(output_file_name) as columnar_file:
+            for chunk in columnar_file.chunks:
+                for subject, predicate_id, object, lang in chunk.rows():
+                    if lang != 'link' or (
+                            predicate_ids is not None
+                            and predicate_id not in predicate_ids):
+                        continue
+                    yield subject.encode('utf-8'), object.encode('utf-8')
+        return
+    if predicate_ids is not None:
+        predicate_ids = frozenset(
+            predicate_id.encode('utf-8') for predicate_id in predicate_ids)
+    with open(output_file_name, 'rb') as output_file:
+        for line in output_file:
+            if not line.endswith(b'\tlink\n'):
+                continue
+            subject, predicate_id, object, _ = line.split(b'\t')
+            if predicate_ids is not None and (
+                    predicate_id not in predicate_ids):
+                continue
+            yield subject, object
+
+def _sort_ids(codes):
+    # the IDs of a dict from IDs to codes in sorted order, and the
+    # position of every code in it
+    ids = sorted(codes)
+    ranks = numpy.empty(len(ids), dtype=numpy.int64)
+    ranks[[codes[id] for id in ids]] = numpy.arange(len(ids))
+    return ids, ranks
+
+def _string_offsets(ids):
+    # the offsets of sorted IDs in their string table
+    lengths = numpy.fromiter(map(len, ids), dtype=numpy.int64, count=len(ids))
+    offsets = numpy.zeros(len(ids) + 1, dtype=numpy.int64)
+    numpy.cumsum(lengths, out=offsets[1:])
+    return offsets.astype(
+        numpy.uint32 if offsets[-1] < 2 ** 32 else numpy.uint64)
+
+def _indptr(sorted_codes, count):
+    indptr = numpy.zeros(count + 1, dtype=numpy.int64)
+    numpy.cumsum(
+        numpy.bincount(sorted_codes, minlength=count), out=indptr[1:])
+    return indptr
+
+class _StringTable:
+    # The sorted IDs of a string table file, by their codes, which is
+    # memory-mapped. Slicing the mapped file gives the bytes of an ID
+    # directly, and the offsets are read through a memoryview, which is
+    # much faster than indexing the NumPy array one offset at a time.
+
+    def __init__(self, offsets, file_name):
+        self._offsets = offsets
+        self._offset_view = memoryview(offsets)
+        self._mmap = None
+        self._data = b''
+        with open(file_name, 'rb') as string_table_file:
+            if offsets[-1] > 0:
+                self._mmap = self._data = mmap.mmap(
+                    string_table_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._bytes = numpy.frombuffer(self._data, dtype=numpy.uint8)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def find(self, id):
+        # the code of an ID, or None if it is not in the table
+        key = id.encode('utf-8')
+        offsets = self._offset_view
+        data = self._data
+        begin = 0
+        end = len(self)
+        while begin < end:
+            middle = (begin + end) // 2
+            if data[offsets[middle]:offsets[middle + 1]] < key:
+                begin = middle + 1
+            else:
+                end = middle
+        if (begin < len(self)
+                and data[offsets[begin]:offsets[begin + 1]] == key):
+            return begin
+        return None
+
+    def strings(self, codes):
+        # The IDs of codes, as a list of strings. The IDs are gathered
+        # by NumPy into one block, where each is followed by a newline,
+        # which does not occur in the escaped fields of the output, and
+        # the block is decoded and split at once.
+        codes = numpy.asarray(codes)
+        if len(codes) <= _FEW_CODES:
+            # sliced one by one, which is faster than setting up NumPy
+            offsets = self._offset_view
+            data = self._data
+            return [
+                data[offsets[code]:offsets[code + 1]].decode('utf-8')
+                for code in codes.tolist()]
+        begins = self._offsets[codes].astype(numpy.int64)
+        lengths = self._offsets[codes + 1].astype(numpy.int64) - begins
+        block_ends = numpy.cumsum(lengths + 1)
+        block = numpy.full(int(block_ends[-1]), ord('\n'), dtype=numpy.uint8)
+        shifts = numpy.repeat(block_ends - lengths - 1 - begins, lengths)
+        positions = numpy.arange(len(shifts)) + numpy.repeat(
+            numpy.arange(len(codes)), lengths)
+        block[positions] = self._bytes[positions - shifts]
+        return block.tobytes().decode('utf-8').split('\n')[:-1]
+
+    def close(self):
+        self._offset_view.release()
+        self._bytes = None
+        if self._mmap is not None:
+            self._mmap.close()
+
+def _intersect_sorted(codes, other_codes):
+    # The codes which are in both sorted arrays. If the first array is
+    # much shorter, every code of it is searched in the second one,
+    # otherwise both are merged by NumPy.
+    if len(codes) * 8 > len(other_codes):
+        return numpy.intersect1d(codes, other_codes, assume_unique=True)
+    positions = numpy.searchsorted(other_codes, codes)
+    positions[positions == len(other_codes)] = 0
+    return codes[other_codes[positions] == codes]
@@ -0,0 +1,240 @@
+"""
+The Freebase metrics module instruments extraction runs. An
+ExtractionMetrics object counts:
+- lines read, lines which cannot be parsed (which do not have three
+  fields) and lines rejected because of their predicate, by predicate,
+- entities seen and entities kept (once per output they are written
+  to), and the sizes of the seen entities in parsed triples, as a
+  histogram,
+- bytes written to the outputs,
+and accumulates the time spent in every stage of the extraction.
+
+The metrics of the chunks processed by worker processes are merged into
+the metrics of the run. A MetricsExporter writes them periodically into
+a JSON file or a Prometheus textfile (for the textfile collector of the
+node exporter), and a ChunkProfiler profiles a sample of the chunks
+with cProfile.
+
+Instrumentation is optional: without it, the extraction does not call
+into this module for lines or entities, so it costs nothing.
+"""
+
+import collections
+import cProfile
+import json
+import os
+import time
+from src.freebase.parser import split_rdf_line
+
+# upper bounds of the buckets of the entity size histogram
+ENTITY_SIZE_BUCKETS = tuple(2 ** i for i in range(17))
+
+STAGES = ('read', 'parse', 'filter', 'format', 'write')
+
+class ExtractionMetrics:
+    """
+    The counters, stage timers and entity size histogram of an
+    extraction run, or of a single chunk of it. The stage_seconds dict
+    holds the cumulative time of every stage (see STAGES). The times of
+    stages run by worker processes are summed over the workers.
+    """
+    def __init__(self):
+        self.lines_read = 0
+        self.unparsable_lines = 0
+        self.rejected_lines = collections.Counter()
+        self.entities_seen = 0
+        self.entities_kept = 0
+        self.bytes_out = 0
+        self.stage_seconds = dict.fromkeys(STAGES, 0.0)
+        # the last bucket counts entities larger than all bounds
+        self.entity_sizes = [0] * (len(ENTITY_SIZE_BUCKETS) + 1)
+        self.entity_size_sum = 0
+
+    def count_lines(self, lines, plan):
+        """
+        Counts a chunk of RDF lines (UTF-8 encoded bytes) as read, and
+        classifies those which the parser drops with the extraction plan:
+        the lines which do not have three fields are unparsable, and the
+        others without a target predicate are rejected. The lines are
+        split by the parser (see src.freebase.parser.split_rdf_line), so
+        that the remaining lines are exactly the parsed ones.
+        """
+        self.lines_read += len(lines)
+        predicate_ids = plan.predicate_ids_bytes
+        split_lines = list(map(split_rdf_line, lines))
+        self.unparsable_lines += split_lines.count(None)
+        self.rejected_lines.update([
+            fields[1] for fields in split_lines
+            if fields is not None and fields[1] not in predicate_ids])
+
+    def count_entities(self, entities):
+        """Counts (subject, triples) tuples as seen entities."""
+        self.entities_seen += len(entities)
+        entity_sizes = self.entity_sizes
+        for _, triples in entities:
+            size = len(triples)
+            self.entity_size_sum += size
+            # the bucket of the smallest bound which is >= size
+            entity_sizes[
+                min((size - 1).bit_length(), len(ENTITY_SIZE_BUCKETS))] += 1
+
+    def add_stage_time(self, stage, seconds):
+        """Adds time spent in a stage."""
+        self.stage_seconds[stage] += seconds
+
+    def merge(self, other):
+        """Adds the counts and times of other metrics to these ones."""
+        self.lines_read += other.lines_read
+        self.unparsable_lines += other.unparsable_lines
+        self.rejected_lines.update(other.rejected_lines)
+        self.entities_seen += other.entities_seen
+        self.entities_kept += other.entities_kept
+        self.bytes_out += other.bytes_out
+        for stage, seconds in other.stage_seconds.items():
+            self.stage_seconds[stage] += seconds
+        for i, count in enumerate(other.entity_sizes):
+            self.entity_sizes[i] += count
+        self.entity_size_sum += other.entity_size_sum
+
+    def to_dict(self):
+        """Returns the metrics as a dict, which can be saved as JSON."""
+        bounds = [str(bound) for bound in ENTITY_SIZE_BUCKETS] + ['+Inf']
+        return {
+            'lines_read': self.lines_read,
+            'unparsable_lines': self.unparsable_lines,
+            'rejected_lines': sum(self.rejected_lines.values()),
+            'rejected_lines_by_predicate': {
+                predicate.decode('utf-8', 'replace'): count
+                for predicate, count in self.rejected_lines.most_common()},
+            'entities_seen': self.entities_seen,
+            'entities_kept': self.entities_kept,
+            'bytes_out': self.bytes_out,
+            'stage_seconds': dict(self.stage_seconds),
+            'entity_size_histogram': dict(zip(bounds, self.entity_sizes)),
+            'entity_size_sum': self.entity_size_sum,
+        }
+
+    def to_prometheus(self):
+        """Returns the metrics in the Prometheus text format."""
+        lines = []
+        _add_metric(
+            lines, 'lines_read_total', 'counter', "Lines read.",
+            [('', self.lines_read)])
+        _add_metric(
+            lines, 'unparsable_lines_total', 'counter',
+            "Lines without three fields.", [('', self.unparsable_lines)])
+        _add_metric(
+            lines, 'rejected_lines_total', 'counter',
+            "Lines rejected because of their predicate.",
+            [(_labels(predicate=predicate.decode('utf-8', 'replace')),
+              count)
+             for predicate, count in sorted(self.rejected_lines.items())])
+        _add_metric(
+            lines, 'entities_seen_total', 'counter', "Entities parsed.",
+            [('', self.entities_seen)])
+        _add_metric(
+            lines, 'entities_kept_total', 'counter',
+            "Entities written, once per output.",
+            [('', self.entities_kept)])
+        _add_metric(
+            lines, 'bytes_out_total', 'counter',
+            "Bytes written to the outputs.", [('', self.bytes_out)])
+        _add_metric(
+            lines, 'stage_seconds_total', 'counter',
+            "Time spent in every stage.",
+            [(_labels(stage=stage), seconds)
+             for stage, seconds in self.stage_seconds.items()])
+        buckets = []
+        cumulative_count = 0
+        for bound, count in zip(
+                ENTITY_SIZE_BUCKETS + ('+Inf',), self.entity_sizes):
+            cumulative_count += count
+            buckets.append((_labels(le=str(bound)), cumulative_count))
+        _add_metric(
+            lines, 'entity_triples', 'histogram',
+            "Parsed triples per entity.",
+            [('_bucket' + labels, count) for labels, count in buckets]
+            + [('_sum', self.entity_size_sum),
+               ('_count', self.entities_seen)])
+        return ''.join(lines)
+
+class MetricsExporter:
+    """
+    Writes metrics into a file at most every every_seconds seconds, and
+    when the run finishes. Files with names ending with .prom are
+    written in the Prometheus text format, other files as JSON. The file
+    is replaced atomically, so that it can be read at any time.
+    """
+    def __init__(self, metrics, file_name, every_seconds=60.0):
+        self.metrics = metrics
+        self._file_name = file_name
+        self._every_seconds = every_seconds
+        self._begin = time.time()
+        self._last_export = self._begin
+
+    def export_if_due(self):
+        """Writes the metrics if every_seconds have passed."""
+        now = time.time()
+        if now - self._last_export >= self._every_seconds:
+            self.export()
+
+    def export(self):
+        """Writes the metrics."""
+        self._last_export = time.time()
+        if self._file_name.endswith('.prom'):
+            text = self.metrics.to_prometheus()
+        else:
+            metrics = self.metrics.to_dict()
+            metrics['elapsed_seconds'] = self._last_export - self._begin
+            text = json.dumps(metrics, indent=4)
+        temporary_file_name = self._file_name + '.tmp'
+        with open(temporary_file_name, 'wt') as metrics_file:
+            metrics_file.write(text)
+        os.replace(temporary_file_name, self._file_name)
+
+class ChunkProfiler:
+    """
+    Profiles one of every every_chunks calls of run with cProfile, and
+    saves the accumulated statistics (see the pstats module) into
+    file_name, when save is called. In worker processes, the process ID
+    is appended to the file name, and the statistics are saved after
+    every profiled chunk, as workers are not told when the run ends.
+    """
+    def __init__(self, file_name, every_chunks=10, in_worker=False):
+        self._file_name = file_name
+        if in_worker:
+            self._file_name += '.{}'.format(os.getpid())
+        self._every_chunks = max(every_chunks, 1)
+        self._in_worker = in_worker
+        self._profile = cProfile.Profile()
+        self._chunk_count = 0
+
+    def run(self, function, *args):
+        """Calls function with args, profiled if it is due."""
+        self._chunk_count += 1
+        if self._chunk_count % self._every_chunks != 1 % self._every_chunks:
+            return function(*args)
+        result = self._profile.runcall(function, *args)
+        if self._in_worker:
+            self.save()
+        return result
+
+    def save(self):
+        """Saves the statistics of the profiled chunks."""
+        self._profile.dump_stats(self._file_name)
+
+def _add_metric(lines, name, type, help, samples):
+    name = 'freebase_' + name
+    lines.append('# HELP {} {}\n'.format(name, help))
+    lines.append('# TYPE {} {}\n'.format(name, type))
+    for suffix, value in samples:
+        lines.append('{}{} {}\n'.format(name, suffix, value))
+
+def _labels(**labels):
+    return '{' + ','.join(
+        '{}="{}"'.format(name, _escape_label_value(value))
+        for name, value in labels.items()) + '}'
+
+def _escape_label_value(value):
+    return (value.replace('\\', '\\\\').replace('"', '\\"')
+        .replace('\n', '\\n'))
@@ -1,7 +1,7 @@
 """
 The Freebaser parser module contains a set of functions for:
 1. Transforming RDF lines into named tuples.
-2. Filtering these transformed triples.
+2. Grouping these transformed triples into entities and filtering them.
 3. Transforming MQL result lists for further processing.
 
 All of these actions are performed according to a configuration dict.
@@ -31,18 +31,142 @@ A sample configuration dict in JSON format can look like this:
     "main_predicate_url": "<http://rdf.freebase.com/ns/type.object.name>",
 }
 
+Before parsing, the configuration dict is compiled into an ExtractionPlan
+by the compile_config function, so that the lookups performed for every
+RDF line and every entity do not have to walk the dict again.
 """
 
 from collections import namedtuple
 from parse import *
+from src.freebase.condition import compile_condition, condition_matches
 
 _Triple = namedtuple('_Triple', 'subject, predicate, object')
 _LocalizedTriple = namedtuple(
     '_LocalizedTriple', 'subject, predicate_id, object, lang')
-          
-def parse_and_localize(rdf_line, config):
+
+# the field separator, the characters stripped from the end of a line
+# and those stripped from the end of its object field, by line type
+_SEPARATORS = {
+    str: ('\t', '\t.\n', ' \t\n'),
+    bytes: (b'\t', b'\t.\n', b' \t\n'),
+}
+
+class ExtractionPlan:
+    """
+    A configuration dict compiled into the structures which are used
+    while parsing and filtering:
+    - predicate_ids maps exact predicate URLs to predicate ID's,
+    - target_predicate_urls is a frozenset of those URLs,
+    - predicate_ids_bytes is the same mapping for UTF-8 encoded URLs,
+    - main_predicate_id is the ID of the main predicate,
+    - linked_predicate_ids holds ID's of predicates with linked objects,
+    - lang_predicate_tuples is a frozenset of the (lang, predicate ID)
+      pairs that should be kept,
+    - condition is the compiled condition entities have to meet (see
+      the src.freebase.condition module), or None if the config does not
+      specify one,
+    - predicate_key_ids maps MQL predicate keys to predicate ID's (see
+      predicate_key_to_predicate_id); it holds the keys of the target
+      predicates, and other keys which map to one of them are added
+      when they are first mapped.
+    The original dict is still available as the config attribute.
+    """
+    def __init__(self, config):
+        self.config = config
+        self.predicate_ids = {}
+        for predicate in config['target_predicates']:
+            # the first matching predicate wins, as in a linear scan
+            self.predicate_ids.setdefault(predicate['url'], predicate['id'])
+        self.target_predicate_urls = frozenset(self.predicate_ids)
+        self.predicate_ids_bytes = {
+            url.encode('utf-8'): id
+            for url, id in self.predicate_ids.items()}
+        self.main_predicate_id = _find_id_of_main_predicate(config)
+        self.linked_predicate_ids = frozenset(
+            predicate['id']
+            for predicate in filter_config_predicates(False, config))
+        self.lang_predicate_tuples = frozenset(
+            _config_to_lang_predicate_tuples(config))
+        self.condition = compile_condition(config.get('condition', None))
+        self.predicate_key_ids = {}
+        for predicate in config['target_predicates']:
+            key = '/' + (
+                predicate['url'].strip('<>').rsplit('/', 1)[-1]
+                .translate({ord('.'): '/'}))
+            self.predicate_key_ids[key] = (
+                _scan_predicate_key(key, config))
+
+_OutputPlan = namedtuple('_OutputPlan', 'name, output_file_name, plan')
+
+def compile_config(config):
+    """
+    Compiles a configuration dict into an ExtractionPlan. This should be
+    done once, and the plan should then be passed to the other functions
+    of this module.
+    """
+    return ExtractionPlan(config)
+
+def compile_outputs(config, plan=None):
+    """
+    Compiles the outputs declared in a configuration dict into a list of
+    named tuples with the name, the output file name and the extraction
+    plan of each output. The 'outputs' entry of the dict is a list of
+    dicts like this one:
+
+    {
+        "name": "celestial",
+        "output_file_name": "data/celestial.txt",
+        "predicate_ids": ["name", "type"],
+        "lang_list": ["en"],
+        "condition": {"predicate_id": "type", "predicate_value": "..."}
+    }
+
+    where "predicate_ids" selects some of the target predicates, and the
+    other keys (all of them optional) replace the top-level entries of
+    the dict for this output. A "condition" of null keeps all entities.
+    Without an 'outputs' entry, the dict's own output_file_name and
+    condition make up a single output, whose plan is the given plan of
+    the whole dict, if any, so that the dict is not compiled again.
+
+    The lines are parsed once for all outputs, with the top-level target
+    predicates, so a ValueError is raised for an output which declares
+    its own "target_predicates" instead of selecting some with
+    "predicate_ids". The main predicate is needed to localize subjects,
+    so a ValueError is also raised for an output whose "predicate_ids"
+    leave it out.
+    """
+    output_configs = config.get('outputs', None)
+    if output_configs is None:
+        if plan is None:
+            plan = compile_config(config)
+        return [_OutputPlan('output', config['output_file_name'], plan)]
+    output_plans = []
+    for output_config in output_configs:
+        if 'target_predicates' in output_config:
+            raise ValueError(
+                "output {} declares target_predicates, which are shared by"
+                " all outputs; select some of them with predicate_ids"
+                .format(output_config['name']))
+        merged_config = dict(config)
+        merged_config.update(output_config)
+        predicate_ids = output_config.get('predicate_ids', None)
+        if predicate_ids is not None:
+            merged_config['target_predicates'] = [
+                predicate for predicate in config['target_predicates']
+                if predicate['id'] in predicate_ids]
+        if _find_id_of_main_predicate(merged_config) is None:
+            raise ValueError(
+                "output {} does not select the main predicate {}".format(
+                    output_config['name'],
+                    merged_config['main_predicate_url']))
+        output_plans.append(_OutputPlan(
+            output_config['name'], output_config['output_file_name'],
+            compile_config(merged_config)))
+    return output_plans
+
+def parse_and_localize(rdf_line, plan):
     """
-    Parses an RDF line according to a configuration dict.
+    Parses an RDF line according to an extraction plan.
     
     The result is a named tuple which contains:
     - the subject (entity ID),
@@ -58,22 +182,187 @@ def parse_and_localize(rdf_line, config):
     return (_LocalizedTriple
         (
             subject=_extract_link_key(t[0]),
-            predicate_id=_predicate_url_to_predicate_id(t[1], config),
+            predicate_id=_predicate_url_to_predicate_id(t[1], plan),
             object=_extract_string_data_or_link_key(t[2]),
             lang=_extract_lang(t[2], 'link')
         ))
 
-def filter_triples(triples, config):
+def parse_and_localize_target(rdf_line, plan):
+    """
+    Works like parse_and_localize, except that it also returns None for
+    RDF lines whose predicate is not one of the target predicates of the
+    extraction plan. The predicate field is checked before the line is
+    tokenized (see split_target_line), so such lines are rejected
+    without building a triple.
+    """
+    fields = split_target_line(rdf_line, plan.predicate_ids)
+    if fields is None: return None
+    predicate_id, subject, object = fields
+    return (_LocalizedTriple
+        (
+            subject=_extract_link_key(subject),
+            predicate_id=predicate_id,
+            object=_extract_string_data_or_link_key(object),
+            lang=_extract_lang(object, 'link')
+        ))
+
+def parse_and_localize_target_bytes(rdf_line, plan):
+    """
+    Works like parse_and_localize_target, except that the RDF line is
+    given as UTF-8 encoded bytes. The predicate is matched and the line
+    is split without decoding it, and only the subject and object fields
+    of lines with a target predicate are decoded into strings. The
+    result is the same named tuple that parse_and_localize returns.
+    """
+    fields = split_target_line(rdf_line, plan.predicate_ids_bytes)
+    if fields is None: return None
+    predicate_id, subject, object = fields
+    object, lang = _extract_object_and_lang_bytes(object)
+    return (_LocalizedTriple
+        (
+            subject=_extract_link_key_bytes(subject).decode('utf-8'),
+            predicate_id=predicate_id,
+            object=object,
+            lang=lang
+        ))
+
+def split_target_line(rdf_line, predicate_ids):
+    """
+    The predicate prefilter of all functions which parse RDF lines. The
+    line is a string or UTF-8 encoded bytes, and predicate_ids maps the
+    URLs of the target predicates, of the same type, to their ID's (the
+    predicate_ids or predicate_ids_bytes of an extraction plan).
+
+    The predicate field is looked up before the line is split, and None
+    is returned if it is not a target predicate, or if the line does not
+    have three fields. Otherwise the result is a (predicate ID, subject
+    field, object field) tuple, whose fields are not parsed any further.
+    """
+    tab, line_end, object_end = _SEPARATORS[type(rdf_line)]
+    predicate_begin = rdf_line.find(tab) + 1
+    predicate_end = rdf_line.find(tab, predicate_begin)
+    predicate_id = predicate_ids.get(
+        rdf_line[predicate_begin:predicate_end], None)
+    if predicate_id is None: return None
+    tokens = rdf_line.rstrip(line_end).split(tab)
+    if len(tokens) != 3: return None
+    return predicate_id, tokens[0], tokens[2].rstrip(object_end)
+
+def split_rdf_line(rdf_line):
+    """
+    Splits an RDF line (a string or UTF-8 encoded bytes) into its
+    subject, predicate and object fields, as split_target_line does
+    after its predicate lookup. Returns the fields as a tuple, or None
+    if the line does not have three fields.
+    """
+    tab, line_end, object_end = _SEPARATORS[type(rdf_line)]
+    tokens = rdf_line.rstrip(line_end).split(tab)
+    if len(tokens) != 3: return None
+    return tokens[0], tokens[1], tokens[2].rstrip(object_end)
+
+def filter_triples(triples, plan):
     """
     Filters a list of localized triples. Only keeps those which the
-    configuration dict specifies as "target".
+    extraction plan specifies as "target". The triples can also be a
+    CompactTriples object (see the src.freebase.compact module), which
+    only builds the triples that are kept.
     """
-    lang_predicate_tuples = _config_to_lang_predicate_tuples(config)
+    lang_predicate_tuples = plan.lang_predicate_tuples
+    select = getattr(triples, 'select', None)
+    if select is not None:
+        return select(lang_predicate_tuples)
     filter_function = (lambda t:
         (t.lang, t.predicate_id) in lang_predicate_tuples)
     return [x for x in filter(filter_function, triples)]
   
-def query_result_to_entity_info(result_list, config):
+def iter_entities(lines, plan, new_triples=None):
+    """
+    Parses RDF lines (strings or UTF-8 encoded bytes) and groups the
+    parsed triples by their subject. This is a generator which reads the
+    lines lazily and yields a (subject, triples) tuple for every group of
+    adjacent lines with the same subject, so only one entity is held in
+    memory at a time. Lines with non-target predicates are dropped
+    before they are tokenized (see split_target_line).
+
+    The triples of an entity are a list of localized triples, or, if
+    new_triples is given, the object which it returns for the subject of
+    the entity, and to which every triple is added by calling its add
+    method with the predicate ID and the object field of the line. For
+    lines given as bytes, this can be the new_triples method of a
+    PairTable (see the src.freebase.compact module), which holds the
+    triples in compact form and only decodes those which are kept.
+    """
+    predicate_ids = None
+    current_subject = None
+    triples = None
+    for line in lines:
+        if predicate_ids is None:
+            if isinstance(line, bytes):
+                predicate_ids = plan.predicate_ids_bytes
+                extract_link_key = _extract_link_key_bytes
+                extract_object_and_lang = _extract_object_and_lang_bytes
+            else:
+                predicate_ids = plan.predicate_ids
+                extract_link_key = _extract_link_key
+                extract_object_and_lang = _extract_object_and_lang
+        fields = split_target_line(line, predicate_ids)
+        if fields is None: continue
+        predicate_id, subject, object = fields
+        subject = extract_link_key(subject)
+        if subject != current_subject:
+            if triples is not None:
+                yield entity_subject, triples
+            current_subject = subject
+            entity_subject = (
+                subject.decode('utf-8') if isinstance(subject, bytes)
+                else subject)
+            triples = (
+                [] if new_triples is None else new_triples(entity_subject))
+        if new_triples is None:
+            object, lang = extract_object_and_lang(object)
+            triples.append(_LocalizedTriple(
+                entity_subject, predicate_id, object, lang))
+        else:
+            triples.add(predicate_id, object)
+    if triples is not None:
+        yield entity_subject, triples
+
+def filter_entities(entities, plan):
+    """
+    Applies filter_triples to the triples of every (subject, triples)
+    tuple, such as the ones yielded by iter_entities.
+    """
+    for subject, triples in entities:
+        yield subject, filter_triples(triples, plan)
+
+def route_entities(entities, plans):
+    """
+    Matches every (subject, triples) tuple against several extraction
+    plans, whose target predicates are a subset of those used to parse
+    the entities. Yields an (index of the plan, subject, filtered
+    triples) tuple for every plan whose condition the entity meets.
+    Plans which keep the same (lang, predicate ID) pairs share the
+    filtered triples.
+    """
+    for subject, triples in entities:
+        filtered_by_selection = {}
+        for index, plan in enumerate(plans):
+            selection = plan.lang_predicate_tuples
+            filtered_triples = filtered_by_selection.get(selection, None)
+            if filtered_triples is None:
+                filtered_triples = filter_triples(triples, plan)
+                filtered_by_selection[selection] = filtered_triples
+            if entity_meets_condition(filtered_triples, plan):
+                yield index, subject, filtered_triples
+
+def entity_meets_condition(triples, plan):
+    """
+    Checks whether the triples of an entity meet the condition of the
+    extraction plan.
+    """
+    return condition_matches(plan.condition, triples)
+
+def query_result_to_entity_info(result_list, plan):
     """
     Takes a list of tuples, where each item consists of:
     - the language code,
@@ -81,27 +370,26 @@ def query_result_to_entity_info(result_list, config):
     - actual object data,
     and transforms it into a similar list of tuples, except that
     predicate keys are mapped into corresponding predicate ID's
-    based on the input configuration dict, and linked predicates
+    based on the input extraction plan, and linked predicates
     from multiple languages are replaced with a single predicate
     entry per (predicate ID, value) pair and value. Their language
     is then set to 'link'.
     """
-    linked_predicates = filter_config_predicates(False, config)
-    linked_predicate_id_list = [
-        predicate['id']
-        for predicate in linked_predicates]
+    linked_predicate_ids = plan.linked_predicate_ids
     entity_info = []
+    seen_tuples = set()
     for tuple in result_list:
         lang = tuple[0]
         predicate_key = tuple[1]
         object = tuple[2]
         predicate_id = (
-            predicate_key_to_predicate_id(predicate_key, config))
-        if predicate_id in linked_predicate_id_list:
+            predicate_key_to_predicate_id(predicate_key, plan))
+        if predicate_id in linked_predicate_ids:
             new_tuple = ('link', predicate_id, object)
         else:
             new_tuple = (lang, predicate_id, object)
-        if new_tuple not in entity_info:
+        if new_tuple not in seen_tuples:
+            seen_tuples.add(new_tuple)
             entity_info.append(new_tuple)
     return entity_info
         
@@ -116,10 +404,21 @@ def filter_config_predicates(localizable, config):
             localizable_predicates.append(predicate)
     return localizable_predicates
     
-def predicate_key_to_predicate_id(predicate_key, config):
+def predicate_key_to_predicate_id(predicate_key, plan):
     """
-    Maps a predicate key to a predicate ID based on the configuration dict.
+    Maps a predicate key to a predicate ID based on the extraction plan.
+    Keys of other predicates are mapped to None, and are not remembered,
+    so that the mapping does not grow with every key of the responses.
     """
+    try:
+        return plan.predicate_key_ids[predicate_key]
+    except KeyError:
+        predicate_id = _scan_predicate_key(predicate_key, plan.config)
+        if predicate_id is not None:
+            plan.predicate_key_ids[predicate_key] = predicate_id
+        return predicate_id
+
+def _scan_predicate_key(predicate_key, config):
     key_string = predicate_key.lstrip('/').translate({ord('/'): '.'})
     for predicate in config['target_predicates']:
         if predicate['url'].rstrip('>').endswith(key_string):
@@ -136,6 +435,20 @@ def _extract_lang(object, not_found_val):
     else:
         return not_found_val
 
+def _extract_object_and_lang(object):
+    return (_extract_string_data_or_link_key(object),
+            _extract_lang(object, 'link'))
+
+def _extract_object_and_lang_bytes(object):
+    tail = object[-3:]
+    if not tail.isascii():
+        # A multi-byte character near the end, where byte positions
+        # differ from character positions, so use the string functions.
+        return _extract_object_and_lang(object.decode('utf-8'))
+    if len(tail) == 3 and tail[0] == ord('@'):
+        return object[:-3].strip(b'\"').decode('utf-8'), tail[1:].decode()
+    return _extract_link_key_bytes(object).decode('utf-8'), 'link'
+
 def _parse_line(line):
     tokens = line.rstrip('\t.\n').split('\t')
     if len(tokens) is 3:
@@ -156,12 +469,11 @@ def _extract_link_key(str):
     return (str.strip('<>')            # remove link marks
                .rsplit('/', 1)[-1])    # string after last '/'
 
-def _predicate_url_to_predicate_id(predicate_url, config):
-    for predicate in config['target_predicates']:
-        if predicate['url'] == predicate_url:
-            return predicate['id']
-    else:
-        return None
+def _extract_link_key_bytes(link):
+    return link.strip(b'<>').rsplit(b'/', 1)[-1]
+
+def _predicate_url_to_predicate_id(predicate_url, plan):
+    return plan.predicate_ids.get(predicate_url, None)
         
 def _find_id_of_main_predicate(config):
     for predicate in config['target_predicates']:
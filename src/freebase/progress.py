@@ -0,0 +1,75 @@
+"""
+The Freebase progress module reports the progress of an extraction run
+on stdout. Instead of printing a status line for every written entity,
+it prints one every N written entities or every T seconds, whichever
+comes first, with the reading speed and an estimate of the remaining
+time.
+"""
+
+import os
+import time
+
+class ProgressReporter:
+    """
+    Counts processed lines and written entities, and prints a status
+    line whenever every_entities more entities have been written or
+    every_seconds seconds have passed since the last one. The counts
+    are updated (and checked) once per processed chunk. The remaining
+    time is estimated from the position in the dump file, if input_file
+    is an object returned by src.freebase.reader.open_dump.
+    """
+    def __init__(self, input_file=None, every_entities=100000,
+                 every_seconds=10.0):
+        self.line_count = 0
+        self.entity_count = 0
+        self._input_file = input_file
+        self._every_entities = every_entities
+        self._every_seconds = every_seconds
+        self._begin = time.time()
+        self._last_report = self._begin
+        self._next_report_entities = every_entities
+
+    def add(self, lines=0, entities=0):
+        """Adds processed lines and written entities to the counts."""
+        self.line_count += lines
+        self.entity_count += entities
+        self._report_if_due()
+
+    def finish(self):
+        """Prints the final status line."""
+        self._report(time.time())
+
+    def _report_if_due(self):
+        now = time.time()
+        if (self.entity_count >= self._next_report_entities
+            or now - self._last_report >= self._every_seconds):
+            self._report(now)
+
+    def _report(self, now):
+        self._last_report = now
+        self._next_report_entities = self.entity_count + self._every_entities
+        elapsed = now - self._begin
+        status = "{} lines, {} entities written, {:.0f} lines/sec".format(
+            self.line_count, self.entity_count,
+            self.line_count / elapsed if elapsed > 0 else 0)
+        fraction = _read_fraction(self._input_file)
+        if fraction is not None and fraction > 0:
+            status += ", {:.1f}% read, ETA {}".format(
+                100 * fraction,
+                _format_seconds(elapsed * (1 - fraction) / fraction))
+        print(status, flush=True)
+
+def _read_fraction(input_file):
+    dump_file = getattr(input_file, 'dump_file', None)
+    if dump_file is None or dump_file.closed:
+        return None
+    size = os.fstat(dump_file.fileno()).st_size
+    if size == 0:
+        return None
+    position = os.lseek(dump_file.fileno(), 0, os.SEEK_CUR)
+    return min(position / size, 1.0)
+
+def _format_seconds(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return "{}:{:02}:{:02}".format(hours, minutes, seconds)
@@ -0,0 +1,214 @@
+"""
+The Freebase reader module opens data dumps for reading their lines as
+bytes. Compressed dumps are decompressed in the background, so that
+parsing overlaps with decompression:
+1. if a parallel decompressor (pigz for gzip, zstd for zstd) is on the
+   PATH, it runs as a separate process and its output is read,
+2. otherwise a background thread decompresses the dump with zlib.
+In both cases the decompressed data is passed to the reading thread as
+large blocks through a bounded queue.
+"""
+
+import errno
+import gzip
+import io
+import itertools
+import os
+import queue
+import shutil
+import subprocess
+import threading
+
+# Commands of external decompressors, by the extension of the dump.
+EXTERNAL_DECOMPRESSORS = {
+    '.gz': [['pigz', '-dc']],
+    '.zst': [['zstd', '-dc']],
+}
+
+_DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024
+_DEFAULT_QUEUE_BLOCKS = 8
+
+class DecompressorNotFoundError(Exception):
+    """
+    Raised by open_dump when a dump needs an external decompressor, and
+    none of the decompressors for its extension is on the PATH. Unlike
+    a FileNotFoundError, it does not mean that the dump is missing.
+    """
+
+def open_dump(file_name, decompressor='auto',
+              block_size=_DEFAULT_BLOCK_SIZE,
+              queue_blocks=_DEFAULT_QUEUE_BLOCKS, skip_bytes=0):
+    """
+    Opens a dump file and returns a binary file-like object whose lines
+    can be iterated. The decompressor argument selects how compressed
+    dumps are read:
+    - 'auto' uses the first external decompressor found on the PATH,
+      and falls back to 'zlib' if there is none,
+    - 'external' requires an external decompressor,
+    - 'zlib' decompresses gzip dumps in a background thread,
+    - 'none' uses a plain gzip.open without a background thread.
+    Dumps whose name does not end with .gz or .zst are read as
+    uncompressed files. The method that was selected is available as the
+    method attribute of the returned object.
+
+    Raises FileNotFoundError if the dump does not exist, and
+    DecompressorNotFoundError if it needs an external decompressor
+    which is not on the PATH (always for .zst dumps).
+    """
+    if not os.path.isfile(file_name):
+        raise FileNotFoundError(
+            errno.ENOENT, os.strerror(errno.ENOENT), file_name)
+    extension = os.path.splitext(file_name)[1]
+    if extension not in EXTERNAL_DECOMPRESSORS:
+        input_file = open(file_name, 'rb', buffering=block_size)
+        input_file.method = 'uncompressed'
+        input_file.dump_file = input_file
+        input_file.seek(skip_bytes)
+        return input_file
+    if decompressor in ('auto', 'external'):
+        for command in EXTERNAL_DECOMPRESSORS[extension]:
+            if shutil.which(command[0]) is not None:
+                # The decompressor reads the dump from our file
+                # descriptor, so its position shows how far it got.
+                dump_file = open(file_name, 'rb', buffering=0)
+                process = subprocess.Popen(
+                    command, stdin=dump_file,
+                    stdout=subprocess.PIPE, bufsize=block_size)
+                input_file = BlockQueueReader(
+                    process.stdout, command[0], dump_file,
+                    block_size, queue_blocks, process)
+                input_file.skip(skip_bytes)
+                return input_file
+    if decompressor == 'external' or extension != '.gz':
+        raise DecompressorNotFoundError(
+            "{} files need {}, which is not on the PATH".format(
+                extension, ' or '.join(
+                    command[0]
+                    for command in EXTERNAL_DECOMPRESSORS[extension])))
+    input_file = gzip.open(file_name, 'rb')
+    if decompressor == 'none':
+        input_file.method = 'gzip'
+        input_file.dump_file = input_file.fileobj
+        input_file.seek(skip_bytes)
+        return input_file
+    input_file = BlockQueueReader(
+        input_file, 'zlib thread', input_file.fileobj,
+        block_size, queue_blocks)
+    input_file.skip(skip_bytes)
+    return input_file
+
+class BlockQueueReader:
+    """
+    Reads blocks of block_size bytes from a binary source in a background
+    thread, and keeps up to queue_blocks of them in a bounded queue.
+    Iterating the reader yields the lines of the source as bytes.
+
+    The dump_file is the compressed file from which the source is
+    decompressed. If the source is the output of a decompressor process,
+    the process is passed as well, so that it can be stopped when the
+    reader is closed.
+    """
+    def __init__(self, source, method, dump_file,
+                 block_size=_DEFAULT_BLOCK_SIZE,
+                 queue_blocks=_DEFAULT_QUEUE_BLOCKS, process=None):
+        self.method = method
+        self.dump_file = dump_file
+        self._pending = b''
+        self._finished = False
+        self._source = source
+        self._process = process
+        self._block_size = block_size
+        self._queue = queue.Queue(queue_blocks)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._fill_queue, daemon=True)
+        self._thread.start()
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self._line_lists())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def blocks(self):
+        """
+        Yields the decompressed data as blocks of bytes, in the order in
+        which they were read from the source.
+        """
+        while not self._finished:
+            block = self._queue.get()
+            if isinstance(block, BaseException):
+                raise block
+            if not block:
+                self._finished = True
+                return
+            yield block
+
+    def skip(self, byte_count):
+        """Discards the next byte_count bytes of the decompressed data."""
+        if byte_count <= 0:
+            return
+        for block in self.blocks():
+            if len(block) > byte_count:
+                self._pending = block[byte_count:]
+                return
+            byte_count -= len(block)
+            if byte_count == 0:
+                return
+
+    def close(self):
+        """
+        Stops the background thread and the decompressor process, and
+        closes the source.
+        """
+        self._stopped.set()
+        if self._process is not None and self._process.poll() is None:
+            self._process.terminate()
+        # unblock the thread if it is waiting for space in the queue
+        while self._thread.is_alive():
+            try:
+                self._queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self._source.close()
+        self.dump_file.close()
+        if self._process is not None:
+            self._process.wait()
+
+    def _line_lists(self):
+        pending, self._pending = self._pending, b''
+        for block in self.blocks():
+            block = pending + block
+            lines_end = block.rfind(b'\n') + 1
+            pending = block[lines_end:]
+            yield io.BytesIO(block[:lines_end]).readlines()
+        if pending:
+            yield [pending,]
+
+    def _fill_queue(self):
+        try:
+            while not self._stopped.is_set():
+                block = self._source.read(self._block_size)
+                if not block:
+                    break
+                self._put(block)
+            if (self._process is not None
+                and self._process.wait() != 0
+                and not self._stopped.is_set()):
+                raise OSError(
+                    "{} exited with status {}"
+                    .format(self.method, self._process.returncode))
+            self._put(b'')
+        except BaseException as exception:
+            self._put(exception)
+
+    def _put(self, item):
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
@@ -0,0 +1,304 @@
+"""
+The Freebase Turtle module converts Turtle documents into the N-Triples
+RDF lines of the Freebase data dumps, as a stream. Unlike
+src.freebase.api.turtle_lines_to_rdf_lines, which converts a single
+downloaded topic held in memory, the converter reads any iterable of
+lines and yields RDF lines as soon as their statements are complete, so
+that whole Turtle exports can be fed into the extractor.
+
+The converter supports prefix declarations anywhere in the document
+(@prefix and SPARQL style PREFIX), any number of subject blocks,
+predicate lists (;), object lists (,), the "a" keyword, comment lines,
+and literals with language tags, datatypes and triple quoted literals
+which span several lines. Blank nodes and collections are not
+supported, as they do not occur in Freebase exports.
+
+Prefixed names are expanded by a PrefixIndex, which is also used by
+src.freebase.api.turtle_lines_to_rdf_lines.
+
+Freebase literals often contain unescaped double quotes. A line with a
+single predicate and such a literal, as in the exports of the Freebase
+RDF API, is accepted by taking the literal up to its last quote.
+"""
+
+import re
+
+_RDF_TYPE = '<http://www.w3.org/1999/02/22-rdf-syntax-ns#type>'
+
+_PREFIX_LINE = re.compile(
+    r'\s*(?:@prefix|(?i:prefix))\s+([^\s:]*):\s*<([^>]*)>\s*\.?\s*$')
+
+# A prefixed name may contain dots, but it does not end with one,
+# because the dot after it terminates the statement.
+_NAME = r'[^\s;,."<>]+(?:\.[^\s;,.]+)*'
+
+_LITERAL = (
+    r'(?:"""(?:[^"\\]|\\.|"(?!""))*"""|"[^"\\]*(?:\\.[^"\\]*)*")'
+    r'(?:@[A-Za-z0-9-]+|\^\^(?:<[^>]*>|' + _NAME + r'))?')
+
+_TOKEN = re.compile(
+    r'\s*(?:(?P<iri><[^>]*>)|(?P<literal>' + _LITERAL + r')'
+    r'|(?P<punctuation>[;,.])|(?P<name>' + _NAME + r'))', re.DOTALL)
+
+# A predicate and a literal with unescaped quotes on a line of their own.
+_LITERAL_LINE = re.compile(
+    r'\s*(<[^>]*>|' + _NAME + r')\s+'
+    r'(".*"(?:@[A-Za-z0-9-]+|\^\^(?:<[^>]*>|' + _NAME + r'))?)'
+    r'\s*([;,.]?)\s*$', re.DOTALL)
+
+_LANGUAGE_TAG = re.compile(r'@[A-Za-z0-9-]+$')
+
+_MAX_EXPANDED_NAMES = 100000
+
+_UNESCAPED_QUOTE = re.compile(r'(?<!\\)((?:\\\\)*)"')
+
+def iter_turtle_rdf_lines(turtle_lines):
+    """
+    Converts Turtle lines (strings, with or without line endings) into
+    N-Triples RDF lines in the format of the Freebase data dumps, where
+    the subject, the predicate and the object are separated by tabs.
+    This is a generator, which reads the input lazily. Raises ValueError
+    if a statement cannot be parsed.
+    """
+    converter = _StatementConverter()
+    pending = None
+    for line in turtle_lines:
+        line = line.rstrip('\r\n')
+        if pending is not None:
+            # inside a triple quoted literal, which may span lines
+            pending += '\n' + line
+            if pending.count('"""') % 2 == 1:
+                continue
+            line, pending = pending, None
+        elif '"""' in line and line.count('"""') % 2 == 1:
+            pending = line
+            continue
+        stripped_line = line.lstrip()
+        if not stripped_line or stripped_line[0] == '#':
+            continue
+        if stripped_line[0] in '@Pp':
+            match = _PREFIX_LINE.match(line)
+            if match is not None:
+                converter.declare_prefix(match.group(1), match.group(2))
+                continue
+        yield from converter.convert(line)
+    if pending is not None:
+        raise ValueError("unterminated literal: {}".format(pending))
+    converter.finish()
+
+class PrefixIndex:
+    """
+    The prefixes of a Turtle document, given as they start prefixed
+    names, with their colon (such as 'ns:'), and mapped to their IRIs.
+    A name is expanded by its longest prefix, which for the usual
+    prefixes is found by a single dict lookup of the text before the
+    first colon of the name. Only prefixes of other forms, which overlap
+    these (such as 'ns:m.', or the empty prefix without a colon), are
+    compared with the name one by one. Literals are never expanded.
+    """
+    def __init__(self, prefixes=None):
+        self._names = {}
+        # (prefix, IRI) tuples of other prefixes, the longest first
+        self._other_prefixes = []
+        for prefix, iri in (prefixes or {}).items():
+            self.declare(prefix, iri)
+
+    def declare(self, prefix, iri):
+        """Adds a prefix, or replaces the IRI of a declared one."""
+        if prefix.endswith(':') and prefix.find(':') == len(prefix) - 1:
+            self._names[prefix[:-1]] = iri
+            return
+        self._other_prefixes = sorted(
+            [(p, i) for p, i in self._other_prefixes if p != prefix]
+            + [(prefix, iri)],
+            key=lambda other_prefix: -len(other_prefix[0]))
+
+    def expand(self, name):
+        """
+        Returns the name with its longest prefix replaced by the IRI of
+        the prefix, or None if no prefix matches or the name is a
+        literal.
+        """
+        if name.startswith('"'):
+            return None
+        prefix, separator, local_name = name.partition(':')
+        iri = self._names.get(prefix, None) if separator else None
+        prefix_length = -1 if iri is None else len(prefix) + 1
+        for other_prefix, other_iri in self._other_prefixes:
+            if len(other_prefix) <= prefix_length:
+                break
+            if name.startswith(other_prefix):
+                return other_iri + name[len(other_prefix):]
+        if iri is None:
+            return None
+        return iri + local_name
+
+class _StatementConverter:
+    # Turns the tokens of statements into RDF lines. The statements may
+    # span lines, so the position in the current statement is kept
+    # between the calls of convert.
+
+    def __init__(self):
+        self._prefixes = PrefixIndex()
+        # expanded prefixed names, as predicates and many objects repeat
+        self._expanded_names = {}
+        self._subject = None
+        self._predicate = None
+        self._expected = 'subject'
+
+    def declare_prefix(self, prefix, iri):
+        self._prefixes.declare(prefix + ':', iri)
+        self._expanded_names.clear()
+
+    def convert(self, text):
+        if self._expected == 'predicate':
+            line = self._convert_predicate_object_line(text)
+            if line is not None:
+                return [line]
+        state = (self._subject, self._predicate, self._expected)
+        try:
+            return list(self._convert_tokens(text))
+        except ValueError:
+            match = _LITERAL_LINE.match(text)
+            if match is None or state[2] != 'predicate':
+                raise
+        self._subject, self._predicate, self._expected = state
+        predicate, literal, punctuation = match.groups()
+        self._predicate = self._term(
+            'iri' if predicate[0] == '<' else 'name', predicate)
+        self._expected = 'separator'
+        if punctuation:
+            self._punctuation(punctuation, text)
+        return ['{}\t{}\t{}\t.\n'.format(
+            self._subject, self._predicate, self._literal(literal))]
+
+    def _convert_predicate_object_line(self, text):
+        # Most lines of Freebase exports hold a single predicate and
+        # object, which are split here without the tokenizer. Returns
+        # None if the line is not that simple.
+        tokens = text.split(None, 1)
+        if len(tokens) != 2:
+            return None
+        predicate, object = tokens
+        object = object.rstrip()
+        punctuation = object[-1]
+        if punctuation in ';,.':
+            object = object[:-1].rstrip()
+            if not object:
+                return None
+        else:
+            punctuation = None
+        first = object[0]
+        if first == '"':
+            quote_end = object.rfind('"')
+            suffix = object[quote_end + 1:]
+            if quote_end == 0 or '"' in object[1:quote_end]:
+                return None
+            if suffix:
+                if suffix[0] == '@':
+                    if not _LANGUAGE_TAG.match(suffix):
+                        return None
+                elif suffix.startswith('^^') and len(suffix.split()) == 1:
+                    object = self._literal(object)
+                else:
+                    return None
+        elif len(object.split()) != 1:
+            return None
+        elif first == '<':
+            if object.find('>') != len(object) - 1:
+                return None
+        elif ',' in object or ';' in object or '"' in object:
+            return None
+        else:
+            object = self._term('name', object)
+        if predicate == 'a':
+            predicate = _RDF_TYPE
+        elif predicate[0] == '<':
+            if predicate[-1] != '>':
+                return None
+        elif '"' in predicate:
+            return None
+        else:
+            predicate = self._term('name', predicate)
+        self._predicate = predicate
+        self._expected = 'separator'
+        if punctuation is not None:
+            self._punctuation(punctuation, text)
+        return self._subject + '\t' + predicate + '\t' + object + '\t.\n'
+
+    def _convert_tokens(self, text):
+        position = 0
+        end = len(text)
+        while position < end:
+            match = _TOKEN.match(text, position)
+            if match is None:
+                if text[position:].strip():
+                    raise ValueError(
+                        "cannot parse Turtle: {}".format(text[position:]))
+                break
+            position = match.end()
+            kind = match.lastgroup
+            token = match.group(kind)
+            if kind == 'punctuation':
+                self._punctuation(token, text)
+            elif self._expected == 'subject':
+                self._subject = self._term(kind, token)
+                self._expected = 'predicate'
+            elif self._expected == 'predicate':
+                self._predicate = (
+                    _RDF_TYPE if token == 'a' and kind == 'name'
+                    else self._term(kind, token))
+                self._expected = 'object'
+            elif self._expected == 'object':
+                self._expected = 'separator'
+                yield '{}\t{}\t{}\t.\n'.format(
+                    self._subject, self._predicate, self._term(kind, token))
+            else:
+                raise ValueError(
+                    "missing separator before {} in {}".format(token, text))
+
+    def finish(self):
+        if self._expected != 'subject':
+            raise ValueError(
+                "unterminated statement about {}".format(self._subject))
+
+    def _punctuation(self, token, text):
+        if token == '.' and self._expected in ('separator', 'predicate'):
+            self._expected = 'subject'
+        elif token == ';' and self._expected in ('separator', 'predicate'):
+            self._expected = 'predicate'
+        elif token == ',' and self._expected == 'separator':
+            self._expected = 'object'
+        else:
+            raise ValueError(
+                "unexpected {} in {}".format(token, text))
+
+    def _term(self, kind, token):
+        if kind == 'iri':
+            return token
+        if kind == 'literal':
+            return self._literal(token)
+        term = self._expanded_names.get(token, None)
+        if term is not None:
+            return term
+        if ':' not in token:
+            # a number or a boolean
+            return token
+        expanded_name = self._prefixes.expand(token)
+        if expanded_name is None:
+            raise ValueError("undeclared prefix in {}".format(token))
+        term = '<' + expanded_name + '>'
+        if len(self._expanded_names) < _MAX_EXPANDED_NAMES:
+            self._expanded_names[token] = term
+        return term
+
+    def _literal(self, token):
+        quote_end = token.rindex('"') + 1
+        value, suffix = token[:quote_end], token[quote_end:]
+        if suffix.startswith('^^') and not suffix.startswith('^^<'):
+            suffix = '^^' + self._term('name', suffix[2:])
+        if value.startswith('"""'):
+            value = _UNESCAPED_QUOTE.sub(r'\1\\"', value[3:-3])
+            value = value.replace('\n', '\\n').replace('\r', '\\r')
+            value = '"' + value + '"'
+        return value + suffix
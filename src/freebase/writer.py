@@ -0,0 +1,152 @@
+"""
+The Freebase writer module contains the output side of the extraction:
+1. formatting localized triples as tab separated lines,
+2. a buffered output sink which collects these lines into a large
+   buffer and writes it out in big blocks, optionally compressed with
+   gzip or zstd.
+"""
+
+import gzip
+import os
+import shutil
+import subprocess
+
+# Commands of external compressors, by the extension of the output.
+EXTERNAL_COMPRESSORS = {
+    '.gz': [['pigz', '-c']],
+    '.zst': [['zstd', '-q', '-c']],
+}
+
+_DEFAULT_BUFFER_SIZE = 8 * 1024 * 1024
+
+class CompressorNotFoundError(Exception):
+    """
+    Raised by open_output when an output needs an external compressor,
+    and none of the compressors for its extension is on the PATH.
+    """
+
+def open_output(file_name, buffer_size=_DEFAULT_BUFFER_SIZE,
+                resume_length=None):
+    """
+    Opens an output file for writing and returns an OutputSink. If the
+    name ends with .gz or .zst, the output is compressed by an external
+    compressor (pigz or zstd) found on the PATH. Gzip output falls back
+    to the gzip module if pigz is not available.
+
+    If resume_length is given, an existing uncompressed output file is
+    truncated to that length and the sink appends to it. Compressed
+    output cannot be resumed.
+
+    Raises CompressorNotFoundError for a .zst output if zstd is not on
+    the PATH.
+    """
+    extension = os.path.splitext(file_name)[1]
+    if resume_length is not None:
+        if extension in EXTERNAL_COMPRESSORS:
+            raise ValueError(
+                "compressed output {} cannot be resumed".format(file_name))
+        output_file = open(file_name, 'r+b')
+        output_file.truncate(resume_length)
+        output_file.seek(resume_length)
+        sink = OutputSink(output_file, buffer_size)
+        sink.bytes_written = resume_length
+        return sink
+    if extension not in EXTERNAL_COMPRESSORS:
+        return OutputSink(open(file_name, 'wb'), buffer_size)
+    for command in EXTERNAL_COMPRESSORS[extension]:
+        if shutil.which(command[0]) is not None:
+            with open(file_name, 'wb') as output_file:
+                process = subprocess.Popen(
+                    command, stdin=subprocess.PIPE, stdout=output_file)
+            return OutputSink(process.stdin, buffer_size, process)
+    if extension != '.gz':
+        raise CompressorNotFoundError(
+            "{} needs {}, which is not on the PATH".format(
+                file_name, ' or '.join(
+                    command[0]
+                    for command in EXTERNAL_COMPRESSORS[extension])))
+    return OutputSink(gzip.open(file_name, 'wb'), buffer_size)
+
+class OutputSink:
+    """
+    Collects written strings (or bytes) in a buffer, and writes the
+    buffer into the underlying binary file once it holds at least
+    buffer_size bytes. Strings are encoded as UTF-8. The number of bytes
+    written so far, including the buffered ones, is available as the
+    bytes_written attribute.
+
+    If the file is the input of a compressor process, the process is
+    passed as well, so that the sink can wait for it when it is closed.
+    """
+    def __init__(self, file, buffer_size=_DEFAULT_BUFFER_SIZE, process=None):
+        self.bytes_written = 0
+        self._file = file
+        self._process = process
+        self._buffer_size = buffer_size
+        self._buffer = []
+        self._buffered_size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, data):
+        """Appends a string or bytes to the buffer."""
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self._buffer.append(data)
+        self._buffered_size += len(data)
+        self.bytes_written += len(data)
+        if self._buffered_size >= self._buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered data into the underlying file."""
+        if self._buffer:
+            self._file.write(b''.join(self._buffer))
+            self._buffer = []
+            self._buffered_size = 0
+        self._file.flush()
+
+    def sync(self):
+        """
+        Flushes the buffer, and if the output is not written through a
+        compressor, makes sure it reaches the disk.
+        """
+        self.flush()
+        if self._process is None and hasattr(self._file, 'fileno'):
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        """Flushes the buffer and closes the underlying file."""
+        self.flush()
+        self._file.close()
+        if self._process is not None and self._process.wait() != 0:
+            raise OSError(
+                "compressor exited with status {}"
+                .format(self._process.returncode))
+
+def triples_to_string(localized_triples):
+    """
+    Transforms a list of localized triples into a string, where the
+    respective triples are separated with new line characters, while
+    the fields of each triple are separated with tabs.
+    """
+    string_list = []
+    for t in localized_triples:
+        subject = escape_field(t[0])
+        predicate_id = t[1]
+        object = escape_field(t[2])
+        lang = t[3]
+        item_list = [subject, predicate_id, object, lang]
+        string_list.append('\t'.join(item_list))
+    return '\n'.join(string_list) + '\n'
+
+def escape_field(string):
+    """
+    Escapes a subject or an object for the output, where non-ASCII
+    characters are written as Python escape sequences.
+    """
+    return str(string.encode('utf-8')).lstrip('b').strip('\'')
@@ -1,104 +1,530 @@
 """
 Example program which uses the src.freebase.parser module to parse and
 filter data from a Freebase data dump. It supports both text files for
-small testing files and gzip archives for parsing all of Freebase.
+small testing files and gzip (or zstd) archives for parsing all of
+Freebase.
 """
 
-import gzip
+import argparse
+import collections
+from collections import namedtuple
+import contextlib
+import io
 import json
+import multiprocessing
+import os
+import resource
+import sys
 import time
+from src.freebase.checkpoint import Checkpointer, load_checkpoint
+from src.freebase.columnar import (
+    encode_chunk, is_columnar_file_name, triples_to_rows)
+from src.freebase.compact import PairTable
+from src.freebase.entity_index import build_entity_index
+from src.freebase.grouping import SubjectGrouper
+from src.freebase.metrics import (
+    ChunkProfiler, ExtractionMetrics, MetricsExporter)
 from src.freebase.parser import *
-  
+from src.freebase.progress import ProgressReporter
+from src.freebase.reader import DecompressorNotFoundError, open_dump
+from src.freebase.turtle import iter_turtle_rdf_lines
+from src.freebase.writer import (
+    EXTERNAL_COMPRESSORS, CompressorNotFoundError, open_output,
+    triples_to_string)
+
+_ChunkResult = namedtuple(
+    '_ChunkResult',
+    'outputs, entity_count, line_count, byte_count, last_subject, '
+    'metrics')
+
 def main():
     """
     Main function of the program. Reads the input file line by line,
-    parsing the lines as it proceeds. When it finds that it has read
-    all lines for a given entity ID, it filters the parsed lines
-    according to the configuration file and either writes or avoids
-    writing the parsed data into the output file. It then repeats this
-    process of reading, parsing, filtering and possibly writing data
-    until all lines of the input file have been processed.
+    parsing the lines as it proceeds (see extract_chunk). When it finds
+    that it has read all lines for a given entity ID, it filters the
+    parsed lines according to the configuration file and either writes
+    or avoids writing the parsed data into the output file. It then
+    repeats this process of reading, parsing, filtering and possibly
+    writing data until all lines of the input file have been processed.
+
+    If the configuration file declares several outputs (see
+    compile_outputs), every entity is parsed once and routed to each
+    output whose condition it meets.
+
+    The input is processed in chunks which end on entity boundaries.
+    With --workers N, the chunks are processed by a pool of N worker
+    processes, see process_chunks. After a chunk has been written, a
+    checkpoint is saved if one is due, and --resume continues an
+    interrupted run from its last checkpoint. Runs with a compressed
+    output (.gz or .zst) are not checkpointed, because a compressed
+    output cannot be truncated to the length of a checkpoint.
+
+    With --input-format turtle, the input is a Turtle document, which is
+    converted into RDF lines while it is read (see iter_turtle_rdf_lines).
+    Such runs are not checkpointed, because the position in the
+    converted lines does not correspond to a position in the input.
+
+    With --metrics FILE, the run is instrumented (see
+    src.freebase.metrics), and the metrics are written into FILE every
+    --metrics-seconds, as a Prometheus textfile if FILE ends with .prom
+    and as JSON otherwise. With --profile FILE, one of every
+    --profile-every chunks is profiled with cProfile.
+
+    With --group-subjects, the triples of every subject are grouped
+    wherever they are in the input, for dumps whose subjects are not
+    contiguous (see src.freebase.grouping). Grouped runs read the whole
+    input before they write the first entity, so they use neither
+    workers nor checkpoints, and they are not instrumented.
+
+    With --entity-index, an entity index (see src.freebase.entity_index)
+    is built for every uncompressed output after the extraction, and
+    with --link-index, an index of the link rows (see
+    src.freebase.link_index), which needs NumPy. A link index which is
+    current, because the output has not changed since it was built, is
+    kept.
     """
-    with open('src/config.json', 'r') as config_file:
+    args = _parse_arguments()
+    if args.input_format == 'turtle':
+        if args.resume:
+            print("Turtle input cannot be resumed.")
+            return
+        args.checkpoint_seconds = 0
+    if args.group_subjects:
+        if args.resume or args.metrics is not None:
+            print("Grouped runs cannot be resumed or instrumented.")
+            return
+        args.checkpoint_seconds = 0
+    with open(args.config, 'r') as config_file:
         config = json.loads(config_file.read())
+    plan = compile_config(config)
     try:
-        if config['input_file_name'].endswith('.gz'):
-            print("Input file's name ends with .gz.")
-            print("Processing it as a gzip archive.")
-            input_file = gzip.open(config['input_file_name'], 'rt', encoding='utf-8')
+        output_plans = compile_outputs(config, plan)
+    except ValueError as error:
+        print("Invalid outputs in {}: {}.".format(args.config, error))
+        return
+    if any(os.path.splitext(output_plan.output_file_name)[1]
+           in EXTERNAL_COMPRESSORS for output_plan in output_plans):
+        if args.resume:
+            print("Compressed outputs cannot be resumed.")
+            return
+        args.checkpoint_seconds = 0
+    checkpoint_file_name = (
+        output_plans[0].output_file_name + '.checkpoint')
+    state = None
+    if args.resume:
+        state = load_checkpoint(checkpoint_file_name)
+        if state is None:
+            print("No checkpoint found, starting from the beginning.")
+        elif (state['input_file_name'] != config['input_file_name']
+              or len(state['output_lengths']) != len(output_plans)):
+            print("The checkpoint is for a different configuration,")
+            print("not resuming.")
+            return
         else:
-            print("Input file's name does not end with .gz")
-            print("Processing it as a text file.")
-            input_file = open(config['input_file_name'], 'rt', encoding='utf-8')
-        output_file = open(config['output_file_name'], 'wt', encoding='utf-8')
-        processing_begin = time.time()
-        first_tuple = None
-        processed_lines = 0
-        while first_tuple is None:
-            line = input_file.readline()
-            first_tuple = parse_and_localize(line, config)
-            processed_lines += 1
-        current_entity_id = first_tuple.subject
-        entity_tuples = [first_tuple,]
-        condition = (
-            config['condition']['predicate_id'],
-            config['condition']['predicate_value'])
-        for line in input_file:
-            tuple = parse_and_localize(line, config)
-            processed_lines += 1
-            if tuple is None: continue
-            if tuple.subject == current_entity_id:
-                entity_tuples.append(tuple)
-            else:
-                if (filter_and_write(entity_tuples, config, condition, output_file)):
-                    print("Entity ID: {}".format(current_entity_id))
-                    print(processed_lines, (time.time() - processing_begin))
-                entity_tuples = [tuple,]
-                current_entity_id = tuple.subject
-        if (filter_and_write(entity_tuples, config, condition, output_file)):
-            print("Entity ID: {}".format(current_entity_id))
-            print(processed_lines, (time.time() - processing_begin))
-    except FileNotFoundError:
-        print("{} not found.".format(config['input_file_name']))
+            print("Resuming after entity {}, {} lines into the input."
+                .format(state['last_subject'], state['line_count']))
+    # closes the input and the outputs opened so far, whatever happens
+    open_files = contextlib.ExitStack()
+    try:
+        input_file = open_dump(
+            config['input_file_name'], args.decompressor,
+            skip_bytes=0 if state is None else state['input_offset'])
+        open_files.callback(input_file.close)
+        print("Reading {} ({}).".format(
+            config['input_file_name'], input_file.method))
+        output_files = []
+        for i, output_plan in enumerate(output_plans):
+            output_files.append(open_output(
+                output_plan.output_file_name,
+                resume_length=(
+                    None if state is None else state['output_lengths'][i])))
+            open_files.callback(output_files[-1].close)
+        progress = ProgressReporter(
+            input_file, args.progress_entities, args.progress_seconds)
+        metrics = exporter = None
+        if args.metrics is not None:
+            metrics = ExtractionMetrics()
+            exporter = MetricsExporter(
+                metrics, args.metrics, args.metrics_seconds)
+            initial_bytes = sum(f.bytes_written for f in output_files)
+        checkpointer = Checkpointer(
+            checkpoint_file_name, config['input_file_name'],
+            input_file, output_files, args.checkpoint_seconds, state)
+        lines = input_file
+        if args.input_format == 'turtle':
+            lines = _turtle_to_rdf_lines(input_file)
+        if args.group_subjects:
+            _extract_grouped(
+                lines, plan, output_plans, output_files, progress, args)
+        else:
+            chunks = read_entity_chunks(lines, plan, args.chunk_lines)
+            profile = None
+            if args.profile is not None:
+                profile = (args.profile, args.profile_every)
+            if metrics is not None:
+                chunks = _timed_chunks(chunks, metrics)
+            for result in process_chunks(
+                    chunks, plan, output_plans, args.workers,
+                    metrics is not None, profile):
+                begin = time.perf_counter()
+                for output_file, output in zip(output_files, result.outputs):
+                    output_file.write(output)
+                if metrics is not None:
+                    metrics.add_stage_time(
+                        'write', time.perf_counter() - begin)
+                    metrics.merge(result.metrics)
+                    metrics.bytes_out = sum(
+                        f.bytes_written for f in output_files) - initial_bytes
+                    exporter.export_if_due()
+                progress.add(result.line_count, result.entity_count)
+                checkpointer.chunk_done(
+                    result.byte_count, result.line_count,
+                    result.entity_count, result.last_subject)
+        progress.finish()
+        if exporter is not None:
+            exporter.export()
+    except FileNotFoundError as error:
+        # the input, or with --resume, an output which does not exist
+        print("{} not found.".format(error.filename))
+    except DecompressorNotFoundError as error:
+        print("Cannot read {}: {}.".format(config['input_file_name'], error))
+    except CompressorNotFoundError as error:
+        print("Cannot write the output: {}.".format(error))
     else:
-        input_file.close()
-        output_file.close()
+        open_files.close()
+        checkpointer.finish()
+        if args.entity_index or args.link_index:
+            _build_indexes(output_plans, args.entity_index, args.link_index)
+    finally:
+        open_files.close()
   
-def triples_to_string(localized_triples):
+def process_chunks(chunks, plan, output_plans, workers=1,
+                   instrumented=False, profile=None):
     """
-    Transforms a list of localized triples into a string, where the
-    respective triples are separated with new line characters, while
-    the fields of each triple are separated with tabs.
+    Parses chunks of lines (see read_entity_chunks) according to an
+    extraction plan, routes their entities to the outputs described by
+    output_plans (see compile_outputs) and yields a _ChunkResult for
+    every chunk, in the input order. With more than one worker, the
+    chunks are processed by a pool of worker processes, and the
+    throughput of every worker is printed at the end.
+
+    If instrumented is true, every _ChunkResult has the ExtractionMetrics
+    of its chunk. If profile is a (file name, every_chunks) tuple, the
+    chunks are sampled by a ChunkProfiler.
     """
-    string_list = []
-    for t in localized_triples:
-        subject = str(t[0].encode('utf-8')).lstrip('b').strip('\'')
-        predicate_id = t[1]
-        object = str(t[2].encode('utf-8')).lstrip('b').strip('\'')
-        lang = t[3]
-        item_list = [subject, predicate_id, object, lang]
-        string_list.append('\t'.join(item_list))
-    return '\n'.join(string_list) + '\n'
-
-def filter_and_write(entity_tuples, config, condition, output_file):
+    if workers <= 1:
+        profiler = None if profile is None else ChunkProfiler(*profile)
+        for chunk in chunks:
+            yield _extract_chunk(
+                chunk, plan, output_plans, instrumented, profiler)
+        if profiler is not None:
+            profiler.save()
+        return
+    worker_stats = collections.defaultdict(lambda: [0, 0.0])
+    with multiprocessing.Pool(
+            workers, _initialize_worker,
+            (plan, output_plans, instrumented, profile)) as pool:
+        pending = collections.deque()
+        while True:
+            # keep a bounded number of chunks in flight
+            for chunk in chunks:
+                pending.append(pool.apply_async(_process_chunk, (chunk,)))
+                if len(pending) >= 2 * workers:
+                    break
+            if not pending:
+                break
+            result, pid, busy_time = pending.popleft().get()
+            worker_stats[pid][0] += result.line_count
+            worker_stats[pid][1] += busy_time
+            yield result
+    for pid, (line_count, busy_time) in sorted(worker_stats.items()):
+        print("worker {}: {} lines in {:.2f} s, {:.0f} lines/sec".format(
+            pid, line_count, busy_time,
+            line_count / busy_time if busy_time > 0 else 0))
+
+def extract_chunk(lines, plan, output_plans, metrics=None):
     """
-    Filters a list of parsed entity tuples according to a configuration
-    dict. It applies two separate filters:
-    - 1. it only keeps those tuples which meet the extraction criteria
-    - 2. it only keeps those entities which meet the condition
-         specified in the configuration dict
-    If it was decided that the entity should be kept and its parsed
-    data was written to a file, it returns True. Otherwise the function
-    returns False.
+    Extracts the entities of a chunk of lines for every output, and
+    returns a _ChunkResult with the formatted outputs and the counts
+    needed for progress reporting and checkpoints. Outputs whose file
+    name ends with .fbc are encoded as a columnar chunk (see
+    src.freebase.columnar), compressed if the output's config has a
+    "columnar_compression" entry of "zlib". The lines are UTF-8 encoded
+    bytes, which iter_entities groups into entities with CompactTriples
+    (see src.freebase.compact), so that only the triples which are kept
+    are decoded.
+
+    If metrics (an ExtractionMetrics object) is given, the lines and
+    entities of the chunk are counted into it and its stages are timed,
+    and it is returned as the metrics of the _ChunkResult.
     """
-    filtered_triples = filter_triples(entity_tuples, config)
-    predicate_id_value_list = [(t[1], t[2]) for t in filtered_triples]
-    if condition in predicate_id_value_list:
-        output_file.write(triples_to_string(filtered_triples))
-        return True
-    else:
-        return False
-        
+    if metrics is not None:
+        return _extract_chunk_with_metrics(
+            lines, plan, output_plans, metrics)
+    routed_entities = route_entities(
+        iter_entities(lines, plan, PairTable().new_triples),
+        [output_plan.plan for output_plan in output_plans])
+    outputs, entity_count = _format_outputs(routed_entities, output_plans)
+    return _ChunkResult(
+        outputs=outputs,
+        entity_count=entity_count,
+        line_count=len(lines),
+        byte_count=sum(map(len, lines)),
+        last_subject=_last_parsed_subject(lines, plan),
+        metrics=None)
+
+def read_entity_chunks(input_file, plan, chunk_lines):
+    """
+    Reads lines from the binary input file (or any iterable of bytes
+    lines) and yields them in lists of at least chunk_lines lines
+    (except for the last one). A chunk only ends before a parsed line
+    whose subject differs from the subject of the last parsed line in
+    the chunk, so that no entity is split across chunks.
+    """
+    chunk_lines = max(chunk_lines, 1)
+    chunk = []
+    last_subject = None
+    for line in input_file:
+        if len(chunk) < chunk_lines:
+            chunk.append(line)
+            continue
+        if len(chunk) == chunk_lines:
+            last_subject = _last_parsed_subject(chunk, plan)
+        tuple = parse_and_localize_target_bytes(line, plan)
+        if tuple is None or tuple.subject == last_subject:
+            chunk.append(line)
+        else:
+            yield chunk
+            chunk = [line,]
+    if chunk:
+        yield chunk
+
+def _format_outputs(routed_entities, output_plans):
+    # the formatted outputs of routed entities, and the entity count
+    output_files = [
+        [] if is_columnar_file_name(output_plan.output_file_name)
+        else io.StringIO()
+        for output_plan in output_plans]
+    entity_count = 0
+    for index, _, triples in routed_entities:
+        # without a condition, entities whose triples were all filtered
+        # out are routed too, but they have no rows to write
+        if not triples:
+            continue
+        output_file = output_files[index]
+        if isinstance(output_file, list):
+            output_file.append(triples_to_rows(triples))
+        else:
+            output_file.write(triples_to_string(triples))
+        entity_count += 1
+    outputs = []
+    for output_plan, output_file in zip(output_plans, output_files):
+        if isinstance(output_file, list):
+            outputs.append(encode_chunk(
+                output_file,
+                output_plan.plan.config.get('columnar_compression', None)))
+        else:
+            outputs.append(output_file.getvalue())
+    return outputs, entity_count
+
+def _extract_chunk_with_metrics(lines, plan, output_plans, metrics):
+    # extract_chunk with timed stages, which are run one after the other
+    begin = time.perf_counter()
+    entities = list(iter_entities(lines, plan, PairTable().new_triples))
+    parsed = time.perf_counter()
+    routed_entities = list(route_entities(
+        entities, [output_plan.plan for output_plan in output_plans]))
+    filtered = time.perf_counter()
+    outputs, entity_count = _format_outputs(routed_entities, output_plans)
+    formatted = time.perf_counter()
+    metrics.add_stage_time('parse', parsed - begin)
+    metrics.add_stage_time('filter', filtered - parsed)
+    metrics.add_stage_time('format', formatted - filtered)
+    metrics.count_lines(lines, plan)
+    metrics.count_entities(entities)
+    metrics.entities_kept += entity_count
+    return _ChunkResult(
+        outputs=outputs,
+        entity_count=entity_count,
+        line_count=len(lines),
+        byte_count=sum(map(len, lines)),
+        last_subject=_last_parsed_subject(lines, plan),
+        metrics=metrics)
+
+def _extract_grouped(lines, plan, output_plans, output_files, progress,
+                     args):
+    grouper = SubjectGrouper(
+        plan, args.group_directory, args.group_memory * 2 ** 20)
+    begin = time.time()
+    line_count = 0
+    batch = []
+    for entity in grouper.group(lines):
+        batch.append(entity)
+        if len(batch) == 10000:
+            line_count = _write_grouped(
+                batch, grouper, output_plans, output_files, progress,
+                line_count)
+            batch = []
+    _write_grouped(
+        batch, grouper, output_plans, output_files, progress, line_count)
+    elapsed = time.time() - begin
+    print("Grouped {} triples of {} lines into {} entities in {:.1f} s "
+          "({:.0f} lines/sec), spilling {} runs of {:.1f} MB, "
+          "peak RSS {:.1f} MB.".format(
+              grouper.triple_count, grouper.line_count,
+              grouper.entity_count, elapsed,
+              grouper.line_count / elapsed if elapsed > 0 else 0,
+              grouper.run_count, grouper.spilled_bytes / 2 ** 20,
+              _peak_rss_bytes() / 2 ** 20))
+
+def _write_grouped(entities, grouper, output_plans, output_files, progress,
+                   line_count):
+    # writes a batch of grouped entities, and returns the number of lines
+    # counted by the progress reporter so far
+    outputs, entity_count = _format_outputs(
+        route_entities(
+            entities, [output_plan.plan for output_plan in output_plans]),
+        output_plans)
+    for output_file, output in zip(output_files, outputs):
+        output_file.write(output)
+    progress.add(grouper.line_count - line_count, entity_count)
+    return grouper.line_count
+
+def _peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux, and in bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+def _last_parsed_subject(lines, plan):
+    for line in reversed(lines):
+        tuple = parse_and_localize_target_bytes(line, plan)
+        if tuple is not None:
+            return tuple.subject
+    return None
+
+def _turtle_to_rdf_lines(input_file):
+    turtle_lines = (line.decode('utf-8') for line in input_file)
+    for line in iter_turtle_rdf_lines(turtle_lines):
+        yield line.encode('utf-8')
+
+def _timed_chunks(chunks, metrics):
+    # the time spent reading (and decompressing) the input
+    chunks = iter(chunks)
+    while True:
+        begin = time.perf_counter()
+        chunk = next(chunks, None)
+        metrics.add_stage_time('read', time.perf_counter() - begin)
+        if chunk is None:
+            return
+        yield chunk
+
+def _extract_chunk(lines, plan, output_plans, instrumented, profiler):
+    metrics = ExtractionMetrics() if instrumented else None
+    if profiler is None:
+        return extract_chunk(lines, plan, output_plans, metrics)
+    return profiler.run(extract_chunk, lines, plan, output_plans, metrics)
+
+def _initialize_worker(plan, output_plans, instrumented, profile):
+    global _worker_plan, _worker_output_plans, _worker_instrumented
+    global _worker_profiler
+    _worker_plan = plan
+    _worker_output_plans = output_plans
+    _worker_instrumented = instrumented
+    _worker_profiler = None
+    if profile is not None:
+        _worker_profiler = ChunkProfiler(*profile, in_worker=True)
+
+def _process_chunk(lines):
+    begin = time.time()
+    result = _extract_chunk(
+        lines, _worker_plan, _worker_output_plans, _worker_instrumented,
+        _worker_profiler)
+    return result, os.getpid(), time.time() - begin
+
+def _build_indexes(output_plans, entity_index, link_index):
+    if link_index:
+        # imported here, so that NumPy is only needed for link indexes
+        from src.freebase.link_index import (
+            build_link_index, link_index_is_current)
+    for output_plan in output_plans:
+        file_name = output_plan.output_file_name
+        if os.path.splitext(file_name)[1] in EXTERNAL_COMPRESSORS:
+            print("{} is compressed, not indexing it.".format(file_name))
+            continue
+        if entity_index:
+            entity_count = build_entity_index(file_name)
+            print("Indexed {} entities of {}.".format(
+                entity_count, file_name))
+        if link_index and link_index_is_current(file_name):
+            print("The link index of {} is current.".format(file_name))
+        elif link_index:
+            link_count = build_link_index(file_name)
+            print("Indexed {} links of {}.".format(link_count, file_name))
+
+def _parse_arguments():
+    argument_parser = argparse.ArgumentParser(
+        description="Extracts data from a Freebase data dump.")
+    argument_parser.add_argument(
+        '--config', default='src/config.json',
+        help="configuration file (default: src/config.json)")
+    argument_parser.add_argument(
+        '--workers', type=int, default=1,
+        help="number of worker processes (default: 1, no pool)")
+    argument_parser.add_argument(
+        '--chunk-lines', type=int, default=100000,
+        help="approximate number of input lines per chunk")
+    argument_parser.add_argument(
+        '--decompressor', default='auto',
+        choices=['auto', 'external', 'zlib', 'none'],
+        help="how compressed input is decompressed (default: auto)")
+    argument_parser.add_argument(
+        '--progress-entities', type=int, default=100000,
+        help="print progress after this many written entities")
+    argument_parser.add_argument(
+        '--progress-seconds', type=float, default=10.0,
+        help="print progress at least this often while reading")
+    argument_parser.add_argument(
+        '--checkpoint-seconds', type=float, default=300.0,
+        help="save a checkpoint this often (0 disables checkpoints)")
+    argument_parser.add_argument(
+        '--input-format', default='ntriples',
+        choices=['ntriples', 'turtle'],
+        help="format of the input (default: ntriples, as in the dumps)")
+    argument_parser.add_argument(
+        '--metrics',
+        help="instrument the run and write its metrics into this file "
+             "(Prometheus textfile if it ends with .prom, else JSON)")
+    argument_parser.add_argument(
+        '--metrics-seconds', type=float, default=60.0,
+        help="write the metrics this often (default: 60)")
+    argument_parser.add_argument(
+        '--profile',
+        help="profile a sample of the chunks with cProfile, and save the "
+             "statistics into this file")
+    argument_parser.add_argument(
+        '--profile-every', type=int, default=10,
+        help="profile one of this many chunks (default: 10)")
+    argument_parser.add_argument(
+        '--group-subjects', action='store_true',
+        help="group the triples of subjects which are not contiguous")
+    argument_parser.add_argument(
+        '--group-memory', type=int, default=256,
+        help="memory budget of the grouping in MB (default: 256)")
+    argument_parser.add_argument(
+        '--group-directory',
+        help="directory for the spilled runs of the grouping "
+             "(default: the system's temporary directory)")
+    argument_parser.add_argument(
+        '--entity-index', action='store_true',
+        help="build the entity lookup index of every output")
+    argument_parser.add_argument(
+        '--link-index', action='store_true',
+        help="build the index of the link rows of every output")
+    argument_parser.add_argument(
+        '--resume', action='store_true',
+        help="resume from the checkpoint of an interrupted run")
+    return argument_parser.parse_args()
+
 if __name__ == "__main__":
     main()
        
\ No newline at end of file
@@ -3,12 +3,18 @@ A sample console application which uses the data parsed from Freebase
 to create a very simple search engine.
 """
 
+import collections
 import json
 import os
 import sys
+import time
+import zlib
 import whoosh.fields
 import whoosh.index
 import whoosh.qparser
+from src.freebase.columnar import ColumnarFile, is_columnar_file_name
+from src.freebase.entity_index import (
+    EntityIndex, build_entity_index, entity_index_is_current)
 
 def main():
     """
@@ -22,16 +28,40 @@ def main():
     the results are limited to the specified language. For displaying
     only information which link to other entities, specify "link" as
     the filter language.
+
+    The Whoosh index is created once, and is then updated with the
+    rows which were appended to the output file (see
+    update_whoosh_index). The number of indexing processes is the
+    "index_processes" entry of the configuration (default: 1).
+
+    Entity lookups are answered by the entity index of the output file
+    (see src.freebase.entity_index), which is built if it is missing or
+    out of date. Only the search in the object data uses Whoosh, through
+    a WhooshSearchSession which stays open while the application runs.
     """
     with open('src/config.json', 'r') as config_file:
         config = json.loads(config_file.read())
+    begin = time.time()
     if whoosh_index_exists_in(config['index_directory']):
-        print("index already exists, not re-creating it")
+        print("index already exists, adding new rows to it")
+        row_count = update_whoosh_index(
+            config['output_file_name'],
+            config['index_directory'],
+            config.get('index_processes', 1))
     else:
         print("index does not yet exist, creating it")
-        create_whoosh_index(
+        row_count = create_whoosh_index(
             config['output_file_name'],
-            config['index_directory'])
+            config['index_directory'],
+            config.get('index_processes', 1))
+    elapsed = time.time() - begin
+    print("indexed {} rows in {:.1f} s ({:.0f} docs/sec)".format(
+        row_count, elapsed, row_count / max(elapsed, 1e-9)))
+    if not entity_index_is_current(config['output_file_name']):
+        print("entity index does not yet exist, creating it")
+        build_entity_index(config['output_file_name'])
+    entity_index = EntityIndex(config['output_file_name'])
+    search_session = WhooshSearchSession(config['index_directory'])
     print("type #exit to exit, #help for help")
     while True:
         user_input = input(">> ")
@@ -42,20 +72,16 @@ def main():
         elif user_input.startswith('#all_about'):
             tokens = user_input.split(' ', maxsplit=2)
             search_term = tokens[1]
-            if len(tokens) == 3:
-                lang = tokens[2]
-                filter_function = (lambda x: x[3] == lang)
-            else:
-                filter_function = (lambda _: True)
-            results = search_whoosh_index(
-                search_term, 'entity_id', config['index_directory'])
-            filtered_results = filter(filter_function, results)
-            print('\n'.join([str(x) for x in filtered_results]))
+            lang = tokens[2] if len(tokens) == 3 else None
+            results = entity_index.lookup(search_term, lang)
+            print('\n'.join([str(x) for x in results]))
         else:
-            results = search_whoosh_index(
-                user_input, 'object', config['index_directory'])
+            print("searching for {} in object".format(user_input))
+            results = search_session.search(user_input, 'object')
             print('\n'.join([str(x) for x in results]))
-            
+    search_session.close()
+    entity_index.close()
+
 def whoosh_index_exists_in(index_directory):
     """
     Checks whether a directory exists, and if so, if it also contains
@@ -67,9 +93,16 @@ def whoosh_index_exists_in(index_directory):
         return False
     return True
 
-def create_whoosh_index(parse_file_name, index_directory):
+def create_whoosh_index(parse_file_name, index_directory, procs=1,
+                        limitmb=128, batch_size=1000):
     """
-    Creates a Whoosh index from data stored in an input file.
+    Creates a Whoosh index from data stored in an input file, which is
+    either the text output of the extraction or a columnar file, and
+    records the watermark of the indexed rows (see update_whoosh_index).
+    With procs > 1, the documents are indexed by that many processes,
+    which receive them in batches of batch_size documents. Each writer
+    uses up to limitmb megabytes of memory. Returns the number of
+    indexed rows.
     """
     if os.path.isdir(index_directory) is False:
         print("{} is not a directory."
@@ -83,17 +116,62 @@ def create_whoosh_index(parse_file_name, index_directory):
         lang = whoosh.fields.STORED)
     whoosh_index = whoosh.index.create_in(
         index_directory, whoosh_schema)
-    index_writer = whoosh_index.writer()
-    with open(parse_file_name, 'rt', encoding='utf-8') as input_file:
+    return _add_rows_to_whoosh_index(
+        whoosh_index, parse_file_name, index_directory, (0, 0), procs,
+        limitmb, batch_size, multisegment=True)
+
+def update_whoosh_index(parse_file_name, index_directory, procs=1,
+                        limitmb=128, batch_size=1000):
+    """
+    Adds the rows which were appended to an input file since the last
+    build or update of the Whoosh index. The index records a watermark,
+    the position in the input file up to which its rows are indexed, and
+    the CRC-32 of all data of the input file before the watermark, which
+    every update extends with the data it adds. If the input file is
+    shorter than the watermark or the CRC-32 of its data before the
+    watermark differs, the input file was rewritten, and the index is
+    created again. Checking this reads the indexed part of the input
+    file once. See create_whoosh_index for the other arguments. Returns
+    the number of indexed rows.
+    """
+    watermark = _read_watermark(parse_file_name, index_directory)
+    if (watermark is None
+            or not whoosh_index_exists_in(index_directory)):
+        return create_whoosh_index(
+            parse_file_name, index_directory, procs, limitmb, batch_size)
+    return _add_rows_to_whoosh_index(
+        whoosh.index.open_dir(index_directory), parse_file_name,
+        index_directory, watermark, procs, limitmb, batch_size,
+        multisegment=False)
+
+def read_parsed_rows(parse_file_name, begin=0, end=None):
+    """
+    Reads the rows of an output file of the extraction, and yields them
+    as (entity ID, predicate ID, object, lang) tuples. Files with names
+    ending with .fbc are read as columnar files. If begin or end are
+    given, only the rows between these positions of the file are read;
+    they must be the positions of line or chunk boundaries.
+    """
+    if is_columnar_file_name(parse_file_name):
+        with ColumnarFile(parse_file_name) as columnar_file:
+            position = 0
+            for chunk in columnar_file.chunks:
+                if end is not None and position >= end:
+                    break
+                if position >= begin:
+                    yield from chunk.rows()
+                position += chunk.length
+        return
+    with open(parse_file_name, 'rb') as input_file:
+        input_file.seek(begin)
+        position = begin
         for line in input_file:
-            tokens = line.rstrip('\n').split('\t')
+            if end is not None and position >= end:
+                break
+            position += len(line)
+            tokens = line.decode('utf-8').rstrip('\n').split('\t')
             assert(len(tokens) == 4)
-            index_writer.add_document(
-                entity_id = tokens[0],
-                predicate_id = tokens[1],
-                object = tokens[2],
-                lang = tokens[3])
-    index_writer.commit()
+            yield tuple(tokens)
 
 def search_whoosh_index(search_term, searched_field, index_directory):
     """
@@ -118,6 +196,170 @@ def search_whoosh_index(search_term, searched_field, index_directory):
             )
             for result in results]
     return result_list
-    
+
+class WhooshSearchSession:
+    """
+    A Whoosh index opened for any number of searches. The searcher is
+    kept open, and is refreshed when the index has changed, which is
+    checked at most every refresh_seconds. Parsed queries and the
+    results of the last max_cached_results searches are cached, and the
+    cached results are dropped when the searcher is refreshed.
+    """
+    def __init__(self, index_directory, max_cached_results=256,
+                 refresh_seconds=1.0):
+        self.max_cached_results = max_cached_results
+        self.refresh_seconds = refresh_seconds
+        self._whoosh_index = whoosh.index.open_dir(index_directory)
+        self._searcher = self._whoosh_index.searcher()
+        self._refresh_time = time.monotonic()
+        self._query_parsers = {}
+        self._queries = {}
+        self._results = collections.OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def search(self, search_term, searched_field):
+        """
+        Searches the index and returns the result as a list of tuples,
+        like search_whoosh_index.
+        """
+        self._refresh_if_due()
+        key = (search_term, searched_field)
+        result_list = self._results.get(key, None)
+        if result_list is not None:
+            self._results.move_to_end(key)
+            return result_list
+        query = self._queries.get(key, None)
+        if query is None:
+            query_parser = self._query_parsers.get(searched_field, None)
+            if query_parser is None:
+                query_parser = whoosh.qparser.QueryParser(
+                    searched_field, self._whoosh_index.schema)
+                self._query_parsers[searched_field] = query_parser
+            query = query_parser.parse(search_term)
+            if len(self._queries) >= self.max_cached_results:
+                self._queries.clear()
+            self._queries[key] = query
+        result_list = [
+            (
+                result['entity_id'],
+                result['predicate_id'],
+                result['object'],
+                result['lang']
+            )
+            for result in self._searcher.search(query)]
+        self._results[key] = result_list
+        if len(self._results) > self.max_cached_results:
+            self._results.popitem(last=False)
+        return result_list
+
+    def close(self):
+        """Closes the searcher."""
+        self._searcher.close()
+
+    def _refresh_if_due(self):
+        now = time.monotonic()
+        if now - self._refresh_time < self.refresh_seconds:
+            return
+        self._refresh_time = now
+        if not self._searcher.up_to_date():
+            # a new searcher, which opens the new segments, replaces the
+            # old one, which is closed with its files
+            searcher = self._whoosh_index.searcher()
+            self._searcher.close()
+            self._searcher = searcher
+            self._results.clear()
+
+_WATERMARK_FILE_NAME = 'watermark.json'
+
+def _add_rows_to_whoosh_index(whoosh_index, parse_file_name,
+                              index_directory, watermark, procs, limitmb,
+                              batch_size, multisegment):
+    # watermark is the (position, checksum) of the indexed data
+    begin, checksum = watermark
+    end = _complete_length(parse_file_name)
+    if procs > 1:
+        index_writer = whoosh_index.writer(
+            procs=procs, limitmb=limitmb, batchsize=batch_size,
+            multisegment=multisegment)
+    else:
+        index_writer = whoosh_index.writer(limitmb=limitmb)
+    row_count = 0
+    for tokens in read_parsed_rows(parse_file_name, begin, end):
+        index_writer.add_document(
+            entity_id = tokens[0],
+            predicate_id = tokens[1],
+            object = tokens[2],
+            lang = tokens[3])
+        row_count += 1
+    index_writer.commit()
+    _write_watermark(
+        parse_file_name, index_directory, end,
+        _checksum(parse_file_name, begin, end, checksum))
+    return row_count
+
+def _complete_length(parse_file_name):
+    # the length of the complete lines or chunks of an output file, which
+    # may be written while it is indexed
+    if is_columnar_file_name(parse_file_name):
+        with ColumnarFile(parse_file_name) as columnar_file:
+            return columnar_file.length
+    with open(parse_file_name, 'rb') as input_file:
+        length = input_file.seek(0, os.SEEK_END)
+        while length > 0:
+            block_begin = max(0, length - 65536)
+            input_file.seek(block_begin)
+            block = input_file.read(length - block_begin)
+            newline = block.rfind(b'\n')
+            if newline >= 0:
+                return block_begin + newline + 1
+            length = block_begin
+        return 0
+
+def _checksum(parse_file_name, begin, end, checksum=0):
+    # the CRC-32 of the data of a file up to end, given the CRC-32 of
+    # the data up to begin
+    with open(parse_file_name, 'rb') as input_file:
+        input_file.seek(begin)
+        position = begin
+        while position < end:
+            block = input_file.read(min(end - position, 2 ** 20))
+            if not block:
+                break
+            checksum = zlib.crc32(block, checksum)
+            position += len(block)
+    return checksum
+
+def _write_watermark(parse_file_name, index_directory, watermark,
+                     checksum):
+    with open(os.path.join(index_directory, _WATERMARK_FILE_NAME),
+              'wt') as watermark_file:
+        watermark_file.write(json.dumps({
+            'parse_file_name': os.path.abspath(parse_file_name),
+            'watermark': watermark,
+            'checksum': checksum,
+        }))
+
+def _read_watermark(parse_file_name, index_directory):
+    # returns the (position, checksum) of the indexed data, or None if
+    # the index must be created again
+    try:
+        with open(os.path.join(index_directory, _WATERMARK_FILE_NAME),
+                  'rt') as watermark_file:
+            state = json.loads(watermark_file.read())
+    except (FileNotFoundError, ValueError):
+        return None
+    watermark = state['watermark']
+    if (state['parse_file_name'] != os.path.abspath(parse_file_name)
+            or os.path.getsize(parse_file_name) < watermark
+            or _checksum(parse_file_name, 0, watermark)
+                != state.get('checksum', None)):
+        return None
+    return watermark, state['checksum']
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,68 @@
+"""
+Fifth part of the test suite. Checks that the links of batched MQL
+queries are not longer than the limit when they are sent, also when the
+entity ID's, the predicates and the API key have characters which have
+to be percent-encoded.
+"""
+
+import sys
+import requests
+from src.freebase.api import create_batched_queries
+
+_PREDICATE_URLS = [
+    '<http://rdf.freebase.com/ns/type.object.name>',
+    '<http://rdf.freebase.com/ns/common.topic.alias>',
+    '<http://rdf.freebase.com/ns/base.ünïcode"predicate {x}>',
+]
+
+_ENTITY_IDS = (
+    ['m.0{}'.format(i) for i in range(300)]
+    + ['m.0 "{}" {{}}'.format(i) for i in range(300)]
+    + ['m.ž{}ř%'.format(i) for i in range(300)])
+
+def main():
+    """
+    Main function of the test program. Creates batched queries with
+    several limits, and checks that the links which requests sends are
+    at most as long as the limit, that no link could have held the
+    first entity of the next link of the same language, and that every
+    entity is in one query per language.
+    """
+    failures = 0
+    for max_url_length in [500, 1000, 4000]:
+        queries = create_batched_queries(
+            ['en', 'de'], _PREDICATE_URLS, 'https://example.com/mql/',
+            'key with spaces\n', _ENTITY_IDS, max_url_length)
+        sent_lengths = [
+            len(requests.Request('GET', query.link).prepare().url)
+            for query in queries]
+        if max(sent_lengths) > max_url_length:
+            print("FAILED: a link of {} characters, limit {}".format(
+                max(sent_lengths), max_url_length))
+            failures += 1
+        for query, next_query in zip(queries, queries[1:]):
+            if next_query.lang != query.lang:
+                continue
+            extended_link = create_batched_queries(
+                [query.lang], _PREDICATE_URLS, 'https://example.com/mql/',
+                'key with spaces\n',
+                query.entity_ids + next_query.entity_ids[:1],
+                max_url_length=10 ** 6)[0].link
+            if len(extended_link) <= max_url_length:
+                print("FAILED: a link of {} characters could hold the "
+                      "next entity".format(len(query.link)))
+                failures += 1
+        for lang in ['en', 'de']:
+            entity_ids = [
+                entity_id for query in queries if query.lang == lang
+                for entity_id in query.entity_ids]
+            if entity_ids != _ENTITY_IDS:
+                print("FAILED: the {} queries lose entities".format(lang))
+                failures += 1
+        print("limit {}: {} queries, longest link {} characters".format(
+            max_url_length, len(queries), max(sent_lengths)))
+    print("tests ended")
+    sys.exit(1 if failures > 0 else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1287 @@
+"""
+Benchmarks for the Freebase extraction code. Each benchmark is a
+function which prints its measurements. Run all of them with
+python -m test.benchmark, or only some of them by passing their names
+as arguments.
+"""
+
+import collections
+import contextlib
+import gzip
+import http.server
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+import numpy
+import whoosh.index
+from src import sample_app
+from src.freebase.api import *
+from src.freebase.cache import ResponseCache
+from src.freebase.columnar import ColumnarFile, encode_chunk
+from src.freebase.compact import PairTable
+from src.freebase.entity_index import EntityIndex, build_entity_index
+from src.freebase.link_index import (
+    LinkIndex, build_link_index, link_index_directory_for)
+from src.freebase.metrics import ChunkProfiler, ExtractionMetrics
+from src.freebase.condition import *
+from src.freebase.parser import *
+from src.freebase.reader import open_dump
+from src.freebase.turtle import PrefixIndex, iter_turtle_rdf_lines
+from src.parse_all import extract_chunk, read_entity_chunks
+from test.parse_and_test import compare_two_lists
+from test.synthetic_dump import (
+    DEFAULT_PREDICATE_MIX, default_spec, generate_dump, iter_entity_lines,
+    rdf_lines_to_turtle_topics)
+from test.timing import best_time
+
+def main():
+    """
+    Main function of the benchmark program. Runs the benchmarks named on
+    the command line, or all of them if no names are given.
+    """
+    names = sys.argv[1:] or list(BENCHMARKS.keys())
+    for name in names:
+        print("running benchmark {}".format(name))
+        BENCHMARKS[name]()
+        print("")
+
+def benchmark_compiled_config(repeat=20):
+    """
+    Compares parsing and filtering the sample data while walking the
+    configuration dict for every line and entity (as the parser used to
+    do: the predicate ID of every line was looked up in the list of
+    target predicates, and the (lang, predicate ID) pairs were collected
+    from the dict again for every entity) with doing the same using a
+    precompiled extraction plan. Both filter every entity once.
+    """
+    config = _load_config('src/config.json')
+    plan = compile_config(config)
+    lines = _read_lines(config['input_file_name'])
+
+    def dict_scans():
+        return _legacy_filtered_entities(lines, config)
+
+    def compiled_plan():
+        return [
+            filter_triples(triples, plan)
+            for _, triples in iter_entities(lines, plan)]
+
+    assert (list(filter(None, dict_scans()))
+            == list(filter(None, compiled_plan())))
+
+    _report_per_unit('dict scans', dict_scans, len(lines), 'line', repeat)
+    _report_per_unit(
+        'compiled plan', compiled_plan, len(lines), 'line', repeat)
+
+def benchmark_predicate_prefilter(line_count=3000000):
+    """
+    Compares the lines/sec of parse_and_localize with the prefiltered
+    parse_and_localize_target on a synthetic dump of several million
+    lines, including the time spent reading the file.
+    """
+    config = _load_config('src/config.json')
+    plan = compile_config(config)
+    directory = tempfile.mkdtemp()
+    dump_file_name, line_count = _generate_dump(directory, line_count)
+
+    def parse_all_lines(parse_function):
+        def run():
+            kept = 0
+            with open(dump_file_name, 'rt', encoding='utf-8') as dump_file:
+                for line in dump_file:
+                    t = parse_function(line, plan)
+                    if t is not None and t.predicate_id is not None:
+                        kept += 1
+            return kept
+        return run
+
+    _report_per_unit('current path',
+        parse_all_lines(parse_and_localize), line_count, 'line', 1)
+    _report_per_unit('prefiltered path',
+        parse_all_lines(parse_and_localize_target), line_count, 'line', 1)
+    shutil.rmtree(directory)
+
+def benchmark_bytes_parsing(line_count=3000000):
+    """
+    Compares reading the synthetic dump as text and parsing it with
+    parse_and_localize_target to reading it as bytes and parsing it with
+    parse_and_localize_target_bytes, which only decodes kept lines.
+    """
+    config = _load_config('src/config.json')
+    plan = compile_config(config)
+    directory = tempfile.mkdtemp()
+    dump_file_name, line_count = _generate_dump(directory, line_count)
+
+    def text_path():
+        with open(dump_file_name, 'rt', encoding='utf-8') as dump_file:
+            return [t for t in (
+                parse_and_localize_target(line, plan)
+                for line in dump_file) if t is not None]
+
+    def bytes_path():
+        with open(dump_file_name, 'rb') as dump_file:
+            return [t for t in (
+                parse_and_localize_target_bytes(line, plan)
+                for line in dump_file) if t is not None]
+
+    assert text_path() == bytes_path()
+    _report_per_unit('decoded text lines', text_path, line_count, 'line', 1)
+    _report_per_unit('bytes lines', bytes_path, line_count, 'line', 1)
+    shutil.rmtree(directory)
+
+def benchmark_decompression(line_count=1000000):
+    """
+    Compares the MB/s of reading the lines of a gzip compressed synthetic
+    dump with gzip.open in text mode (as parse_all used to do) to the
+    methods of open_dump. A zstd compressed copy is measured as well if
+    the zstd command is available.
+    """
+    directory = tempfile.mkdtemp()
+    dump_file_name, line_count = _generate_dump(directory, line_count)
+    megabytes = os.path.getsize(dump_file_name) / 1e6
+    gzip_file_name = dump_file_name + '.gz'
+    with open(dump_file_name, 'rb') as dump_file:
+        with gzip.open(gzip_file_name, 'wb') as gzip_file:
+            shutil.copyfileobj(dump_file, gzip_file)
+    zstd_file_name = dump_file_name + '.zst'
+    if shutil.which('zstd') is not None:
+        subprocess.run(
+            ['zstd', '-q', dump_file_name, '-o', zstd_file_name],
+            check=True)
+
+    def count_lines(open_function):
+        def run():
+            with open_function() as input_file:
+                return sum(1 for _ in input_file)
+        return run
+
+    methods = [
+        ('gzip.open text', lambda:
+            gzip.open(gzip_file_name, 'rt', encoding='utf-8')),
+        ('gzip.open bytes', lambda: open_dump(gzip_file_name, 'none')),
+        ('zlib thread', lambda: open_dump(gzip_file_name, 'zlib')),
+    ]
+    if shutil.which('pigz') is not None:
+        methods.append(
+            ('pigz', lambda: open_dump(gzip_file_name, 'external')))
+    if os.path.isfile(zstd_file_name):
+        methods.append(
+            ('zstd', lambda: open_dump(zstd_file_name, 'external')))
+    for label, open_function in methods:
+        elapsed = best_time(count_lines(open_function), 1)
+        print("{:>24}: {:8.1f} MB/s".format(label, megabytes / elapsed))
+    shutil.rmtree(directory)
+
+def benchmark_conditions(repeat=20):
+    """
+    Evaluates conditions with growing numbers of values on the entities
+    of the sample data, and compares the condition engine to scanning a
+    list of (predicate ID, value) pairs once per value, which is what
+    checking many single-value conditions used to cost.
+    """
+    config = _load_config('src/config.json')
+    plan = compile_config(config)
+    with open(config['input_file_name'], 'rb') as input_file:
+        entities = [
+            triples for _, triples in
+            filter_entities(iter_entities(input_file, plan), plan)]
+    known_values = sorted(load_condition_values(
+        'data/celestial_object_categories.txt', 'type'))
+    for value_count in [1, 100, 1000, 10000]:
+        values = (
+            ['synthetic.type_{}'.format(i) for i in range(value_count)]
+            + known_values)[-value_count:]
+        condition = compile_condition(
+            {'predicate_id': 'type', 'predicate_values': values})
+        pairs = [('type', value) for value in values]
+
+        def list_scans():
+            for triples in entities:
+                predicate_id_value_list = [(t[1], t[2]) for t in triples]
+                any(pair in predicate_id_value_list for pair in pairs)
+
+        def condition_engine():
+            for triples in entities:
+                condition_matches(condition, triples)
+
+        print("{} condition values".format(value_count))
+        for label, function in [
+                ('list scans', list_scans),
+                ('condition engine', condition_engine)]:
+            elapsed = best_time(function, repeat)
+            print("{:>24}: {:10.2f} us/entity".format(
+                label, 1e6 * elapsed / len(entities)))
+
+def benchmark_multiple_outputs(line_count=1000000):
+    """
+    Extracts five differently filtered datasets from the synthetic dump,
+    once with a separate pass over the dump for each of them, and once
+    in a single pass which routes every entity to all outputs.
+    """
+    config = _load_config('src/config.json')
+    directory = tempfile.mkdtemp()
+    dump_file_name, line_count = _generate_dump(directory, line_count)
+    config['outputs'] = [
+        {'name': 'topics', 'output_file_name': 'topics.txt'},
+        {'name': 'english', 'output_file_name': 'english.txt',
+         'lang_list': ['en'], 'predicate_ids': ['name', 'alias', 'type']},
+        {'name': 'celestial', 'output_file_name': 'celestial.txt',
+         'condition': {
+            'predicate_id': 'type',
+            'predicate_values_file':
+                'data/celestial_object_categories.txt'}},
+        {'name': 'wiki_titles', 'output_file_name': 'wiki_titles.txt',
+         'predicate_ids': ['name', 'en_wiki_title', 'de_wiki_title']},
+        {'name': 'everything', 'output_file_name': 'everything.txt',
+         'condition': None},
+    ]
+    plan = compile_config(config)
+    output_plans = compile_outputs(config, plan)
+
+    def extract(selected_output_plans):
+        with open(dump_file_name, 'rb') as dump_file:
+            for chunk in read_entity_chunks(dump_file, plan, 100000):
+                extract_chunk(chunk, plan, selected_output_plans)
+
+    def separate_passes():
+        for output_plan in output_plans:
+            extract([output_plan,])
+
+    def single_pass():
+        extract(output_plans)
+
+    for label, function in [
+            ('{} passes'.format(len(output_plans)), separate_passes),
+            ('single routed pass', single_pass)]:
+        elapsed = best_time(function, 1)
+        print("{:>24}: {:8.2f} s".format(label, elapsed))
+    shutil.rmtree(directory)
+
+def benchmark_instrumentation(line_count=1000000):
+    """
+    Extracts the chunks of the synthetic dump without metrics, with
+    metrics, and with metrics and a profile of one of every ten chunks,
+    and checks that the metrics do not change the outputs.
+    """
+    config = _load_config('src/config.json')
+    directory = tempfile.mkdtemp()
+    dump_file_name, line_count = _generate_dump(directory, line_count)
+    plan = compile_config(config)
+    output_plans = compile_outputs(config, plan)
+    with open(dump_file_name, 'rb') as dump_file:
+        chunks = list(read_entity_chunks(dump_file, plan, 100000))
+    profile_file_name = os.path.join(directory, 'chunks.prof')
+
+    def extract(metrics, profiler):
+        results = []
+        for chunk in chunks:
+            if profiler is None:
+                results.append(extract_chunk(
+                    chunk, plan, output_plans, metrics and metrics()))
+            else:
+                results.append(profiler.run(
+                    extract_chunk, chunk, plan, output_plans, metrics()))
+        return results
+
+    expected = [r.outputs for r in extract(None, None)]
+    metrics = ExtractionMetrics()
+    for result in extract(ExtractionMetrics, None):
+        assert result.outputs == expected.pop(0)
+        metrics.merge(result.metrics)
+    assert metrics.lines_read == line_count
+    baseline = None
+    for label, metrics, profiler in [
+            ('disabled', None, None),
+            ('metrics', ExtractionMetrics, None),
+            ('metrics and profile', ExtractionMetrics,
+             ChunkProfiler(profile_file_name, 10))]:
+        elapsed = _report_per_unit(
+            label, lambda: extract(metrics, profiler), line_count, 'line', 3)
+        if baseline is None:
+            baseline = elapsed
+        else:
+            print("{:>24}: {:+.1%}".format('overhead', elapsed / baseline - 1))
+    shutil.rmtree(directory)
+
+def benchmark_turtle_conversion(line_count=100000):
+    """
+    Converts a synthetic Turtle export with the entities of the
+    synthetic dump into RDF lines, once topic by topic with
+    turtle_lines_to_rdf_lines, and once as a stream with
+    iter_turtle_rdf_lines, and extracts the converted stream.
+    """
+    config = _load_config('src/config.json')
+    plan = compile_config(config)
+    directory = tempfile.mkdtemp()
+    dump_file_name, line_count = _generate_dump(directory, line_count)
+    rdf_lines = _read_lines(dump_file_name)
+    topics = rdf_lines_to_turtle_topics(rdf_lines)
+    turtle_file_name = dump_file_name[:-len('.rdf')] + '.ttl'
+    with open(turtle_file_name, 'wt', encoding='utf-8') as turtle_file:
+        for topic in topics:
+            turtle_file.write('\n'.join(topic) + '\n\n')
+    print("{:>24}: {:.1f} MB, {} topics".format(
+        'Turtle input', os.path.getsize(turtle_file_name) / 2 ** 20,
+        len(topics)))
+
+    def convert_topics():
+        for topic in topics:
+            turtle_lines_to_rdf_lines(topic)
+
+    def convert_stream():
+        with open(turtle_file_name, 'rt', encoding='utf-8') as turtle_file:
+            return list(iter_turtle_rdf_lines(turtle_file))
+
+    def convert_and_extract():
+        with open(turtle_file_name, 'rt', encoding='utf-8') as turtle_file:
+            for _, triples in filter_entities(iter_entities(
+                    iter_turtle_rdf_lines(turtle_file), plan), plan):
+                entity_meets_condition(triples, plan)
+
+    assert convert_stream() == rdf_lines
+    for label, function in [
+            ('topic by topic', convert_topics),
+            ('streaming', convert_stream),
+            ('streaming and extracting', convert_and_extract)]:
+        _report_per_unit(label, function, len(rdf_lines), 'line', 3)
+    shutil.rmtree(directory)
+
+def benchmark_prefix_expansion(line_count=100000):
+    """
+    Compares expanding the predicates and objects of a synthetic Turtle
+    export by scanning the prefix dict to looking them up in a prefix
+    index, with the prefixes of Freebase topics and with many more
+    prefixes. The expansion itself is tested by test.prefix_and_test.
+    """
+    directory = tempfile.mkdtemp()
+    dump_file_name, line_count = _generate_dump(directory, line_count)
+    rdf_lines = _read_lines(dump_file_name)
+    topics = rdf_lines_to_turtle_topics(rdf_lines)
+    prefix_dict = {
+        token[0]: token[1]
+        for token in (
+            line.split()[1:3] for line in topics[0] if line.startswith('@'))}
+    prefix_dict = {p: r.strip('<>') for p, r in prefix_dict.items()}
+    tokens = [
+        token
+        for topic in topics
+        for line in topic[len(prefix_dict) + 2:]
+        for token in line.strip().rstrip(';').split(None, 1)]
+    many_prefixes = {
+        'p{}:'.format(i): 'http://example.com/{}/'.format(i)
+        for i in range(60)}
+    many_prefixes.update(prefix_dict)
+    for label, prefixes in [
+            ('{} prefixes'.format(len(prefix_dict)), prefix_dict),
+            ('{} prefixes'.format(len(many_prefixes)), many_prefixes)]:
+        index = PrefixIndex(prefixes)
+        assert ([index.expand(t) or t for t in tokens]
+                == [_legacy_replace_prefix(t, prefixes) for t in tokens])
+
+        def scan():
+            for token in tokens:
+                _legacy_replace_prefix(token, prefixes)
+
+        def lookup():
+            for token in tokens:
+                index.expand(token) or token
+
+        print(label)
+        _report_per_unit('dict scan', scan, len(tokens), 'token', 3)
+        _report_per_unit('prefix index', lookup, len(tokens), 'token', 3)
+    shutil.rmtree(directory)
+
+def benchmark_entity_comparison(max_tuple_count=100000):
+    """
+    Maps and deduplicates the query results of entities with growing
+    numbers of tuples, and compares them with parsed tuples, to show
+    that the time per tuple stays the same. The previous, quadratic
+    versions are timed up to 10000 tuples.
+    """
+    config = _load_config('test/test_config.json')
+    plan = compile_config(config)
+    predicate_keys = ['/type/object/name', '/common/topic/alias',
+                      '/type/object/type']
+    tuple_count = 1000
+    while tuple_count <= max_tuple_count:
+        # every tuple appears twice, as in results for several languages
+        result_list = [
+            (['en', 'de', 'sk'][i % 3], predicate_keys[i % 3],
+             'object {}'.format(i // 2))
+            for i in range(tuple_count)]
+        parsed_info = query_result_to_entity_info(result_list[1:], plan)
+        print("{} tuples".format(tuple_count))
+        functions = [
+            ('map and deduplicate',
+             lambda: query_result_to_entity_info(result_list, plan)),
+            ('compare',
+             lambda: compare_two_lists(
+                 query_result_to_entity_info(result_list, plan),
+                 parsed_info))]
+        if tuple_count <= 10000:
+            assert (query_result_to_entity_info(result_list, plan)
+                    == _legacy_query_result_to_entity_info(
+                        result_list, config))
+            legacy_info = _legacy_query_result_to_entity_info(
+                result_list, config)
+            assert (compare_two_lists(legacy_info, parsed_info)
+                    == _legacy_compare_two_lists(legacy_info, parsed_info))
+            functions += [
+                ('previous map and dedup',
+                 lambda: _legacy_query_result_to_entity_info(
+                     result_list, config)),
+                ('previous compare',
+                 lambda: _legacy_compare_two_lists(
+                     _legacy_query_result_to_entity_info(
+                         result_list, config),
+                     parsed_info))]
+        for label, function in functions:
+            _report_per_unit(label, function, tuple_count, 'tuple', 1)
+        tuple_count *= 10
+
+def benchmark_columnar_output(line_count=1000000):
+    """
+    Extracts all entities of the synthetic dump into the text output
+    and into columnar files, without and with compression, checks that
+    they hold the same rows, and compares their sizes and the time of
+    loading them.
+    """
+    config = _load_config('src/config.json')
+    config['condition'] = None
+    directory = tempfile.mkdtemp()
+    config['input_file_name'], line_count = _generate_dump(
+        directory, line_count)
+    config['outputs'] = [
+        {'name': 'text',
+         'output_file_name': os.path.join(directory, 'output.txt')},
+        {'name': 'columnar',
+         'output_file_name': os.path.join(directory, 'output.fbc')},
+        {'name': 'compressed',
+         'output_file_name': os.path.join(directory, 'compressed.fbc'),
+         'columnar_compression': 'zlib'},
+    ]
+    config_file_name = os.path.join(directory, 'config.json')
+    with open(config_file_name, 'wt') as config_file:
+        config_file.write(json.dumps(config))
+    subprocess.run(
+        [sys.executable, '-W', 'ignore', '-m', 'src.parse_all',
+         '--config', config_file_name, '--checkpoint-seconds', '0'],
+        check=True, stdout=subprocess.DEVNULL)
+    text_file_name = config['outputs'][0]['output_file_name']
+    text_rows = list(sample_app.read_parsed_rows(text_file_name))
+    for output in config['outputs']:
+        file_name = output['output_file_name']
+        if output['name'] != 'text':
+            assert list(sample_app.read_parsed_rows(file_name)) == text_rows
+        print("{:>24}: {:8.2f} MB".format(
+            output['name'], os.path.getsize(file_name) / 2 ** 20))
+
+    def count_rows(file_name):
+        for _ in sample_app.read_parsed_rows(file_name):
+            pass
+
+    def count_predicates(file_name):
+        # reads a single column of every chunk
+        counts = collections.Counter()
+        with ColumnarFile(file_name) as columnar_file:
+            for chunk in columnar_file.chunks:
+                codes = chunk.column('predicate_codes')
+                for code, count in collections.Counter(codes).items():
+                    counts[chunk.predicate_ids[code]] += count
+                codes.release()
+        return counts
+
+    for output in config['outputs']:
+        file_name = output['output_file_name']
+        _report_per_unit(
+            'load ' + output['name'], lambda: count_rows(file_name),
+            len(text_rows), 'row', 10)
+        if output['name'] != 'text':
+            _report_per_unit(
+                'predicate column', lambda: count_predicates(file_name),
+                len(text_rows), 'row', 10)
+    shutil.rmtree(directory)
+
+def benchmark_entity_lookup(row_count=2000000, lookup_count=2000,
+                            whoosh_row_count=20000):
+    """
+    Builds the entity index of a text output and of columnar outputs,
+    uncompressed and compressed, with row_count rows, made of copies of
+    the sample output, checks the rows of some entities, and reports the
+    latency of lookups of random entities. For comparison, the same
+    lookups are made with a Whoosh query on a smaller index with
+    whoosh_row_count rows.
+    """
+    entity_rows = _sample_entity_rows()
+    directory = tempfile.mkdtemp()
+    text_file_name = os.path.join(directory, 'output.txt')
+    columnar_file_name = os.path.join(directory, 'output.fbc')
+    compressed_file_name = os.path.join(directory, 'compressed.fbc')
+    subjects = _synthetic_output(text_file_name, row_count)
+    written_row_count = 0
+    with open(columnar_file_name, 'wb') as columnar_file, \
+            open(compressed_file_name, 'wb') as compressed_file:
+        chunk = []
+        for row in sample_app.read_parsed_rows(text_file_name):
+            written_row_count += 1
+            if not chunk or chunk[-1][0][0] != row[0]:
+                if len(chunk) == 10000:
+                    columnar_file.write(encode_chunk(chunk))
+                    compressed_file.write(encode_chunk(chunk, 'zlib'))
+                    chunk = []
+                chunk.append([])
+            chunk[-1].append(row)
+        columnar_file.write(encode_chunk(chunk))
+        compressed_file.write(encode_chunk(chunk, 'zlib'))
+    print("{:>24}: {} rows, {} entities".format(
+        'output', written_row_count, len(subjects)))
+    random_generator = random.Random(0)
+    lookups = [
+        random_generator.choice(subjects) for _ in range(lookup_count)]
+    for name, file_name in [('text', text_file_name),
+                            ('columnar', columnar_file_name),
+                            ('compressed', compressed_file_name)]:
+        begin = time.perf_counter()
+        build_entity_index(file_name)
+        print("{:>24}: {:8.2f} s, index {:.2f} MB".format(
+            'build ' + name, time.perf_counter() - begin,
+            os.path.getsize(file_name + '.idx') / 2 ** 20))
+        with EntityIndex(file_name) as entity_index:
+            for i in [0, len(subjects) // 2, len(subjects) - 1]:
+                expected = entity_rows[i % len(entity_rows)]
+                assert entity_index.lookup(subjects[i]) == [
+                    (subjects[i],) + row[1:] for row in expected]
+                assert entity_index.lookup(subjects[i], 'en') == [
+                    (subjects[i],) + row[1:]
+                    for row in expected if row[3] == 'en']
+            assert entity_index.lookup('m.0missing') == []
+            _report_latencies(
+                'lookup ' + name, entity_index.lookup, lookups)
+    whoosh_directory = os.path.join(directory, 'whoosh')
+    os.mkdir(whoosh_directory)
+    whoosh_file_name = os.path.join(directory, 'whoosh_output.txt')
+    with open(text_file_name, 'rt', encoding='utf-8') as text_file, \
+            open(whoosh_file_name, 'wt', encoding='utf-8') as whoosh_file:
+        for _, line in zip(range(whoosh_row_count), text_file):
+            whoosh_file.write(line)
+    sample_app.create_whoosh_index(whoosh_file_name, whoosh_directory)
+    whoosh_subjects = sorted(set(
+        row[0] for row in sample_app.read_parsed_rows(whoosh_file_name)))
+    lookups = [
+        random_generator.choice(whoosh_subjects)
+        for _ in range(lookup_count // 10)]
+
+    def search_whoosh_index(subject):
+        # without the message printed by every search
+        with contextlib.redirect_stdout(io.StringIO()):
+            return sample_app.search_whoosh_index(
+                subject, 'entity_id', whoosh_directory)
+
+    _report_latencies(
+        'whoosh ({} rows)'.format(whoosh_row_count),
+        search_whoosh_index, lookups)
+    shutil.rmtree(directory)
+
+def benchmark_whoosh_search(row_count=20000, query_count=2000):
+    """
+    Replays a query log, in which some terms are much more frequent than
+    others, against a Whoosh index of row_count rows of the synthetic
+    output, opening the index for every query (search_whoosh_index) and
+    with search sessions without and with caches. Reports the latency
+    percentiles, and checks that a session sees changes of the index.
+    """
+    directory = tempfile.mkdtemp()
+    output_file_name = os.path.join(directory, 'output.txt')
+    _synthetic_output(output_file_name, row_count)
+    whoosh_directory = os.path.join(directory, 'whoosh')
+    os.mkdir(whoosh_directory)
+    sample_app.create_whoosh_index(output_file_name, whoosh_directory)
+    words = sorted(set(
+        word
+        for row in sample_app.read_parsed_rows(output_file_name)
+        for word in row[2].split() if word.isalpha() and len(word) > 3))
+    random_generator = random.Random(0)
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    query_log = random_generator.choices(words, weights, k=query_count)
+
+    def search_whoosh_index(search_term):
+        # without the message printed by every search
+        with contextlib.redirect_stdout(io.StringIO()):
+            return sample_app.search_whoosh_index(
+                search_term, 'object', whoosh_directory)
+
+    expected = {term: search_whoosh_index(term) for term in set(query_log)}
+    _report_latencies(
+        'open per query', search_whoosh_index, query_log[:query_count // 10])
+    for label, max_cached_results in [('session', 0),
+                                      ('session with caches', 256)]:
+        with sample_app.WhooshSearchSession(
+                whoosh_directory, max_cached_results) as session:
+            _report_latencies(
+                label, lambda term: session.search(term, 'object'),
+                query_log)
+            for term in set(query_log):
+                assert session.search(term, 'object') == expected[term]
+    with sample_app.WhooshSearchSession(
+            whoosh_directory, refresh_seconds=0) as session:
+        assert session.search('zyzzyva', 'object') == []
+        index_writer = whoosh.index.open_dir(whoosh_directory).writer()
+        index_writer.add_document(
+            entity_id='m.0new', predicate_id='name', object='zyzzyva',
+            lang='en')
+        index_writer.commit()
+        assert session.search('zyzzyva', 'object') == [
+            ('m.0new', 'name', 'zyzzyva', 'en')]
+    shutil.rmtree(directory)
+
+def benchmark_whoosh_build(row_count=20000, procs=4):
+    """
+    Builds a Whoosh index of row_count rows of the synthetic output with
+    one process and with procs processes, then appends a tenth of the
+    rows to the output and updates the index, which only indexes the
+    new rows. Reports the indexed documents per second.
+    """
+    directory = tempfile.mkdtemp()
+    output_file_name = os.path.join(directory, 'output.txt')
+    _synthetic_output(output_file_name, row_count)
+    with open(output_file_name, 'rb') as output_file:
+        lines = output_file.readlines()
+    row_count = len(lines)
+    with open(output_file_name, 'wb') as output_file:
+        output_file.writelines(lines[:row_count - row_count // 10])
+    for label, build_procs in [('1 process', 1),
+                               ('{} processes'.format(procs), procs)]:
+        whoosh_directory = os.path.join(directory, label)
+        os.mkdir(whoosh_directory)
+        begin = time.perf_counter()
+        indexed = sample_app.create_whoosh_index(
+            output_file_name, whoosh_directory, build_procs)
+        _report_documents_per_second(
+            'build ' + label, indexed, time.perf_counter() - begin)
+    with open(output_file_name, 'ab') as output_file:
+        output_file.writelines(lines[row_count - row_count // 10:])
+    begin = time.perf_counter()
+    indexed = sample_app.update_whoosh_index(
+        output_file_name, whoosh_directory, procs)
+    _report_documents_per_second(
+        'update', indexed, time.perf_counter() - begin)
+    assert indexed == row_count // 10
+    assert sample_app.update_whoosh_index(
+        output_file_name, whoosh_directory, procs) == 0
+    with whoosh.index.open_dir(whoosh_directory).searcher() as searcher:
+        assert searcher.doc_count() == row_count
+    shutil.rmtree(directory)
+
+def benchmark_group_subjects(entity_count=20000, memory_mb=16):
+    """
+    Splits every entity of a synthetic dump of entity_count entities
+    into two fragments, and writes all first fragments before all second
+    ones, as in a concatenation of two dumps. Extracts the fragmented
+    dump with --group-subjects and a memory budget of memory_mb MB, and
+    the original dump without grouping, checks that both outputs hold
+    the same rows, and reports their throughput and the statistics of
+    the grouping, including the peak RSS.
+    """
+    config = _load_config('src/config.json')
+    directory = tempfile.mkdtemp()
+    dump_file_name = os.path.join(directory, 'dump.rdf')
+    fragmented_file_name = os.path.join(directory, 'fragmented.rdf')
+    second_fragments_file_name = os.path.join(directory, 'second.rdf')
+    line_count = 0
+    with open(dump_file_name, 'wt', encoding='utf-8') as dump_file, \
+            open(fragmented_file_name, 'wt',
+                 encoding='utf-8') as fragmented_file, \
+            open(second_fragments_file_name, 'wt',
+                 encoding='utf-8') as second_fragments_file:
+        for lines in iter_entity_lines(default_spec(entity_count)):
+            dump_file.writelines(lines)
+            fragmented_file.writelines(lines[:len(lines) // 2])
+            second_fragments_file.writelines(lines[len(lines) // 2:])
+            line_count += len(lines)
+    with open(second_fragments_file_name, 'rb') as second_fragments_file, \
+            open(fragmented_file_name, 'ab') as fragmented_file:
+        shutil.copyfileobj(second_fragments_file, fragmented_file)
+    outputs = []
+    for label, input_file_name, options in [
+            ('sorted', dump_file_name, []),
+            ('grouped', fragmented_file_name,
+             ['--group-subjects', '--group-memory', str(memory_mb),
+              '--group-directory', directory])]:
+        output_file_name = os.path.join(directory, label + '.txt')
+        config_file_name = os.path.join(directory, label + '.json')
+        with open(config_file_name, 'wt') as config_file:
+            config_file.write(json.dumps(dict(
+                config, input_file_name=input_file_name,
+                output_file_name=output_file_name)))
+        begin = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, '-W', 'ignore', '-m', 'src.parse_all',
+             '--config', config_file_name, '--checkpoint-seconds', '0']
+            + options,
+            check=True, stdout=subprocess.PIPE, universal_newlines=True)
+        elapsed = time.perf_counter() - begin
+        print("{:>24}: {:8.3f} s, {:10.0f} lines/sec".format(
+            label, elapsed, line_count / elapsed))
+        for line in result.stdout.splitlines():
+            if line.startswith('Grouped'):
+                print(line)
+        with open(output_file_name, 'rb') as output_file:
+            outputs.append(sorted(output_file))
+    assert outputs[0] == outputs[1]
+    shutil.rmtree(directory)
+
+def benchmark_compact_triples(triple_count=100000):
+    """
+    Parses a synthetic entity with triple_count lines of target
+    predicates (names, aliases, types and Wikipedia titles in many
+    languages) into a list of triples (iter_entities) and into
+    CompactTriples, and checks that both hold the same triples. Reports
+    the memory held by the parsed entity and the peak memory of parsing
+    and filtering it, and the time per line.
+    """
+    plan = compile_config(_load_config('src/config.json'))
+    spec = default_spec(1, triples_per_entity=2 * triple_count)._replace(
+        predicate_mix=[
+            predicate for predicate in DEFAULT_PREDICATE_MIX
+            if predicate[0].format(lang='en') in plan.target_predicate_urls])
+    lines = [line.encode('utf-8')
+             for line in next(iter_entity_lines(spec))[:triple_count]]
+    assert ([list(triples) for _, triples in iter_entities(lines, plan)]
+            == [list(triples) for _, triples in iter_entities(
+                lines, plan, PairTable().new_triples)])
+    for label, compact in [('list', False), ('compact', True)]:
+
+        def iter_function():
+            new_triples = PairTable().new_triples if compact else None
+            return iter_entities(lines, plan, new_triples)
+
+        tracemalloc.start()
+        entities = list(iter_function())
+        parsed_bytes = tracemalloc.get_traced_memory()[0]
+        filtered = [filter_triples(t, plan) for _, t in entities]
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        parsed_count = len(entities[0][1])
+        print("{:>24}: {} of {} triples kept".format(
+            label, len(filtered[0]), parsed_count))
+        print("{:>24}: {:8.2f} MB, {:6.1f} bytes/triple".format(
+            'parsed', parsed_bytes / 2 ** 20, parsed_bytes / parsed_count))
+        print("{:>24}: {:8.2f} MB".format(
+            'peak with filtering', peak_bytes / 2 ** 20))
+        del entities, filtered
+        _report_per_unit(
+            'parse and filter',
+            lambda: [filter_triples(t, plan) for _, t in iter_function()],
+            len(lines), 'line', 3)
+
+def benchmark_link_index(link_count=20000000, type_count=10000,
+                         lookup_count=2000):
+    """
+    Writes a synthetic text output with link_count type rows of entities
+    with four types on average, out of type_count types with a Zipf-like
+    popularity, and a name row per entity. Builds its link index, and
+    reports the build throughput, the latency of neighbour lookups and
+    of intersecting the entities of the two most popular types, and for
+    comparison, the time of scanning the output for the entities of one
+    type, as a grep would.
+    """
+    directory = tempfile.mkdtemp()
+    output_file_name = os.path.join(directory, 'output.txt')
+    random_generator = numpy.random.default_rng(0)
+    entity_count = link_count // 4
+    # every entity has at least one type
+    link_entities = numpy.sort(numpy.concatenate([
+        numpy.arange(entity_count),
+        random_generator.integers(
+            0, entity_count, link_count - entity_count)]))
+    link_types = numpy.minimum(
+        random_generator.zipf(1.3, link_count) - 1, type_count - 1)
+    begin = time.perf_counter()
+    with open(output_file_name, 'wt', encoding='utf-8') as output_file:
+        entity = -1
+        lines = []
+        for link_entity, link_type in zip(
+                link_entities.tolist(), link_types.tolist()):
+            if link_entity != entity:
+                entity = link_entity
+                lines.append('m.0bench{}\tname\tEntity {}\ten\n'.format(
+                    entity, entity))
+            lines.append('m.0bench{}\ttype\tbench.type_{}\tlink\n'.format(
+                entity, link_type))
+            if len(lines) >= 100000:
+                output_file.writelines(lines)
+                lines = []
+        output_file.writelines(lines)
+    print("{:>24}: {:8.3f} s, {:.1f} MB".format(
+        'write output', time.perf_counter() - begin,
+        os.path.getsize(output_file_name) / 2 ** 20))
+    begin = time.perf_counter()
+    indexed = build_link_index(output_file_name)
+    elapsed = time.perf_counter() - begin
+    index_directory = link_index_directory_for(output_file_name)
+    print("{:>24}: {:8.3f} s, {:12.0f} links/sec, {} links, {:.1f} MB".format(
+        'build', elapsed, indexed / elapsed, indexed,
+        sum(os.path.getsize(os.path.join(index_directory, name))
+            for name in os.listdir(index_directory)) / 2 ** 20))
+    begin = time.perf_counter()
+    link_index = LinkIndex(output_file_name)
+    print("{:>24}: {:8.1f} us".format(
+        'open', 1e6 * (time.perf_counter() - begin)))
+    entities = ['m.0bench{}'.format(entity) for entity in random.Random(0)
+                .sample(range(entity_count), lookup_count)]
+    types = ['bench.type_{}'.format(link_type) for link_type in
+             random.Random(0).sample(range(type_count), lookup_count)]
+    _report_latencies('subject code', link_index.subject_code, entities)
+    _report_latencies(
+        'object codes of', link_index.object_codes_of,
+        [link_index.subject_code(entity) for entity in entities])
+    _report_latencies('types of entity', link_index.objects_of, entities)
+    _report_latencies(
+        'subject codes of', link_index.subject_codes_of,
+        [link_index.object_code(t) for t in types
+         if link_index.object_code(t) is not None])
+    _report_latencies('entities of type', link_index.subjects_of, types)
+    popular_types = ['bench.type_0', 'bench.type_1']
+    first_codes, second_codes = [
+        link_index.subject_codes_of(link_index.object_code(t))
+        for t in popular_types]
+    print("{:>24}: {} and {} entities".format(
+        'popular types', len(first_codes), len(second_codes)))
+    _report_latencies(
+        'numpy intersect1d',
+        lambda _: numpy.intersect1d(
+            second_codes, first_codes, assume_unique=True), [None] * 20)
+    _report_latencies(
+        'intersect entities', link_index.subjects_of_all,
+        [popular_types] * 5)
+    first_set, second_set = [
+        set(link_index.subjects_of(t)) for t in popular_types]
+    _report_latencies(
+        'set intersection', lambda _: first_set & second_set, [None] * 5)
+    assert (link_index.subjects_of_all(popular_types)
+            == sorted(first_set & second_set))
+    begin = time.perf_counter()
+    scanned = set()
+    with open(output_file_name, 'rb') as output_file:
+        for line in output_file:
+            if line.endswith(b'\tbench.type_1\tlink\n'):
+                scanned.add(line[:line.index(b'\t')].decode('utf-8'))
+    print("{:>24}: {:8.3f} s".format(
+        'scan for a type', time.perf_counter() - begin))
+    assert scanned == second_set
+    link_index.close()
+    shutil.rmtree(directory)
+
+def benchmark_mql_concurrency(entity_count=64, latency=0.05):
+    """
+    Executes the MQL queries of entity_count entities against a local
+    stub server which answers every request after latency seconds.
+    Compares executing them one by one to executing them concurrently
+    with growing limits, and finally checks that concurrent queries
+    recover from transient errors by retrying.
+    """
+    config = _load_config('test/test_config.json')
+    predicate_url_list = [p['url'] for p in config['target_predicates']]
+    with _StubMqlServer(latency) as server:
+        query_lists = [
+            create_queries_for_entity(
+                ['en'], predicate_url_list, server.url, 'key',
+                'm.0bench{}'.format(i))
+            for i in range(entity_count)]
+        begin = time.perf_counter()
+        serial_results = [
+            execute_freebase_queries(queries) for queries in query_lists]
+        serial_time = time.perf_counter() - begin
+        print("{:>24}: {:8.2f} s".format('one by one', serial_time))
+        for max_workers in [1, 2, 4, 8, 16]:
+            begin = time.perf_counter()
+            outcomes = execute_queries_concurrently(query_lists, max_workers)
+            elapsed = time.perf_counter() - begin
+            assert [o.tuple_list for o in outcomes] == serial_results
+            print("{:>24}: {:8.2f} s, speedup {:.1f}".format(
+                '{} workers'.format(max_workers), elapsed,
+                serial_time / elapsed))
+        server.fail_every = 4
+        request_count = server.request_count
+        outcomes = execute_queries_concurrently(
+            query_lists, 8, backoff=latency)
+        assert all(outcome.error is None for outcome in outcomes)
+        assert [o.tuple_list for o in outcomes] == serial_results
+        print("{:>24}: {} retried requests".format(
+            'transient errors',
+            server.request_count - request_count - len(query_lists)))
+
+def benchmark_mql_batching(entity_count=500, latency=0.05, max_workers=8):
+    """
+    Looks up entity_count entities in three languages against a local
+    stub server, once with one query per entity and language, and once
+    with batched queries, and checks that the demultiplexed results of
+    the batched queries are the same.
+    """
+    config = _load_config('test/test_config.json')
+    plan = compile_config(config)
+    lang_list = ['en', 'de', 'fr']
+    predicate_url_list = [p['url'] for p in config['target_predicates']]
+    entity_ids = ['m.0bench{}'.format(i) for i in range(entity_count)]
+    with _StubMqlServer(latency) as server:
+        request_count = server.request_count
+        begin = time.perf_counter()
+        outcomes = execute_queries_concurrently(
+            [
+                create_queries_for_entity(
+                    lang_list, predicate_url_list, server.url, 'key', id)
+                for id in entity_ids
+            ],
+            max_workers)
+        elapsed = time.perf_counter() - begin
+        single_info = [
+            query_result_to_entity_info(outcome.tuple_list, plan)
+            for outcome in outcomes]
+        print("{:>24}: {:8.2f} s, {} requests".format(
+            'one query per entity', elapsed,
+            server.request_count - request_count))
+        for max_url_length in [2000, 4000, 8000]:
+            request_count = server.request_count
+            begin = time.perf_counter()
+            batch_outcomes = execute_batched_queries(
+                create_batched_queries(
+                    lang_list, predicate_url_list, server.url, 'key',
+                    entity_ids, max_url_length),
+                max_workers)
+            elapsed = time.perf_counter() - begin
+            assert all(o.error is None for o in batch_outcomes.values())
+            assert single_info == [
+                query_result_to_entity_info(
+                    batch_outcomes[id].tuple_list, plan)
+                for id in entity_ids]
+            print("{:>24}: {:8.2f} s, {} requests".format(
+                'batched, {} chars'.format(max_url_length), elapsed,
+                server.request_count - request_count))
+
+def benchmark_response_cache(entity_count=200, latency=0.05):
+    """
+    Executes the MQL queries of entity_count entities against a local
+    stub server, first with an empty response cache, then with the
+    filled cache and finally offline. Also checks that expired responses
+    are fetched again and that the cache stays within its size bound.
+    """
+    config = _load_config('test/test_config.json')
+    predicate_url_list = [p['url'] for p in config['target_predicates']]
+    cache_file_name = os.path.join(
+        tempfile.mkdtemp(), 'response_cache.sqlite')
+    with _StubMqlServer(latency) as server:
+        query_lists = [
+            create_queries_for_entity(
+                ['en'], predicate_url_list, server.url,
+                'key{}'.format(i % 3), 'm.0bench{}'.format(i))
+            for i in range(entity_count)]
+        expected = None
+        for run, offline in [('cold', False), ('warm', False),
+                             ('offline', True)]:
+            with ResponseCache(cache_file_name, offline=offline) as cache:
+                request_count = server.request_count
+                begin = time.perf_counter()
+                outcomes = execute_queries_concurrently(
+                    query_lists, 8, cache=cache)
+                elapsed = time.perf_counter() - begin
+                tuple_lists = [o.tuple_list for o in outcomes]
+                assert all(o.error is None for o in outcomes)
+                assert expected is None or tuple_lists == expected
+                expected = tuple_lists
+                print("{:>24}: {:8.2f} s, {} requests, {}".format(
+                    run, elapsed, server.request_count - request_count,
+                    cache.stats()))
+        # another API key hits the same responses
+        with ResponseCache(cache_file_name, offline=True) as cache:
+            query = create_queries_for_entity(
+                ['en'], predicate_url_list, server.url, 'other', 'm.0bench0')
+            assert execute_freebase_queries(query, cache=cache) == expected[0]
+        with ResponseCache(cache_file_name, ttl_seconds=0) as cache:
+            request_count = server.request_count
+            execute_queries_concurrently(query_lists[:10], 8, cache=cache)
+            assert server.request_count - request_count == 10
+            max_bytes = cache.stats()['bytes'] // 4
+        with ResponseCache(cache_file_name, max_bytes=max_bytes) as cache:
+            cache.put(server.url + 'extra', 'x')
+            stats = cache.stats()
+            assert stats['bytes'] <= max_bytes and stats['evictions'] > 0
+            print("{:>24}: {}".format('bounded', stats))
+    os.remove(cache_file_name)
+
+class _StubMqlServer:
+    """
+    A local HTTP server which answers MQL read requests in the format of
+    the Freebase API after a delay. If fail_every is set, every
+    fail_every-th distinct request URL fails once with a 503 status.
+    """
+    def __init__(self, latency, fail_every=None):
+        self.latency = latency
+        self.fail_every = fail_every
+        self.request_count = 0
+        self._failed_urls = set()
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # headers and body are sent separately, which on keep-alive
+            # connections would otherwise stall on delayed ACKs
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                stub._handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer(
+            ('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self.url = 'http://127.0.0.1:{}/'.format(self._server.server_port)
+
+    def __enter__(self):
+        threading.Thread(
+            target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handle(self, handler):
+        time.sleep(self.latency)
+        with self._lock:
+            self.request_count += 1
+            fail = (
+                self.fail_every is not None
+                and hash(handler.path) % self.fail_every == 0
+                and handler.path not in self._failed_urls)
+            if fail:
+                self._failed_urls.add(handler.path)
+        if fail:
+            self._reply(handler, 503, b'try again later')
+        else:
+            self._reply(handler, 200, json.dumps(
+                {'result': self.answer(handler.path)}).encode('utf-8'))
+
+    def answer(self, path):
+        """Builds the result of an MQL read request for a request path."""
+        parameters = urllib.parse.parse_qs(urllib.parse.urlsplit(path).query)
+        query = json.loads(parameters['query'][0])
+        lang = parameters['lang'][0].rsplit('/', 1)[-1]
+        if isinstance(query, list):
+            # an array query selecting its entities with "mid|="
+            query = query[0]
+            return [
+                _stub_mql_result(dict(query, mid=mid), lang)
+                for mid in query['mid|='][:query['limit']]]
+        return _stub_mql_result(query, lang)
+
+    def _reply(self, handler, status_code, body):
+        handler.send_response(status_code)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+def _stub_mql_result(query, lang):
+    result = {'mid': query['mid']}
+    for key in query:
+        if key in ('mid', 'mid|=', 'limit'):
+            continue
+        if key == '/type/object/type':
+            result[key] = ['/common/topic']
+        else:
+            result[key] = ['{} {} {}'.format(key, query['mid'], lang)]
+    return result
+
+def _generate_dump(directory, line_count):
+    # Writes a synthetic dump (see test.synthetic_dump) of about
+    # line_count lines into a directory, and returns its file name and
+    # its number of lines.
+    dump_file_name = os.path.join(directory, 'dump.rdf')
+    spec = default_spec(max(1, line_count // 40))
+    return dump_file_name, generate_dump(dump_file_name, spec)
+
+def _sample_entity_rows():
+    # the rows of the sample output, grouped by entity
+    entity_rows = []
+    for row in sample_app.read_parsed_rows('data/sample_output.txt'):
+        if not entity_rows or entity_rows[-1][0][0] != row[0]:
+            entity_rows.append([])
+        entity_rows[-1].append(row)
+    return entity_rows
+
+def _synthetic_output(file_name, row_count):
+    # Writes a text output of at least row_count rows, made of copies of
+    # the entities of the sample output with new subjects, and returns
+    # the subjects.
+    entity_rows = _sample_entity_rows()
+    subjects = []
+    written_row_count = 0
+    with open(file_name, 'wt', encoding='utf-8') as output_file:
+        while written_row_count < row_count:
+            subject = 'm.0bench{}'.format(len(subjects))
+            rows = entity_rows[len(subjects) % len(entity_rows)]
+            subjects.append(subject)
+            written_row_count += len(rows)
+            output_file.write(''.join(
+                '\t'.join((subject,) + row[1:]) + '\n' for row in rows))
+    return subjects
+
+def _legacy_query_result_to_entity_info(result_list, config):
+    linked_predicate_ids = [
+        predicate['id'] for predicate in config['target_predicates']
+        if predicate['localizable_subject'] is False]
+    entity_info = []
+    for lang, predicate_key, object in result_list:
+        key_string = predicate_key.lstrip('/').translate({ord('/'): '.'})
+        for predicate in config['target_predicates']:
+            if predicate['url'].rstrip('>').endswith(key_string):
+                predicate_id = predicate['id']
+                break
+        else:
+            predicate_id = None
+        if predicate_id in linked_predicate_ids:
+            new_tuple = ('link', predicate_id, object)
+        else:
+            new_tuple = (lang, predicate_id, object)
+        if new_tuple not in entity_info:
+            entity_info.append(new_tuple)
+    return entity_info
+
+def _legacy_compare_two_lists(benchmark_list, compared_list):
+    return (
+        [item for item in benchmark_list if item in compared_list],
+        [item for item in benchmark_list if item not in compared_list],
+        [item for item in compared_list if item not in benchmark_list])
+
+def _legacy_replace_prefix(str, prefix_translation_dict):
+    for p, r in prefix_translation_dict.items():
+        if str.startswith(p):
+            prefix, replacement = p, r
+            break
+    else:
+        prefix, replacement = None, None
+    return (str if prefix is None
+            else str
+                .replace(prefix, replacement)
+                .rstrip()) # remove newline
+
+def _legacy_predicate_url_to_predicate_id(predicate_url, config):
+    for predicate in config['target_predicates']:
+        if predicate['url'] == predicate_url:
+            return predicate['id']
+    else:
+        return None
+
+_LegacyTriple = collections.namedtuple(
+    '_LegacyTriple', 'subject, predicate_id, object, lang')
+
+def _legacy_parse_and_localize(rdf_line, config):
+    tokens = rdf_line.rstrip('\t.\n').split('\t')
+    if len(tokens) != 3:
+        return None
+    object = tokens[2].rstrip(' \t\n')
+    lang = object[-2:] if len(object) >= 3 and object[-3] == '@' else None
+    return _LegacyTriple(
+        subject=tokens[0].strip('<>').rsplit('/', 1)[-1],
+        predicate_id=_legacy_predicate_url_to_predicate_id(
+            tokens[1], config),
+        object=(object[:-3].strip('"') if lang
+                else object.strip('<>').rsplit('/', 1)[-1]),
+        lang=lang or 'link')
+
+def _legacy_filter_triples(triples, config):
+    lang_predicate_tuples = []
+    for predicate in config['target_predicates']:
+        if predicate['localizable_subject'] is True:
+            lang_predicate_tuples.append(
+                (config['main_lang'], predicate['id']))
+    main_predicate_id = _legacy_predicate_url_to_predicate_id(
+        config['main_predicate_url'], config)
+    for lang in config['lang_list']:
+        lang_predicate_tuples.append((lang, main_predicate_id))
+    for predicate in config['target_predicates']:
+        if predicate['localizable_subject'] is False:
+            lang_predicate_tuples.append(('link', predicate['id']))
+    lang_predicate_tuples = list(set(lang_predicate_tuples))
+    return [t for t in triples
+            if (t.lang, t.predicate_id) in lang_predicate_tuples]
+
+def _legacy_filtered_entities(lines, config):
+    # the filtered triples of every entity, filtered once per entity
+    entities = []
+    for line in lines:
+        triple = _legacy_parse_and_localize(line, config)
+        if triple is None: continue
+        if not entities or triple.subject != entities[-1][0].subject:
+            entities.append([])
+        entities[-1].append(triple)
+    return [
+        _legacy_filter_triples(triples, config) for triples in entities]
+
+def _report_per_unit(label, function, count, unit, repeat):
+    # times function, which processes count units such as lines or rows
+    elapsed = best_time(function, repeat)
+    print("{:>24}: {:8.3f} us/{}, {:12.0f} {}s/sec".format(
+        label, 1e6 * elapsed / count, unit, count / elapsed, unit))
+    return elapsed
+
+def _report_documents_per_second(label, document_count, elapsed):
+    print("{:>24}: {:8.2f} s, {:8.0f} docs/sec".format(
+        label, elapsed, document_count / elapsed))
+
+def _report_latencies(label, function, arguments):
+    latencies = []
+    for argument in arguments:
+        begin = time.perf_counter()
+        function(argument)
+        latencies.append(time.perf_counter() - begin)
+    latencies.sort()
+    print("{:>24}: p50 {:8.1f} us, p99 {:8.1f} us".format(
+        label, 1e6 * latencies[len(latencies) // 2],
+        1e6 * latencies[len(latencies) * 99 // 100]))
+
+def _load_config(file_name):
+    with open(file_name, 'r') as config_file:
+        return json.loads(config_file.read())
+
+def _read_lines(file_name):
+    with open(file_name, 'rt', encoding='utf-8') as input_file:
+        return input_file.readlines()
+
+BENCHMARKS = {
+    'compiled_config': benchmark_compiled_config,
+    'predicate_prefilter': benchmark_predicate_prefilter,
+    'bytes_parsing': benchmark_bytes_parsing,
+    'decompression': benchmark_decompression,
+    'conditions': benchmark_conditions,
+    'multiple_outputs': benchmark_multiple_outputs,
+    'instrumentation': benchmark_instrumentation,
+    'turtle_conversion': benchmark_turtle_conversion,
+    'prefix_expansion': benchmark_prefix_expansion,
+    'entity_comparison': benchmark_entity_comparison,
+    'columnar_output': benchmark_columnar_output,
+    'entity_lookup': benchmark_entity_lookup,
+    'whoosh_search': benchmark_whoosh_search,
+    'whoosh_build': benchmark_whoosh_build,
+    'group_subjects': benchmark_group_subjects,
+    'compact_triples': benchmark_compact_triples,
+    'link_index': benchmark_link_index,
+    'mql_concurrency': benchmark_mql_concurrency,
+    'mql_batching': benchmark_mql_batching,
+    'response_cache': benchmark_response_cache,
+}
+
+if __name__ == "__main__":
+    main()
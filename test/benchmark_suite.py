@@ -0,0 +1,191 @@
+"""
+Stage-level benchmark suite. Generates a synthetic dump (see
+test.synthetic_dump), times every stage of the extraction and of the
+sample application on it, and saves the results as JSON, so that the
+results of two commits can be compared:
+
+python -m test.benchmark_suite --output before.json
+(check out another commit)
+python -m test.benchmark_suite --output after.json --compare before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from src import sample_app
+from src.freebase.api import turtle_lines_to_rdf_lines
+from src.freebase.parser import *
+from src.freebase.reader import open_dump
+from test.synthetic_dump import (
+    default_spec, generate_dump, rdf_lines_to_turtle_topics)
+from test.timing import best_time
+
+def main():
+    """
+    Main function of the benchmark suite. Runs all stages, prints their
+    throughput, saves the results into the --output file and compares
+    them with the --compare file, if given.
+    """
+    args = _parse_arguments()
+    with open(args.config, 'r') as config_file:
+        config = json.loads(config_file.read())
+    plan = compile_config(config)
+    directory = tempfile.mkdtemp()
+    spec = default_spec(args.entities, args.triples_per_entity)._replace(
+        seed=args.seed)
+    dump_file_name = os.path.join(
+        directory, 'dump.rdf.gz' if args.gzip else 'dump.rdf')
+    line_count = generate_dump(dump_file_name, spec)
+    print("{:>28}: {} lines, {:.1f} MB".format(
+        'dump', line_count, os.path.getsize(dump_file_name) / 2 ** 20))
+    stages = {}
+    try:
+        _run_stages(
+            stages, config, plan, dump_file_name, directory, args)
+    finally:
+        shutil.rmtree(directory)
+    results = {
+        'commit': _current_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        # through JSON, so that it compares equal to a loaded baseline
+        'dump': json.loads(json.dumps(dict(
+            spec._asdict(), gzip=args.gzip, lines=line_count))),
+        'stages': stages,
+    }
+    if args.output is not None:
+        with open(args.output, 'wt') as output_file:
+            output_file.write(json.dumps(results, indent=4))
+    if args.compare is not None:
+        with open(args.compare, 'r') as baseline_file:
+            compare_results(json.loads(baseline_file.read()), results)
+
+def compare_results(baseline, results):
+    """
+    Prints the throughput of every stage of two results of the suite
+    and the relative change from the baseline.
+    """
+    print("compared with {} of {}".format(
+        baseline['commit'], baseline['time']))
+    if baseline['dump'] != results['dump']:
+        print("the dumps differ, the results are not comparable")
+    for name, stage in results['stages'].items():
+        baseline_stage = baseline['stages'].get(name, None)
+        if baseline_stage is None:
+            print("{:>28}: not in the baseline".format(name))
+            continue
+        change = (
+            stage['items_per_second'] / baseline_stage['items_per_second']
+            - 1)
+        print("{:>28}: {:12.0f} -> {:12.0f} {}/sec ({:+.1%})".format(
+            name, baseline_stage['items_per_second'],
+            stage['items_per_second'], stage['unit'], change))
+
+def _run_stages(stages, config, plan, dump_file_name, directory, args):
+    with open_dump(dump_file_name, 'zlib') as dump_file:
+        lines = [line.decode('utf-8') for line in dump_file]
+    _time_stage(
+        stages, 'parse_and_localize', 'lines', len(lines), args.repeat,
+        lambda: [parse_and_localize(line, plan) for line in lines])
+    _time_stage(
+        stages, 'iter_entities', 'lines', len(lines), args.repeat,
+        lambda: list(iter_entities(lines, plan)))
+    entities = list(iter_entities(lines, plan))
+    triple_count = sum(len(triples) for _, triples in entities)
+    _time_stage(
+        stages, 'filter_triples', 'triples', triple_count, args.repeat,
+        lambda: [filter_triples(t, plan) for _, t in entities])
+    _time_stage(
+        stages, 'route_entities', 'triples', triple_count, args.repeat,
+        lambda: list(route_entities(entities, [plan])))
+    topics = rdf_lines_to_turtle_topics(lines)
+    _time_stage(
+        stages, 'turtle_lines_to_rdf_lines', 'lines', len(lines),
+        args.repeat,
+        lambda: [turtle_lines_to_rdf_lines(topic) for topic in topics])
+    config = dict(
+        config, input_file_name=dump_file_name,
+        output_file_name=os.path.join(directory, 'output.txt'))
+    config_file_name = os.path.join(directory, 'config.json')
+    with open(config_file_name, 'wt') as config_file:
+        config_file.write(json.dumps(config))
+    _time_stage(
+        stages, 'parse_all', 'lines', len(lines), 1,
+        lambda: subprocess.run(
+            [sys.executable, '-W', 'ignore', '-m', 'src.parse_all',
+             '--config', config_file_name, '--checkpoint-seconds', '0'],
+            check=True, stdout=subprocess.DEVNULL))
+    index_file_name = os.path.join(directory, 'whoosh_input.txt')
+    with open(config['output_file_name'], 'rb') as output_file, \
+            open(index_file_name, 'wb') as index_file:
+        row_count = 0
+        for line in output_file:
+            if row_count == args.whoosh_rows:
+                break
+            index_file.write(line)
+            row_count += 1
+    whoosh_directory = os.path.join(directory, 'whoosh')
+    os.mkdir(whoosh_directory)
+    _time_stage(
+        stages, 'create_whoosh_index', 'rows', row_count, 1,
+        lambda: sample_app.create_whoosh_index(
+            index_file_name, whoosh_directory))
+
+def _time_stage(stages, name, unit, item_count, repeat, function):
+    elapsed = best_time(function, repeat)
+    stages[name] = {
+        'seconds': elapsed,
+        'items': item_count,
+        'unit': unit,
+        'items_per_second': item_count / elapsed,
+    }
+    print("{:>28}: {:8.3f} s, {:12.0f} {}/sec".format(
+        name, elapsed, item_count / elapsed, unit))
+
+def _current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], check=True,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _parse_arguments():
+    argument_parser = argparse.ArgumentParser(
+        description="Times the stages of the extraction.")
+    argument_parser.add_argument(
+        '--config', default='src/config.json',
+        help="configuration file (default: src/config.json)")
+    argument_parser.add_argument(
+        '--entities', type=int, default=5000,
+        help="number of entities of the dump (default: 5000)")
+    argument_parser.add_argument(
+        '--triples-per-entity', type=int, default=40,
+        help="average number of lines per entity (default: 40)")
+    argument_parser.add_argument(
+        '--seed', type=int, default=0,
+        help="seed of the dump generator (default: 0)")
+    argument_parser.add_argument(
+        '--gzip', action='store_true',
+        help="compress the dump")
+    argument_parser.add_argument(
+        '--repeat', type=int, default=3,
+        help="repetitions of the in-memory stages (default: 3)")
+    argument_parser.add_argument(
+        '--whoosh-rows', type=int, default=5000,
+        help="rows of the output which are indexed (default: 5000)")
+    argument_parser.add_argument(
+        '--output', help="JSON file for the results")
+    argument_parser.add_argument(
+        '--compare', help="JSON file with results to compare with")
+    return argument_parser.parse_args()
+
+if __name__ == "__main__":
+    main()
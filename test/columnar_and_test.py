@@ -0,0 +1,130 @@
+"""
+Seventh part of the test suite. Checks that a columnar file which is
+cut short, as while it is being written, is read up to its last complete
+chunk, and that the Whoosh index of a growing output file is updated
+with its new rows only, and created again when the file is rewritten,
+even if only the middle of a large file changes.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+from src import sample_app
+from src.freebase.columnar import ColumnarFile, encode_chunk
+
+def main():
+    """
+    Main function of the test program. Writes a columnar file of a few
+    chunks, cuts it at every length within and between the chunks, and
+    compares the rows and the length read from the cut file with those
+    of its complete chunks. Then indexes a text output file, appends
+    rows to it, updates the index, and rewrites the file. Finally checks
+    the watermark of a large file whose middle is rewritten.
+    """
+    test_directory = tempfile.mkdtemp()
+    failures = 0
+    chunks = [encode_chunk(entities) for entities in _chunk_entities()]
+    file_name = os.path.join(test_directory, 'output.fbc')
+    data = b''.join(chunks)
+    chunk_ends = [sum(map(len, chunks[:i])) for i in range(len(chunks) + 1)]
+    cut_failures = 0
+    for length in range(len(data) + 1):
+        with open(file_name, 'wb') as output_file:
+            output_file.write(data[:length])
+        complete_chunks = max(
+            i for i, end in enumerate(chunk_ends) if end <= length)
+        expected_rows = [
+            row for entities in _chunk_entities()[:complete_chunks]
+            for rows in entities for row in rows]
+        with ColumnarFile(file_name) as columnar_file:
+            rows = list(columnar_file.rows())
+            file_length = columnar_file.length
+        if (rows != expected_rows
+                or file_length != chunk_ends[complete_chunks]
+                or sample_app._complete_length(file_name) != file_length
+                or list(sample_app.read_parsed_rows(file_name))
+                    != expected_rows):
+            print("FAILED: columnar file cut at {} of {} bytes".format(
+                length, len(data)))
+            cut_failures += 1
+    if cut_failures == 0:
+        print("OK: columnar file cut at every length of {} bytes".format(
+            len(data)))
+    failures += cut_failures
+
+    output_file_name = os.path.join(test_directory, 'output.txt')
+    index_directory = os.path.join(test_directory, 'index')
+    os.mkdir(index_directory)
+    lines = [
+        'm.0test_{0}\tname\tentity {0}\ten\n'.format(i).encode('utf-8')
+        for i in range(300)]
+    with open(output_file_name, 'wb') as output_file:
+        output_file.writelines(lines[:200])
+        # a line which is still being written is not indexed
+        output_file.write(lines[200][:5])
+    failures += _check_indexed('create', 200, sample_app.create_whoosh_index(
+        output_file_name, index_directory))
+    with open(output_file_name, 'r+b') as output_file:
+        output_file.seek(sum(map(len, lines[:200])))
+        output_file.writelines(lines[200:])
+    failures += _check_indexed('append', 100, sample_app.update_whoosh_index(
+        output_file_name, index_directory))
+    failures += _check_indexed('update', 0, sample_app.update_whoosh_index(
+        output_file_name, index_directory))
+    with open(output_file_name, 'wb') as output_file:
+        output_file.writelines(lines[::-1])
+    failures += _check_indexed('rewrite', 300, sample_app.update_whoosh_index(
+        output_file_name, index_directory))
+    failures += _check_middle_rewrite(output_file_name, index_directory)
+    shutil.rmtree(test_directory)
+    print("tests ended")
+    sys.exit(1 if failures > 0 else 0)
+
+def _chunk_entities():
+    # the entities of three chunks, as rows for encode_chunk
+    return [
+        [[('m.0test_{}'.format(chunk * 10 + entity), 'name',
+           'entity {}'.format(entity), 'en')] * (entity + 1)
+         for entity in range(chunk + 1)]
+        for chunk in range(3)]
+
+def _check_middle_rewrite(output_file_name, index_directory):
+    # Writes a watermark of a file of several megabytes, appends to the
+    # file, and checks that the watermark still holds; then changes a
+    # single byte in the middle of the file, appends again, and checks
+    # that the index must be created again. Returns the failure count.
+    line = b'm.0test\tname\t' + b'x' * 100 + b'\ten\n'
+    with open(output_file_name, 'wb') as output_file:
+        output_file.write(line * 40000)
+    length = os.path.getsize(output_file_name)
+    sample_app._write_watermark(
+        output_file_name, index_directory, length,
+        sample_app._checksum(output_file_name, 0, length))
+    with open(output_file_name, 'ab') as output_file:
+        output_file.write(line)
+    appended = sample_app._read_watermark(output_file_name, index_directory)
+    with open(output_file_name, 'r+b') as output_file:
+        output_file.seek(length // 2 + 20)
+        output_file.write(b'y')
+        output_file.seek(0, os.SEEK_END)
+        output_file.write(line)
+    rewritten = sample_app._read_watermark(output_file_name, index_directory)
+    if appended is not None and appended[0] == length and rewritten is None:
+        print("OK: the watermark detects a rewritten middle")
+        return 0
+    print("FAILED: the watermark of an appended file is {}, and of a file"
+          " with a rewritten middle {}".format(appended, rewritten))
+    return 1
+
+def _check_indexed(label, expected, indexed):
+    # prints the result of an indexing step, returns the failure count
+    if indexed == expected:
+        print("OK: {} indexes {} rows".format(label, indexed))
+        return 0
+    print("FAILED: {} indexes {} rows, expected {}".format(
+        label, indexed, expected))
+    return 1
+
+if __name__ == "__main__":
+    main()
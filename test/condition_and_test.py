@@ -0,0 +1,115 @@
+"""
+Sixth part of the test suite. Checks that the conditions documented in
+the src.freebase.condition module select the expected entities of the
+sample data, extended by a few celestial objects with a category, and
+drop the others.
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+from src.freebase.parser import *
+
+_NS = 'http://rdf.freebase.com/ns/'
+
+_CATEGORY_PREDICATE = {
+    'id': 'category',
+    'url': '<{}astronomy.celestial_object.category>'.format(_NS),
+    'localizable_subject': False,
+}
+
+# (subject, category), the first category is in the values file
+_CELESTIAL_OBJECTS = [
+    ('m.0test_1', 'm.0175d9'),
+    ('m.0test_2', 'm.0not_a_category'),
+]
+
+# a plain values file, with a type which only one sample entity has
+_TYPE_VALUES_FILE = 'types.txt'
+_TYPE_VALUES = ['astronomy.celestial_object_category']
+
+# (condition, expected selected subjects, expected dropped subjects)
+_CASES = [
+    # every sample entity is a common.topic, which is in the file
+    ({'predicate_id': 'type',
+      'predicate_values_file': 'data/celestial_object_categories.txt'},
+     {'m.0bt_c3', 'm.04m6h', 'm.06ngk'},
+     {'m.0test_1', 'm.0test_2'}),
+    ({'predicate_id': 'type',
+      'predicate_values_file': _TYPE_VALUES_FILE},
+     {'m.06ngk'},
+     {'m.0bt_c3', 'm.04m6h', 'm.0test_1', 'm.0test_2'}),
+    ({'predicate_id': 'category',
+      'predicate_values_file': 'data/celestial_object_categories.txt',
+      'values_from': 'subject'},
+     {'m.0test_1'},
+     {'m.0bt_c3', 'm.04m6h', 'm.06ngk', 'm.0test_2'}),
+    # type ID's are never MID's
+    ({'predicate_id': 'type',
+      'predicate_values_file': 'data/celestial_object_categories.txt',
+      'values_from': 'subject'},
+     set(),
+     {'m.0bt_c3', 'm.04m6h', 'm.06ngk', 'm.0test_1', 'm.0test_2'}),
+]
+
+def main():
+    """
+    Main function of the test program. Extracts the entities of the
+    test lines with every condition of the test cases, and compares the
+    subjects of the selected entities, and of the entities extracted
+    without a condition which are dropped, with the expected ones.
+    """
+    with open('src/config.json', 'r') as config_file:
+        config = json.loads(config_file.read())
+    config['target_predicates'].append(_CATEGORY_PREDICATE)
+    with open(config['input_file_name'], 'rb') as input_file:
+        lines = input_file.readlines()
+    lines.extend(_celestial_object_lines())
+    test_directory = tempfile.mkdtemp()
+    with open(os.path.join(test_directory, _TYPE_VALUES_FILE), 'w',
+              encoding='utf-8') as values_file:
+        values_file.writelines(value + '\n' for value in _TYPE_VALUES)
+    config['condition'] = None
+    subjects = _selected_subjects(lines, config)
+    failures = 0
+    for condition, expected, expected_dropped in _CASES:
+        config['condition'] = dict(condition)
+        if condition['predicate_values_file'] == _TYPE_VALUES_FILE:
+            config['condition']['predicate_values_file'] = os.path.join(
+                test_directory, _TYPE_VALUES_FILE)
+        selected = _selected_subjects(lines, config)
+        dropped = subjects - selected
+        if selected == expected and dropped == expected_dropped:
+            print("OK: {} selects {} and drops {}".format(
+                condition, sorted(selected), sorted(dropped)))
+        else:
+            print("FAILED: {} selects {} and drops {}, expected {} and {}"
+                .format(condition, sorted(selected), sorted(dropped),
+                        sorted(expected), sorted(expected_dropped)))
+            failures += 1
+    shutil.rmtree(test_directory)
+    print("tests ended")
+    sys.exit(1 if failures > 0 else 0)
+
+def _selected_subjects(lines, config):
+    # the subjects of the entities which are extracted with the config
+    plan = compile_config(config)
+    return {
+        subject for subject, triples in
+        filter_entities(iter_entities(lines, plan), plan)
+        if entity_meets_condition(triples, plan)}
+
+def _celestial_object_lines():
+    lines = []
+    for subject, category in _CELESTIAL_OBJECTS:
+        lines.append('<{0}{1}>\t<{0}type.object.name>\t"{1}"@en\t.\n'
+            .format(_NS, subject).encode('utf-8'))
+        lines.append('<{0}{1}>\t{2}\t<{0}{3}>\t.\n'.format(
+            _NS, subject, _CATEGORY_PREDICATE['url'], category)
+            .encode('utf-8'))
+    return lines
+
+if __name__ == "__main__":
+    main()
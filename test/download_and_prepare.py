@@ -1,9 +1,12 @@
 """First part of the test suite."""
 
+import argparse
 import json
 import os
 import requests
+import sys
 from src.freebase.api import *
+from src.freebase.cache import open_response_cache
 from src.freebase.parser import *
 
 def main():
@@ -11,11 +14,17 @@ def main():
     Main function of the test program. For each topic MID specified
     in the test config file, it downloads the first 100 information
     entries in Turtle format. It then transforms these into N-Triple
-    RDF format and saves the aggregated result into a file.
+    RDF format and saves the aggregated result into a file. Downloads
+    are kept in the response cache from the test config, and with
+    --offline, they are served only from the cache.
     """
-    api_key = load_api_key_from_file_or_die('api_key.txt')
+    args = parse_arguments()
     with open('test/test_config.json', 'r') as config_file:
         config = json.loads(config_file.read())
+    cache = open_response_cache(
+        config.get('response_cache'), args.offline or None)
+    offline = cache is not None and cache.offline
+    api_key = '' if offline else load_api_key_from_file_or_die('api_key.txt')
 
     output_lines = []
     for topic_id in sorted(config['test_topic_id_list']):
@@ -26,12 +35,11 @@ def main():
                 config['rdf_service_url'],
                 api_key, topic_id))
         print(rdf_url)
-        http_reply = requests.get(rdf_url)
-        if http_reply.status_code != 200:
-            print(http_reply.text)
+        rdf_lines, error = download_turtle_lines(rdf_url, cache=cache)
+        if error is not None:
+            print_query_error(error)
             sys.exit(4)
         print("download OK")
-        rdf_lines = http_reply.text.split('\n')
         full_triples = turtle_lines_to_rdf_lines(rdf_lines)
         output_lines.extend(sorted(full_triples))
     
@@ -42,6 +50,18 @@ def main():
         output_file.writelines(output_lines)
     print("downloaded and prepared sample data into {}"
         .format(output_file_name))
+    if cache is not None:
+        print("response cache: {}".format(cache.stats()))
+        cache.close()
+
+def parse_arguments():
+    """Parses the command line arguments of the test program."""
+    argument_parser = argparse.ArgumentParser(
+        description="Downloads the sample data of the test suite.")
+    argument_parser.add_argument(
+        '--offline', action='store_true',
+        help="serve downloads only from the response cache")
+    return argument_parser.parse_args()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
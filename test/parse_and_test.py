@@ -2,10 +2,14 @@
 Second part of the test suite.
 """
 
+import argparse
+import itertools
 import json
 import os
 import requests
+import sys
 from src.freebase.api import *
+from src.freebase.cache import open_response_cache
 from src.freebase.parser import *
 
 def main():
@@ -14,61 +18,85 @@ def main():
     by the first part of the test suite. Then, for each entity ID, the
     test program executes a live query and compares these query results
     with the results obtaining from parsing the file from first part.
+    The entities are looked up in batched queries, which are executed
+    concurrently, with at most mql_concurrency (from the test config)
+    requests in flight. Query results are kept in the response cache
+    from the test config, and with --offline, they are served only from
+    the cache.
     """
-    api_key = load_api_key_from_file_or_die('api_key.txt') 
+    args = parse_arguments()
     print("running tests\n")
     with open('test/test_config.json', 'r') as config_file:
         config = json.loads(config_file.read())
-
-    input_file_name = os.path.join(
-        config['test_data_directory'], 'sample_data.rdf')
-    with open(input_file_name, 'rt') as input_file:
-        lines = input_file.readlines()
-        tuples = extract_tuples(lines, config)
-        
-    entity_info = {}
-    for t in tuples:
-        new_tuple = (t.lang, t.predicate_id, t.object)
-        if entity_info.get(t.subject, None) is None:
-            entity_info[t.subject] = [new_tuple,]
-        else:
-            entity_info[t.subject].append(new_tuple)
+    cache = open_response_cache(
+        config.get('response_cache'), args.offline or None)
+    offline = cache is not None and cache.offline
+    api_key = '' if offline else load_api_key_from_file_or_die('api_key.txt')
+    plan = compile_config(config)
 
     lang_list = config['lang_list']
     predicate_url_list = [p['url'] for p in config['target_predicates']]
     mql_service_url = config['mql_service_url']
-    for id, parsed_info in entity_info.items():
-        print("Entity ID: {}".format(id))
-        queries = create_queries_for_entity(
-            lang_list, predicate_url_list,
-            mql_service_url, api_key, id)
-        result_list = execute_freebase_queries(queries)
-        queried_info = query_result_to_entity_info(result_list, config)
-        matching_items, missing_items, extra_items = (
-            compare_two_lists(queried_info, parsed_info))
-        print("Number of matching items: {}"
-            .format(len(matching_items)))
-        if len(missing_items) > 0:
-            print("missing items:")
-            print('\n'.join([str(mi) for mi in missing_items]))
-        if len(extra_items) > 0:
-            print("extra items:")
-            print('\n'.join([str(ei) for ei in extra_items]))
-        print("")
+    max_workers = config.get('mql_concurrency', 8)
+    session = create_session(max_workers)
+    input_file_name = os.path.join(
+        config['test_data_directory'], 'sample_data.rdf')
+    with open(input_file_name, 'rb') as input_file:
+        entities = extract_entity_info(input_file, plan)
+        while True:
+            # query the entities in batches, concurrently
+            batch = list(itertools.islice(entities, 100 * max_workers))
+            if not batch:
+                break
+            batch_queries = create_batched_queries(
+                lang_list, predicate_url_list,
+                mql_service_url, api_key, [id for id, _ in batch])
+            outcomes = execute_batched_queries(
+                batch_queries, max_workers, session=session, cache=cache)
+            for id, parsed_info in batch:
+                outcome = outcomes[id]
+                print("Entity ID: {}".format(id))
+                if outcome.error is not None:
+                    print_query_error(outcome.error)
+                    sys.exit(2)
+                queried_info = query_result_to_entity_info(
+                    outcome.tuple_list, plan)
+                matching_items, missing_items, extra_items = (
+                    compare_two_lists(queried_info, parsed_info))
+                print("Number of matching items: {}"
+                    .format(len(matching_items)))
+                if len(missing_items) > 0:
+                    print("missing items:")
+                    print('\n'.join([str(mi) for mi in missing_items]))
+                if len(extra_items) > 0:
+                    print("extra items:")
+                    print('\n'.join([str(ei) for ei in extra_items]))
+                print("")
     print("tests ended")
+    if cache is not None:
+        print("response cache: {}".format(cache.stats()))
+        cache.close()
+
+def parse_arguments():
+    """Parses the command line arguments of the test program."""
+    argument_parser = argparse.ArgumentParser(
+        description="Compares parsed sample data with live queries.")
+    argument_parser.add_argument(
+        '--offline', action='store_true',
+        help="serve queries only from the response cache")
+    return argument_parser.parse_args()
                  
-def extract_tuples(rdf_lines, config):
+def extract_entity_info(rdf_lines, plan):
     """
-    Transforms RDF lines into a list of tuples. Keeps only those tuples
-    which meets the criteria specified in the configuration dict.
+    Transforms RDF lines into (entity ID, list of tuples) pairs, where
+    each tuple consists of the language, the predicate ID and the object.
+    Keeps only those tuples which meet the criteria specified in the
+    extraction plan. The lines are read lazily, one entity at a time.
     """
-    localized_triples = []
-    for line in rdf_lines:
-        localized_triple = parse_and_localize(line, config)
-        if localized_triple is not None:
-            localized_triples.append(localized_triple)
-    filtered_triples = filter_triples(localized_triples, config)
-    return filtered_triples
+    for subject, triples in filter_entities(
+            iter_entities(rdf_lines, plan), plan):
+        if not triples: continue
+        yield subject, [(t.lang, t.predicate_id, t.object) for t in triples]
     
 def compare_two_lists(benchmark_list, compared_list):
     """
@@ -79,17 +107,20 @@ def compare_two_lists(benchmark_list, compared_list):
       are missing from the compared list)
     - a list of extra items (those that are not in the original list,
       but are in the compared list)
-    The function does not check for or remove duplicates.
+    The function does not check for or remove duplicates. The items
+    have to be hashable.
     """
+    benchmark_set = set(benchmark_list)
+    compared_set = set(compared_list)
     matching_items = [benchmark_item
         for benchmark_item in benchmark_list
-        if benchmark_item in compared_list]
+        if benchmark_item in compared_set]
     missing_items = [benchmark_item
         for benchmark_item in benchmark_list
-        if benchmark_item not in compared_list]
+        if benchmark_item not in compared_set]
     extra_items = [compared_item
         for compared_item in compared_list
-        if compared_item not in benchmark_list]
+        if compared_item not in benchmark_set]
     return matching_items, missing_items, extra_items
 
 if __name__ == "__main__":
@@ -0,0 +1,54 @@
+"""
+Fourth part of the test suite. Checks that the prefixes of Turtle
+documents are expanded by their longest match, also when prefixes
+overlap, and that literals are left as they are. The prefix index is
+shared by src.freebase.api and src.freebase.turtle.
+"""
+
+import sys
+from src.freebase.api import _replace_prefix
+from src.freebase.turtle import PrefixIndex
+
+_OVERLAPPING_PREFIXES = {
+    'ns:': 'http://rdf.freebase.com/ns/',
+    'ns:m.': 'http://rdf.freebase.com/ns/mid/',
+    'n': 'http://n/',
+    '': 'http://empty/',
+}
+
+# (prefixes, token, expected expansion)
+_CASES = [
+    (_OVERLAPPING_PREFIXES, 'ns:m.0x', 'http://rdf.freebase.com/ns/mid/0x'),
+    (_OVERLAPPING_PREFIXES, 'ns:type.object.name',
+     'http://rdf.freebase.com/ns/type.object.name'),
+    (_OVERLAPPING_PREFIXES, 'ns:m', 'http://rdf.freebase.com/ns/m'),
+    (_OVERLAPPING_PREFIXES, 'nx', 'http://n/x'),
+    (_OVERLAPPING_PREFIXES, 'x:y', 'http://empty/x:y'),
+    (_OVERLAPPING_PREFIXES, 'ns:m.0x\n',
+     'http://rdf.freebase.com/ns/mid/0x'),
+    (_OVERLAPPING_PREFIXES, '"x"@en', '"x"@en'),
+    (_OVERLAPPING_PREFIXES, '"ns:m.0x"', '"ns:m.0x"'),
+    ({'ns:': 'http://ns/'}, '"a"', '"a"'),
+    ({'ns:': 'http://ns/'}, 'xs:a', 'xs:a'),
+]
+
+def main():
+    """
+    Main function of the test program. Expands every token of the test
+    cases with a prefix index of their prefixes, and compares the result
+    with the expected one.
+    """
+    failures = 0
+    for prefixes, token, expected in _CASES:
+        expanded = _replace_prefix(token, PrefixIndex(prefixes))
+        if expanded == expected:
+            print("OK: {!r} -> {!r}".format(token, expanded))
+        else:
+            print("FAILED: {!r} -> {!r}, expected {!r}".format(
+                token, expanded, expected))
+            failures += 1
+    print("tests ended")
+    sys.exit(1 if failures > 0 else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Third part of the test suite. Checks that an extraction run which is
+killed and then resumed from its checkpoint produces the same output as
+an uninterrupted run.
+"""
+
+import filecmp
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from test.synthetic_dump import default_spec, generate_dump
+
+def main():
+    """
+    Main function of the test program. Creates a synthetic dump, both
+    uncompressed and gzip compressed, and extracts each of them twice:
+    once without interruption, and once while killing the extraction a
+    few times and resuming it with --resume. The outputs of the two
+    runs are then compared.
+    """
+    with open('src/config.json', 'r') as config_file:
+        config = json.loads(config_file.read())
+    test_directory = tempfile.mkdtemp()
+    # about a million lines
+    spec = default_spec(25000)
+    dump_file_name = os.path.join(test_directory, 'dump.rdf')
+    gzip_file_name = dump_file_name + '.gz'
+    generate_dump(dump_file_name, spec)
+    generate_dump(gzip_file_name, spec)
+
+    failures = 0
+    for input_file_name in [dump_file_name, gzip_file_name]:
+        print("testing {}".format(input_file_name))
+        config['input_file_name'] = input_file_name
+        reference_file_name = os.path.join(test_directory, 'reference.txt')
+        config['output_file_name'] = reference_file_name
+        _run_extraction(config, test_directory, ['--checkpoint-seconds', '0'])
+
+        output_file_name = os.path.join(test_directory, 'resumed.txt')
+        config['output_file_name'] = output_file_name
+        kills = _run_with_kills(config, test_directory, 3)
+        print("the run was killed {} times".format(kills))
+        if kills == 0:
+            print("the run finished before it could be killed,")
+            print("the test needs a larger dump on this machine")
+        if filecmp.cmp(reference_file_name, output_file_name, shallow=False):
+            print("OK: the outputs are identical")
+        else:
+            print("FAILED: the outputs differ")
+            failures += 1
+        print("")
+    shutil.rmtree(test_directory)
+    print("tests ended")
+    sys.exit(1 if failures > 0 else 0)
+
+def _run_with_kills(config, test_directory, max_kills):
+    """
+    Starts the extraction, kills it shortly after it saved a checkpoint
+    and resumes it, until it was killed max_kills times. Then lets it
+    finish. Returns the number of times the extraction was killed.
+    """
+    checkpoint_file_name = config['output_file_name'] + '.checkpoint'
+    arguments = [
+        '--checkpoint-seconds', '0.2', '--chunk-lines', '20000']
+    kills = 0
+    while kills < max_kills:
+        process = _start_extraction(
+            config, test_directory,
+            arguments + (['--resume'] if kills > 0 else []))
+        checkpoint_time = _wait_for_change(
+            checkpoint_file_name, process)
+        if checkpoint_time is None:
+            return kills
+        time.sleep(0.3)
+        if process.poll() is not None:
+            return kills
+        process.kill()
+        process.wait()
+        kills += 1
+    _run_extraction(config, test_directory, arguments + ['--resume'])
+    return kills
+
+def _wait_for_change(file_name, process):
+    """
+    Waits until a file is written or replaced, or until the process
+    exits. Returns the new modification time, or None if the process
+    exited first.
+    """
+    initial_time = _modification_time(file_name)
+    while process.poll() is None:
+        current_time = _modification_time(file_name)
+        if current_time is not None and current_time != initial_time:
+            return current_time
+        time.sleep(0.01)
+    return None
+
+def _modification_time(file_name):
+    try:
+        return os.stat(file_name).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def _run_extraction(config, test_directory, arguments):
+    process = _start_extraction(config, test_directory, arguments)
+    assert(process.wait() == 0)
+
+def _start_extraction(config, test_directory, arguments):
+    config_file_name = os.path.join(test_directory, 'config.json')
+    with open(config_file_name, 'wt') as config_file:
+        config_file.write(json.dumps(config))
+    return subprocess.Popen(
+        [sys.executable, '-m', 'src.parse_all',
+         '--config', config_file_name] + arguments,
+        stdout=subprocess.DEVNULL)
+
+if __name__ == "__main__":
+    main()
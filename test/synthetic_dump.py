@@ -0,0 +1,335 @@
+"""
+Generates synthetic Freebase data dumps for benchmarks and tests. The
+lines have the shapes of the lines of the Freebase data dumps (see
+data/sample_data.rdf): names, labels and aliases in many languages,
+long descriptions, types, keys, Wikipedia keys and titles with Freebase
+key escapes, web pages and links to other entities. Literals with
+non-ASCII characters are written with the escapes of the dumps (\\xe9,
+\\u1ed5), or as UTF-8 if raw_unicode is set.
+
+The dump is determined by its parameters and the seed: the same
+arguments always produce the same file, also when it is gzip
+compressed.
+
+Run as a program to write a dump, for example:
+python -m test.synthetic_dump /tmp/dump.rdf.gz --entities 100000
+"""
+
+import argparse
+from collections import namedtuple
+import gzip
+import io
+import json
+import random
+
+_NS = 'http://rdf.freebase.com/ns/'
+_KEY = 'http://rdf.freebase.com/key/'
+
+DumpSpec = namedtuple(
+    'DumpSpec',
+    'entity_count, triples_per_entity, predicate_mix, lang_mix, '
+    'unicode_share, topic_share, raw_unicode, seed')
+
+# (predicate URL, shape of the object, weight), after the frequencies of
+# the predicates in the sample data
+DEFAULT_PREDICATE_MIX = [
+    ('<' + _NS + 'type.object.key>', 'key', 12),
+    ('<' + _NS + 'common.topic.topic_equivalent_webpage>', 'webpage', 12),
+    ('<http://www.w3.org/2000/01/rdf-schema#label>', 'text', 5),
+    ('<' + _NS + 'type.object.name>', 'text', 5),
+    ('<' + _NS + 'common.topic.description>', 'description', 5),
+    ('<' + _NS + 'common.topic.alias>', 'text', 1),
+    ('<' + _NS + 'type.object.type>', 'type', 1),
+    ('<' + _NS + 'rdf:type>', 'type', 1),
+    ('<' + _NS + 'astronomy.celestial_object_category.objects>',
+     'link', 4),
+    ('<' + _KEY + 'wikipedia.{lang}>', 'wiki_key', 12),
+    ('<' + _KEY + 'wikipedia.{lang}_id>', 'wiki_id', 3),
+    ('<' + _KEY + 'wikipedia.{lang}_title>', 'wiki_key', 3),
+]
+
+# language codes and weights, after the language tags of the sample data
+DEFAULT_LANG_MIX = {
+    'en': 6, 'de': 3, 'fr': 3, 'es': 3, 'sk': 1, 'ca': 2, 'uk': 2,
+    'zh': 2, 'zh-tw': 1, 'vi': 2, 'tr': 2, 'th': 2, 'sv': 2, 'ar': 2,
+    'fa': 1, 'pl': 2, 'ru': 2, 'ja': 2, 'ko': 1, 'pt': 1,
+}
+
+_TYPES = [
+    ('common.topic', 20),
+    ('astronomy.celestial_object_category', 1),
+    ('base.ontologies.ontology_instance', 1),
+    ('computer.software', 1),
+    ('people.person', 3),
+    ('location.location', 3),
+    ('music.recording', 2),
+]
+
+# ranges of the characters which are used in non-ASCII words
+_SCRIPTS = {
+    'zh': (0x4e00, 0x9fa5), 'zh-tw': (0x4e00, 0x9fa5),
+    'ja': (0x3041, 0x30ff), 'ko': (0xac00, 0xd7a3),
+    'ar': (0x0627, 0x064a), 'fa': (0x0627, 0x064a),
+    'ru': (0x0430, 0x044f), 'uk': (0x0430, 0x044f),
+    'th': (0x0e01, 0x0e30),
+}
+_LATIN_ACCENTS = 'áéíóúýčďěňřšťžäöüßàèìòùâêîôûçñåøłćśźżőűăđơưạảấầẩẫậắằ'
+
+_SYLLABLES = [
+    consonant + vowel
+    for consonant in 'bcdfghklmnprstvz'
+    for vowel in 'aeiou']
+
+def default_spec(entity_count=1000, triples_per_entity=40):
+    """Returns a DumpSpec with the default mixes of the sample data."""
+    return DumpSpec(
+        entity_count=entity_count,
+        triples_per_entity=triples_per_entity,
+        predicate_mix=DEFAULT_PREDICATE_MIX,
+        lang_mix=DEFAULT_LANG_MIX,
+        unicode_share=0.3,
+        topic_share=0.8,
+        raw_unicode=False,
+        seed=0)
+
+def generate_dump(file_name, spec):
+    """
+    Writes a dump as described by a DumpSpec into a file, which is gzip
+    compressed if its name ends with .gz. Returns the number of lines.
+    The entities have between half and one and a half times
+    triples_per_entity lines, and a share of topic_share of them have
+    the type common.topic in addition to their other types.
+    """
+    with open(file_name, 'wb') as raw_file:
+        if file_name.endswith('.gz'):
+            # without the file name and the time in the gzip header, the
+            # compressed file is deterministic as well
+            dump_file = gzip.GzipFile('', 'wb', fileobj=raw_file, mtime=0)
+        else:
+            dump_file = raw_file
+        return _write_lines(dump_file, spec)
+
+def iter_entity_lines(spec):
+    """
+    Yields the lines of every entity of a dump described by a DumpSpec,
+    as lists of strings. This is a generator, so dumps of any size can
+    be generated without holding them in memory.
+    """
+    generator = _LineGenerator(spec)
+    for entity_index in range(spec.entity_count):
+        yield generator.entity_lines(entity_index)
+
+class _LineGenerator:
+
+    def __init__(self, spec):
+        self._spec = spec
+        self._random = random.Random(spec.seed)
+        self._predicates = [p[:2] for p in spec.predicate_mix]
+        self._predicate_weights = [p[2] for p in spec.predicate_mix]
+        self._langs = list(spec.lang_mix.keys())
+        self._lang_weights = list(spec.lang_mix.values())
+        self._types = [t[0] for t in _TYPES]
+        self._type_weights = [t[1] for t in _TYPES]
+
+    def entity_lines(self, entity_index):
+        random_generator = self._random
+        subject = '<{}m.0{}>'.format(_NS, _mid_suffix(entity_index))
+        triples_per_entity = self._spec.triples_per_entity
+        line_count = random_generator.randint(
+            max(1, triples_per_entity // 2),
+            max(1, triples_per_entity * 3 // 2))
+        lines = []
+        if random_generator.random() < self._spec.topic_share:
+            lines.append(_format_line(
+                subject, '<{}type.object.type>'.format(_NS),
+                '<{}common.topic>'.format(_NS)))
+        predicates = random_generator.choices(
+            self._predicates, self._predicate_weights, k=line_count)
+        for predicate, shape in predicates:
+            lang = random_generator.choices(
+                self._langs, self._lang_weights)[0]
+            lines.append(_format_line(
+                subject, predicate.format(lang=lang),
+                self._object(shape, lang)))
+        lines.sort()
+        return lines
+
+    def _object(self, shape, lang):
+        random_generator = self._random
+        if shape == 'text':
+            return self._literal(
+                self._words(random_generator.randint(1, 4), lang), lang)
+        if shape == 'description':
+            return self._literal(
+                self._words(random_generator.randint(30, 90), lang), lang)
+        if shape == 'type':
+            return '<{}{}>'.format(_NS, random_generator.choices(
+                self._types, self._type_weights)[0])
+        if shape == 'key':
+            return '<{}{}.{}>'.format(
+                _NS, lang, self._words(2, 'en').replace(' ', '_'))
+        if shape == 'wiki_key':
+            return '"{}"'.format(_escape_key(
+                self._words(random_generator.randint(1, 3), lang)))
+        if shape == 'wiki_id':
+            return '"{}"'.format(random_generator.randint(1000, 9999999))
+        if shape == 'webpage':
+            return '<http://{}.wikipedia.org/wiki/{}>'.format(
+                lang, self._words(2, 'en').replace(' ', '_'))
+        if shape == 'link':
+            return '<{}m.0{}>'.format(_NS, _mid_suffix(
+                random_generator.randrange(self._spec.entity_count)))
+        raise ValueError("unknown object shape {}".format(shape))
+
+    def _literal(self, text, lang):
+        text = text.replace('\\', '\\\\').replace('"', '\\"')
+        if not self._spec.raw_unicode:
+            text = text.encode('ascii', 'backslashreplace').decode('ascii')
+        return '"{}"@{}'.format(text, lang)
+
+    def _words(self, word_count, lang):
+        random_generator = self._random
+        unicode_word = (
+            random_generator.random() < self._spec.unicode_share)
+        words = []
+        for _ in range(word_count):
+            if unicode_word and lang in _SCRIPTS:
+                first, last = _SCRIPTS[lang]
+                word = ''.join(
+                    chr(random_generator.randint(first, last))
+                    for _ in range(random_generator.randint(1, 4)))
+            else:
+                word = ''.join(random_generator.choices(
+                    _SYLLABLES, k=random_generator.randint(1, 4)))
+                if unicode_word:
+                    position = random_generator.randrange(len(word))
+                    word = (word[:position]
+                        + random_generator.choice(_LATIN_ACCENTS)
+                        + word[position + 1:])
+            words.append(word)
+        words[0] = words[0].capitalize()
+        return ' '.join(words)
+
+def rdf_lines_to_turtle_topics(rdf_lines, topic_size=100):
+    """
+    Formats RDF lines like the topics served by the Freebase RDF API:
+    returns a list of topics, lists of Turtle lines with prefix
+    declarations and up to topic_size statements about a subject, with
+    prefixed names where possible.
+    """
+    prefixes = [
+        ('ns', 'http://rdf.freebase.com/ns/'),
+        ('key', 'http://rdf.freebase.com/key/'),
+        ('rdfs', 'http://www.w3.org/2000/01/rdf-schema#'),
+        ('rdf', 'http://www.w3.org/1999/02/22-rdf-syntax-ns#'),
+    ]
+    prefix_lines = [
+        '@prefix {}: <{}>.'.format(prefix, iri) for prefix, iri in prefixes]
+
+    def shorten(term):
+        for prefix, iri in prefixes:
+            local_name = term[len(iri) + 1:-1]
+            if (term.startswith('<' + iri) and local_name
+                    and all(c.isalnum() or c in '_.' for c in local_name)
+                    and not local_name.endswith('.')):
+                return prefix + ':' + local_name
+        return term
+
+    topics = []
+    for line in rdf_lines:
+        subject, predicate, object = line.split('\t')[:3]
+        if (not topics or topics[-1][1] != subject
+                or len(topics[-1][0]) - len(prefix_lines) - 2 == topic_size):
+            topics.append((prefix_lines + ['', shorten(subject)], subject))
+        topics[-1][0].append('    {}    {};'.format(
+            shorten(predicate), shorten(object)))
+    for topic, _ in topics:
+        topic[-1] = topic[-1][:-1] + '.'
+    return [topic for topic, _ in topics]
+
+def _write_lines(dump_file, spec):
+    text_file = io.TextIOWrapper(dump_file, encoding='utf-8', newline='\n')
+    line_count = 0
+    for lines in iter_entity_lines(spec):
+        text_file.write(''.join(lines))
+        line_count += len(lines)
+    # also finishes the gzip stream, if there is one
+    text_file.close()
+    return line_count
+
+def _mid_suffix(entity_index):
+    # the part of a machine ID after "m.0", in the alphabet of the IDs
+    alphabet = '0123456789bcdfghjklmnpqrstvwxyz_'
+    digits = []
+    entity_index += 32 ** 3
+    while entity_index:
+        entity_index, digit = divmod(entity_index, len(alphabet))
+        digits.append(alphabet[digit])
+    return ''.join(reversed(digits))
+
+def _escape_key(text):
+    # Freebase key escaping: spaces become underscores, and characters
+    # other than ASCII letters, digits and underscores become $XXXX
+    return ''.join(
+        c if (c.isascii() and c.isalnum()) or c == '_'
+        else '${:04X}'.format(ord(c))
+        for c in text.replace(' ', '_'))
+
+def _format_line(subject, predicate, object):
+    return '{}\t{}\t{}\t.\n'.format(subject, predicate, object)
+
+def main():
+    """
+    Main function of the generator. Writes a dump with the parameters
+    given on the command line.
+    """
+    args = _parse_arguments()
+    spec = default_spec(args.entities, args.triples_per_entity)
+    if args.predicate_mix is not None:
+        with open(args.predicate_mix, 'r') as predicate_mix_file:
+            spec = spec._replace(predicate_mix=[
+                tuple(p) for p in json.loads(predicate_mix_file.read())])
+    if args.lang_mix is not None:
+        spec = spec._replace(lang_mix={
+            lang: float(weight)
+            for lang, weight in (
+                pair.split('=') for pair in args.lang_mix.split(','))})
+    spec = spec._replace(
+        unicode_share=args.unicode_share, topic_share=args.topic_share,
+        raw_unicode=args.raw_unicode, seed=args.seed)
+    line_count = generate_dump(args.file_name, spec)
+    print("{} lines written to {}".format(line_count, args.file_name))
+
+def _parse_arguments():
+    argument_parser = argparse.ArgumentParser(
+        description="Generates a synthetic Freebase data dump.")
+    argument_parser.add_argument(
+        'file_name', help="dump file, gzip compressed if it ends with .gz")
+    argument_parser.add_argument(
+        '--entities', type=int, default=1000,
+        help="number of entities (default: 1000)")
+    argument_parser.add_argument(
+        '--triples-per-entity', type=int, default=40,
+        help="average number of lines per entity (default: 40)")
+    argument_parser.add_argument(
+        '--predicate-mix',
+        help="JSON file with a list of [predicate URL, shape, weight]")
+    argument_parser.add_argument(
+        '--lang-mix',
+        help="language weights, for example en=5,de=2,sk=1")
+    argument_parser.add_argument(
+        '--unicode-share', type=float, default=0.3,
+        help="share of literals with non-ASCII characters (default: 0.3)")
+    argument_parser.add_argument(
+        '--topic-share', type=float, default=0.8,
+        help="share of entities of type common.topic (default: 0.8)")
+    argument_parser.add_argument(
+        '--raw-unicode', action='store_true',
+        help="write non-ASCII characters as UTF-8 instead of escapes")
+    argument_parser.add_argument(
+        '--seed', type=int, default=0,
+        help="seed of the random generator (default: 0)")
+    return argument_parser.parse_args()
+
+if __name__ == "__main__":
+    main()
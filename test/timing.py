@@ -0,0 +1,20 @@
+"""
+Timing helpers shared by the benchmarks (test.benchmark and
+test.benchmark_suite).
+"""
+
+import time
+
+def best_time(function, repeat):
+    """
+    Calls a function repeat times, and returns the shortest time of a
+    call in seconds.
+    """
+    best = None
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - begin
+        if best is None or elapsed < best:
+            best = elapsed
+    return best